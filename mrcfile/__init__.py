@@ -15,8 +15,22 @@ Functions
 * :func:`new`: Create a new MRC file.
 * :func:`open`: Open an MRC file.
 * :func:`mmap`: Open a memory-mapped MRC file (fast for large files).
+* :func:`new_mmap`: Create a new, empty memory-mapped MRC file (fast for large
+  files).
+* :func:`reslice`: Copy an MRC file with its data in a different axis order.
+* :func:`bin`: Copy an MRC file with its data binned to a coarser sampling.
+* :func:`preview`: Make a small 8-bit thumbnail image of an MRC file.
+* :func:`to_dask`: Make a :mod:`dask` array which reads an MRC file in chunks.
+* :func:`load_many`: Read the data from many MRC files into one array, in
+  parallel.
 * :func:`validate`: Validate an MRC file (not implemented yet!)
 
+Classes
+-------
+
+* :class:`~mrcfile.virtualstack.VirtualStack`: A lazy, read-only stack of the
+  data from many MRC files.
+
 Basic usage
 -----------
 
@@ -61,15 +75,30 @@ http://www.ccpem.ac.uk/mrc_format/mrc2014.php
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import bz2
+import gzip
 import io
+from multiprocessing.pool import ThreadPool
 import os
+import shutil
+import tempfile
 
+import numpy as np
+
+from . import bricks, chunkstore, pyramid, utils
+from ._opening import _get_mrc_class, _open_source
 from .bzip2mrcfile import Bzip2MrcFile
-from .constants import MRC_FORMAT_VERSION, MAP_ID, MAP_ID_OFFSET_BYTES
+from .constants import MRC_FORMAT_VERSION, STREAM_BLOCK_BYTES, BRICKS_SUFFIX
 from .gzipmrcfile import GzipMrcFile
+from .lazyarrays import FileRegionArray, LazyArray, TransposedArray
 from .mrcfile import MrcFile
 from .mrcmemmap import MrcMemmap
 from .version import __version__
+from .virtualstack import VirtualStack
+
+
+# Number of data sections to check in quick validation mode
+QUICK_VALIDATION_SECTIONS = 20
 
 
 def new(name, data=None, compression=None, overwrite=False):
@@ -113,7 +142,8 @@ def new(name, data=None, compression=None, overwrite=False):
     return mrc
 
 
-def open(name, mode='r', permissive=False):  # @ReservedAssignment
+def open(name, mode='r', permissive=False,  # @ReservedAssignment
+         header_only=False, cache=None):
     """Open an MRC file.
     
     This function opens both normal and compressed MRC files. Supported
@@ -135,6 +165,14 @@ def open(name, mode='r', permissive=False):  # @ReservedAssignment
             file. The default is ``r``.
         permissive: Read the file in permissive mode. The default is
             :data:`False`.
+        header_only: Only read the header (and extended header) from the file.
+            The data block is not read and the :attr:`data` attribute is
+            :data:`None`. The default is :data:`False`.
+        cache: Set to ``'drop'`` to keep the data from filling the operating
+            system's page cache, when the file will only be read once. Parts
+            of the file which have been read are dropped from the cache, and
+            the next part is requested ahead of time when the data is read in
+            blocks. The default is :data:`None`, for normal caching.
     
     Returns:
         An :class:`~mrcfile.mrcfile.MrcFile` object (or a
@@ -158,25 +196,12 @@ def open(name, mode='r', permissive=False):  # @ReservedAssignment
         RuntimeWarning: If the file is not a valid MRC file and ``permissive``
             is :data:`True`.
     """
-    NewMrc = MrcFile
-    if os.path.exists(name):
-        with io.open(name, 'rb') as f:
-            start = f.read(MAP_ID_OFFSET_BYTES + len(MAP_ID))
-        # Check for map ID string to avoid trying to decompress normal files
-        # where the nx value happens to include the magic number for a
-        # compressed format. (This still risks failing to correctly decompress
-        # compressed files which happen to have 'MAP ' at position 208, but
-        # that is less likely and if it does occur, the CompressedMrcFile
-        # class can always be used directly instead.)
-        if start[-len(MAP_ID):] != MAP_ID:
-            if start[:2] == b'\x1f\x8b':
-                NewMrc = GzipMrcFile
-            elif start[:2] == b'BZ':
-                NewMrc = Bzip2MrcFile
-    return NewMrc(name, mode=mode, permissive=permissive)
-
-
-def mmap(name, mode='r', permissive=False):
+    NewMrc = _get_mrc_class(name)
+    return NewMrc(name, mode=mode, permissive=permissive,
+                  header_only=header_only, cache=cache)
+
+
+def mmap(name, mode='r', permissive=False, access=None, window=None):
     """Open a memory-mapped MRC file.
     
     This allows much faster opening of large files, because the data is only
@@ -194,20 +219,633 @@ def mmap(name, mode='r', permissive=False):
         mode: The file mode (one of ``r``, ``r+`` or ``w+``).
         permissive: Read the file in permissive mode. The default is
             :data:`False`.
+        access: A hint about how the data will be accessed: one of
+            ``'sequential'``, ``'random'``, ``'willneed'`` or ``'hugepage'``.
+            The default is :data:`None`, for no hint. See
+            :meth:`MrcMemmap.__init__() <mrcfile.mrcmemmap.MrcMemmap.__init__>`
+            for details.
+        window: The number of sections to map into memory at a time, to keep
+            memory use bounded when reading through very large files. The
+            default is :data:`None`, to map the whole data block.
     
     Returns:
         An :class:`~mrcfile.mrcmemmap.MrcMemmap` object.
     """
-    return MrcMemmap(name, mode=mode, permissive=permissive)
+    return MrcMemmap(name, mode=mode, permissive=permissive, access=access,
+                     window=window)
+
+
+def new_mmap(name, shape, dtype, fill=None, sparse=True, overwrite=False,
+             extended_header_reserve=0):
+    """Create a new, empty memory-mapped MRC file.
+    
+    This function is useful for creating very large files. The header is set up
+    for the given shape and dtype and the data block is allocated on disk, but
+    no data array is created in memory. The data can then be written into the
+    file slice-by-slice through the returned object's memory-mapped
+    :attr:`data` array, or by several processes, each opening the file with
+    :func:`mmap` in ``r+`` mode and writing a different region. The header is
+    written before the new object is returned, so the file can be opened
+    straight away.
+    
+    Unless ``fill`` is given, the data values are initially zero. The header
+    statistics are marked as undetermined, so call
+    :meth:`~mrcfile.mrcobject.MrcObject.update_header_stats` once all of the
+    data has been written.
+    
+    Args:
+        name: The file name to use.
+        shape: The shape of the data array.
+        dtype: The :class:`numpy dtype <numpy.dtype>` of the data array. This
+            must be one of the types which can be stored in an MRC file (see
+            :func:`~mrcfile.utils.mode_from_dtype`).
+        fill: A value to write into every element of the data array. The
+            default is :data:`None`, which leaves the data as zeros without
+            writing to it. Note that filling a very large file can take a long
+            time.
+        sparse: If :data:`True` (the default), the file is simply extended to
+            the right size, which on most file systems creates a sparse file
+            with no disk space used for the data until it is written. If
+            :data:`False`, disk space is reserved for the whole data block
+            immediately, using :func:`os.posix_fallocate` where it is
+            available. This avoids running out of space part-way through
+            writing the data.
+        overwrite: Flag to force overwriting of an existing file. If
+            :data:`False` and a file of the same name already exists, the file
+            is not overwritten and an exception is raised.
+        extended_header_reserve: The number of bytes to reserve for an
+            extended header in front of the data block. An extended header of
+            up to this size can then be added later without moving the data
+            (see :meth:`~mrcfile.mrcobject.MrcObject.set_extended_header`).
+    
+    Returns:
+        A new :class:`~mrcfile.mrcmemmap.MrcMemmap` object, open in ``w+``
+        mode.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If there is no MRC mode for the given
+            dtype.
+        :class:`~exceptions.ValueError`: If the file already exists and
+            ``overwrite`` is :data:`False`.
+    """
+    # Check the dtype before creating the file
+    dtype = np.dtype(dtype)
+    utils.mode_from_dtype(dtype)
+    mrc = MrcMemmap(name, mode='w+', overwrite=overwrite)
+    try:
+        if extended_header_reserve:
+            mrc.set_extended_header(mrc.extended_header,
+                                    reserve=extended_header_reserve)
+        mrc._allocate_data(shape, dtype, sparse=sparse)
+        if fill is not None:
+            for index in utils.block_slices(mrc.data.shape, dtype.itemsize):
+                mrc.data[index] = fill
+        # Write the header now, so the file can be opened by other processes
+        # while this object is still open
+        mrc.flush()
+    except Exception:
+        mrc.close()
+        raise
+    return mrc
+
+
+def reslice(src, dst, order='zxy', overwrite=False,
+            max_bytes=STREAM_BLOCK_BYTES):
+    """Write a copy of an MRC file with its data in a different axis order.
+    
+    Reading planes which cut across the sections of a large volume (for
+    example, XZ or YZ planes from a file in the standard XYZ order) is slow,
+    because the values are widely spaced on disk. If the same kind of plane
+    will be read many times, it is much faster to reslice the file once so
+    that those planes become the sections of the new file.
+    
+    The new file is written through a memory map, one roughly cubic tile at a
+    time (see :func:`~mrcfile.utils.tile_slices`), so memory use is bounded by
+    ``max_bytes`` however large the file is. Uncompressed source files are
+    memory-mapped; compressed files are decompressed into memory first.
+    
+    The header's ``mapc``, ``mapr`` and ``maps`` fields are set to the new
+    axis order, and the dimension and ``nxstart``/``nystart``/``nzstart``
+    fields are permuted to match. Fields which describe the X, Y and Z axes
+    (the cell size and angles, grid sampling and origin) are unchanged, as are
+    the labels, data statistics and extended header. Packed 4-bit and
+    quantised data is written unpacked, as uint8 or float32 values.
+    
+    Args:
+        src: The name of the file to read.
+        dst: The name of the new file.
+        order: The new axis order, as a string of the letters ``x``, ``y``
+            and ``z`` giving the axes of the columns, rows and sections of the
+            new file. The default is ``'zxy'``, which puts the sections along
+            Y, so each section is an XZ plane. Use ``'yzx'`` for YZ planes, or
+            ``'xyz'`` to restore the standard order.
+        overwrite: Flag to force overwriting of an existing file. If
+            :data:`False` and a file called ``dst`` already exists, it is not
+            overwritten and an exception is raised.
+        max_bytes: The maximum number of bytes to copy at a time.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If ``order`` is not a permutation of
+            ``'xyz'``, the source file's axis mapping is invalid, or the data
+            is 2D and the new order has a different section axis.
+        :class:`~exceptions.ValueError`: If the file ``dst`` already exists
+            and ``overwrite`` is :data:`False`.
+    """
+    with _open_source(src) as src_mrc:
+        src_header = src_mrc.header
+        data = src_mrc.data
+        src_order = utils.axis_order_from_header(src_header)
+        axes = utils.transpose_axes(src_order, order, data.ndim)
+        if isinstance(data, LazyArray):
+            resliced = TransposedArray(data, axes)
+        else:
+            resliced = np.transpose(data, axes)
+        
+        with MrcMemmap(dst, mode='w+', overwrite=overwrite) as dst_mrc:
+            dst_mrc.set_extended_header(np.array(src_mrc.extended_header))
+            dst_mrc._allocate_data(resliced.shape, resliced.dtype)
+            _copy_resliced_header(src_header, dst_mrc.header, src_order,
+                                  order.lower())
+            for index in utils.tile_slices(resliced.shape,
+                                           resliced.dtype.itemsize,
+                                           max_bytes):
+                dst_mrc.data[index] = resliced[index]
+
+
+def _copy_resliced_header(src_header, dst_header, src_order, order):
+    """Copy header fields from a file to a resliced copy of it.
+    
+    The destination header must already have the right mode and dimensions.
+    Fields which refer to the columns, rows and sections are permuted to the
+    new axis order, and fields which refer to the X, Y and Z axes are copied
+    directly.
+    """
+    for field in ['ispg', 'cella', 'cellb', 'origin', 'exttyp', 'nversion',
+                  'dmin', 'dmax', 'dmean', 'rms', 'nlabl', 'label']:
+        dst_header[field] = src_header[field]
+    if not utils.spacegroup_is_volume_stack(dst_header.ispg):
+        # For volume stacks, mz is the number of sections in each volume
+        for field in ['mx', 'my', 'mz']:
+            dst_header[field] = src_header[field]
+    start_fields = ['nxstart', 'nystart', 'nzstart']
+    for field, axis in zip(start_fields, order):
+        dst_header[field] = src_header[start_fields[src_order.index(axis)]]
+    utils.set_header_axis_order(dst_header, order)
+
+
+def bin(src, dst, factor=2, method='mean',  # @ReservedAssignment
+        compression=None, overwrite=False, max_bytes=STREAM_BLOCK_BYTES):
+    """Write a copy of an MRC file with its data binned to a coarser sampling.
+    
+    Each bin of ``bz`` sections by ``by`` rows by ``bx`` columns is reduced to
+    a single voxel. The source is read a block of at most ``max_bytes`` at a
+    time, and each section is binned along Y and X as soon as it is read, so
+    only the much smaller binned sections are kept until they can be binned
+    along Z and written to the new file. Memory use is therefore bounded
+    however large the file is. This works in the same way for compressed
+    source files, which are decompressed as they are read.
+    
+    Items at the end of an axis which do not fill a whole bin are left out.
+    The new file's voxel size is scaled by the binning factors, and its
+    ``mx``, ``my`` and ``mz`` fields and cell dimensions are set to match the
+    new sampling. The origin, space group and labels are copied, and the
+    ``nxstart``, ``nystart`` and ``nzstart`` fields are divided by the
+    binning factors. The extended header (with the ``exttyp``, ``nint`` and
+    ``nreal`` fields which describe it) is copied only if sections are not
+    binned together, since it often holds metadata for each section.
+    
+    Args:
+        src: The name of the file to read.
+        dst: The name of the new file.
+        factor: The binning factor, either as a single number for all three
+            axes or as a tuple ``(bz, by, bx)``. To bin the images of an image
+            stack or a movie without combining them, use ``(1, b, b)``. For
+            2D data, ``bz`` must be 1 (or a single number may be given, which
+            is applied to X and Y). For volume stacks, each volume is binned
+            separately. The default is 2.
+        method: The reduction to use for each bin: ``'mean'`` (the default),
+            ``'sum'``, ``'max'`` or ``'min'``. Means and sums are stored as
+            float32 values; maxima and minima keep the data type of the
+            source's data array (float32, for quantised data).
+        compression: The compression format to use for the new file:
+            :data:`None` (the default; for no compression), ``'gzip'`` or
+            ``'bzip2'``. Compressed files are first written uncompressed to a
+            temporary file next to ``dst``, which is then compressed a block
+            at a time and deleted.
+        overwrite: Flag to force overwriting of an existing file. If
+            :data:`False` and a file called ``dst`` already exists, it is not
+            overwritten and an exception is raised.
+        max_bytes: The maximum number of bytes of source data to read at a
+            time. At least one section is always read.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the binning factors or method are
+            not valid, or the data is too small for the binning factors.
+        :class:`~exceptions.ValueError`: If the compression format is not
+            recognised.
+        :class:`~exceptions.ValueError`: If the file ``dst`` already exists
+            and ``overwrite`` is :data:`False`.
+    """
+    if compression == 'gzip':
+        open_compressed = gzip.open
+    elif compression == 'bzip2':
+        open_compressed = bz2.BZ2File
+    elif compression is not None:
+        raise ValueError("Unknown compression format '{0}'"
+                         .format(compression))
+    if os.path.exists(dst) and not overwrite:
+        raise ValueError("File '{0}' already exists; set overwrite=True "
+                         "to overwrite it".format(dst))
+    try:
+        factors = (int(factor),) * 3
+    except TypeError:
+        factors = tuple(int(f) for f in factor)
+    if len(factors) != 3 or min(factors) < 1:
+        raise ValueError("Binning factor must be a positive integer or a "
+                         "tuple of three positive integers")
+    
+    with open(src, header_only=True) as src_mrc:
+        shape = utils.data_shape_from_header(src_mrc.header)
+        if len(shape) == 2:
+            if factors[0] != 1 and not np.isscalar(factor):
+                raise ValueError("2D data cannot be binned along Z")
+            factors = (1,) + factors[1:]
+        data_factors = ((1,) * len(shape) + factors)[-len(shape):]
+        out_shape = tuple(length // f
+                          for length, f in zip(shape, data_factors))
+        if min(out_shape) < 1:
+            raise ValueError("Data of shape {0} is too small to bin by {1}"
+                             .format(shape, factors))
+        out_dtype = utils.binned_dtype(utils.loaded_dtype_from_header(
+            src_mrc.header), method)
+        
+        if compression is None:
+            target = dst
+        else:
+            fd, target = tempfile.mkstemp(suffix='.mrc',
+                                          dir=os.path.dirname(dst) or '.')
+            os.close(fd)
+        try:
+            with MrcMemmap(target, mode='w+', overwrite=True) as dst_mrc:
+                dst_mrc.header.ispg = src_mrc.header.ispg
+                if factors[0] == 1:
+                    dst_mrc.set_extended_header(
+                        np.array(src_mrc.extended_header))
+                dst_mrc._allocate_data(out_shape, out_dtype)
+                _copy_binned_header(src_mrc, dst_mrc, factors)
+                _write_binned_sections(src_mrc, dst_mrc, shape, factors,
+                                       method, max_bytes)
+                dst_mrc.update_header_stats()
+            if compression is not None:
+                with io.open(target, 'rb') as f_in:
+                    with open_compressed(dst, 'wb') as f_out:
+                        shutil.copyfileobj(f_in, f_out, STREAM_BLOCK_BYTES)
+        finally:
+            if compression is not None and os.path.exists(target):
+                os.remove(target)
+
+
+def _write_binned_sections(src_mrc, dst_mrc, shape, factors, method,
+                           max_bytes):
+    """Stream the sections of a file, bin them and write them to a new file.
+    
+    Each section is binned in Y and X as soon as it is read, and only the
+    binned sections are kept until there are enough to bin along Z. Sections
+    left over at the end of each volume are skipped.
+    """
+    bz = factors[0]
+    sections_per_volume = shape[-3] if len(shape) > 2 else 1
+    used_sections = sections_per_volume // bz * bz
+    out_sections = dst_mrc.data.reshape((-1,) + dst_mrc.data.shape[-2:])
+    pending = []
+    index = written = 0
+    for block in src_mrc._iter_section_blocks(max_bytes):
+        for section in block:
+            if index % sections_per_volume < used_sections:
+                pending.append(utils.bin_data(section, factors[1:], method))
+            index += 1
+            if len(pending) == bz:
+                binned = utils.bin_data(np.stack(pending), (bz, 1, 1), method)
+                out_sections[written] = binned[0]
+                written += 1
+                pending = []
 
 
-def validate(name, print_file=None):
+def _copy_binned_header(src_mrc, dst_mrc, factors):
+    """Copy header fields from a file to a binned copy of it.
+    
+    The destination must already have its data allocated, so the mode and
+    dimensions are set. The voxel size is scaled by the binning factors
+    (given in ``(z, y, x)`` order), and the start indices are divided by
+    them.
+    """
+    src_header = src_mrc.header
+    dst_header = dst_mrc.header
+    for field in ['cellb', 'origin', 'mapc', 'mapr', 'maps', 'nversion',
+                  'nlabl', 'label']:
+        dst_header[field] = src_header[field]
+    if dst_header.nsymbt > 0:
+        # The extended header was copied, so copy the fields which describe it
+        dst_header.exttyp = src_header.exttyp
+        src_fields = utils.imod_header_fields(src_header)
+        dst_fields = utils.imod_header_fields(dst_header)
+        dst_fields.nint = src_fields.nint
+        dst_fields.nreal = src_fields.nreal
+    # The factors apply to the columns, rows and sections, which might not be
+    # along X, Y and Z
+    order = utils.axis_order_from_header(src_header)
+    axis_factors = dict(zip(order, factors[::-1]))
+    voxel_size = src_mrc.voxel_size
+    dst_mrc.voxel_size = (voxel_size.x * axis_factors['x'],
+                          voxel_size.y * axis_factors['y'],
+                          voxel_size.z * axis_factors['z'])
+    for field, f in zip(['nxstart', 'nystart', 'nzstart'], factors[::-1]):
+        dst_header[field] = src_header[field] // f
+
+
+def preview(name, max_size=512, projection=None, output=None,
+            overwrite=False):
+    """Make a small 8-bit thumbnail image of an MRC file.
+    
+    Only the values needed for the thumbnail are read: uncompressed files are
+    memory-mapped and sampled with a stride, so only every ``n``-th row of
+    the chosen sections is read from disk, however large the file is.
+    (Compressed files must still be decompressed.)
+    
+    By default the thumbnail is the central section of the volume (or the
+    central image of an image stack, or the central section of the central
+    volume of a volume stack). Alternatively, a number of evenly spaced
+    sections can be sampled and averaged to give a rough projection.
+    
+    The values are scaled to the range 0-255 using the ``dmin`` and ``dmax``
+    values from the header if they are valid, so thumbnails of different parts
+    of a data set are on the same scale. Otherwise, the range of the sampled
+    values is used. Complex data is shown as its amplitude, scaled by the range
+    of the sampled amplitudes (the header values describe the real part, not
+    the amplitude).
+    
+    Args:
+        name: The name of the MRC file.
+        max_size: The maximum length of each side of the thumbnail. The
+            sampling stride is the same along both axes, so the thumbnail has
+            the same aspect ratio as the data. The default is 512.
+        projection: The number of sections to average, taken from the middle
+            of equal slabs through the volume. The default is :data:`None`,
+            to use only the central section.
+        output: The name of a file to write the thumbnail to, or :data:`None`
+            (the default) to skip writing a file. Names ending in ``.pgm`` are
+            written as binary PGM images, which most image viewers and
+            libraries can read; anything else is written as raw bytes, one
+            per pixel in row order, with the first row at the bottom of the
+            image as in the MRC file.
+        overwrite: Flag to force overwriting of an existing output file. If
+            :data:`False` and the file already exists, an exception is raised.
+    
+    Returns:
+        The thumbnail, as a 2D :class:`numpy array <numpy.ndarray>` of uint8
+        values.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If ``max_size`` or ``projection`` is
+            less than 1.
+        :class:`~exceptions.ValueError`: If the output file already exists and
+            ``overwrite`` is :data:`False`.
+    """
+    if max_size < 1:
+        raise ValueError("Thumbnail size must be at least 1")
+    if projection is not None and projection < 1:
+        raise ValueError("Number of projected sections must be at least 1")
+    if output is not None and os.path.exists(output) and not overwrite:
+        raise ValueError("File '{0}' already exists; set overwrite=True "
+                         "to overwrite it".format(output))
+    with _open_source(name) as mrc:
+        data = mrc.data
+        if data.ndim == 4:
+            data = data[data.shape[0] // 2]
+        step = max(1, -(-max(data.shape[-2:]) // max_size))
+        if data.ndim == 2:
+            sections = [data]
+        elif projection is None:
+            sections = [data[data.shape[0] // 2]]
+        else:
+            # Take the section at the middle of each of equal slabs
+            count = min(projection, data.shape[0])
+            indices = (np.arange(count) + 0.5) * data.shape[0] // count
+            sections = [data[int(index)] for index in indices]
+        image = np.zeros(((data.shape[-2] + step - 1) // step,
+                          (data.shape[-1] + step - 1) // step),
+                         dtype=np.float32)
+        for section in sections:
+            sample = np.asarray(section[::step, ::step])
+            if np.iscomplexobj(sample):
+                sample = np.abs(sample)
+            image += sample
+        image /= len(sections)
+        
+        low, high = float(mrc.header.dmin), float(mrc.header.dmax)
+        if (np.dtype(data.dtype).kind == 'c'
+                or not (np.isfinite([low, high]).all() and low < high)):
+            low, high = float(image.min()), float(image.max())
+    if high > low:
+        image = (image - low) * (255.0 / (high - low))
+    else:
+        image[...] = 0
+    thumbnail = np.rint(np.clip(image, 0, 255)).astype(np.uint8)
+    
+    if output is not None:
+        with io.open(output, 'wb') as f:
+            if output.lower().endswith('.pgm'):
+                # PGM images start at the top row
+                f.write('P5\n{0} {1}\n255\n'.format(thumbnail.shape[1],
+                                                     thumbnail.shape[0])
+                        .encode('ascii'))
+                f.write(thumbnail[::-1].tobytes())
+            else:
+                f.write(thumbnail.tobytes())
+    return thumbnail
+
+
+def to_dask(name, chunks=None, sidecar=None):
+    """Make a :mod:`dask` array which reads an MRC file in chunks.
+    
+    Only the header is read when the array is created. Each chunk of the dask
+    array is read separately from the file when it is computed (see
+    :class:`~mrcfile.lazyarrays.FileRegionArray`), so the tasks of a
+    distributed computation each read only their own part of the data.
+    
+    Compressed files cannot be read from an arbitrary position, so they can
+    only be used if they have a bricked sidecar file (see
+    :mod:`mrcfile.bricks`). In that case the chunks are best aligned with the
+    bricks, and by default they are the same shape as the bricks.
+    
+    dask is not a requirement of ``mrcfile``, so it must be installed
+    separately to use this function.
+    
+    Args:
+        name: The name of the MRC file.
+        chunks: The chunk shape to use, in any form accepted by
+            :func:`dask.array.from_array`. The default is :data:`None`, which
+            gives chunks of whole sections totalling about
+            :data:`~mrcfile.constants.STREAM_BLOCK_BYTES` each (or the brick
+            shape, if the data is read from a sidecar file).
+        sidecar: The name of a bricked sidecar file to read the data from.
+            The default is :data:`None`, which reads uncompressed files
+            directly and compressed files from a sidecar file with the default
+            name (the file name with ``.bricks`` appended).
+    
+    Returns:
+        A :class:`dask array <dask.array.Array>` of the file's data.
+    
+    Raises:
+        :class:`~exceptions.ImportError`: If dask is not installed.
+        :class:`~exceptions.ValueError`: If the file is compressed and has no
+            bricked sidecar file.
+    """
+    try:
+        import dask.array
+    except ImportError:
+        raise ImportError("to_dask() requires dask; install it with "
+                          "'pip install dask[array]'")
+    
+    with open(name, header_only=True) as mrc:
+        header = mrc.header
+        shape = utils.data_shape_from_header(header)
+        dtype = utils.loaded_dtype_from_header(header)
+    
+    if sidecar is None and _get_mrc_class(name) is not MrcFile:
+        sidecar = name + BRICKS_SUFFIX
+        if not os.path.exists(sidecar):
+            raise ValueError("Compressed file '{0}' has no bricked sidecar "
+                             "file; create one with mrcfile.bricks.build() "
+                             "to read it in chunks".format(name))
+    if chunks is None and sidecar is not None:
+        with bricks.BrickedReader(name, sidecar=sidecar) as reader:
+            chunks = reader.brick_shape
+    elif chunks is None:
+        chunks = _section_chunks(shape, dtype.itemsize)
+    return dask.array.from_array(FileRegionArray(name, shape, dtype, sidecar),
+                                 chunks=chunks)
+
+
+def _section_chunks(shape, itemsize, max_bytes=STREAM_BLOCK_BYTES):
+    """Return a chunk shape of whole sections totalling about ``max_bytes``.
+    
+    For volume stacks, a chunk holds whole volumes if more than one volume
+    fits in ``max_bytes``.
+    """
+    if len(shape) == 2:
+        return shape
+    section_nbytes = itemsize * shape[-2] * shape[-1]
+    count = max(1, max_bytes // max(1, section_nbytes))
+    if len(shape) == 3 or count < shape[1]:
+        return (1,) * (len(shape) - 3) + (min(count, shape[-3]),) + shape[-2:]
+    return (min(count // shape[1], shape[0]),) + shape[1:]
+
+
+def load_many(paths, workers=None, out=None):
+    """Read the data from many MRC files into one array, in parallel.
+    
+    All of the files must have data of the same shape. A single array is
+    allocated (unless one is given), with a new first axis for the files, and
+    each file's data is read straight into its place in the array, without
+    any intermediate copy. The files are read by a pool of threads: reading
+    and decompressing the data (:mod:`zlib` and :mod:`bz2` both release the
+    GIL while they work) can then run at the same time for different files,
+    and much of the time spent waiting for each file is overlapped.
+    
+    Every file's header is checked before any data is read, so if a file does
+    not match, an exception is raised before ``out`` is changed.
+    
+    Args:
+        paths: The names of the MRC files, in order.
+        workers: The number of threads to use. The default is :data:`None`,
+            which uses one thread for each CPU.
+        out: An array to read the data into, of shape ``(len(paths),) +
+            data_shape``. The default is :data:`None`, which allocates a new
+            array with the data's dtype. (The first file's header gives the
+            data shape and dtype.) If an array is given, the data is converted
+            to the array's dtype as it is copied in.
+    
+    Returns:
+        The filled array.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If there are no files, or a file's
+            data is not the same shape and dtype as the first file's.
+        :class:`~exceptions.ValueError`: If ``out`` is the wrong shape.
+    """
+    paths = list(paths)
+    if not paths:
+        raise ValueError("No files were given")
+    with _get_mrc_class(paths[0])(paths[0], header_only=True) as mrc:
+        shape = utils.data_shape_from_header(mrc.header)
+        dtype = utils.loaded_dtype_from_header(mrc.header)
+    if out is None:
+        out = np.empty((len(paths),) + shape, dtype=dtype)
+    elif out.shape != (len(paths),) + shape:
+        raise ValueError("Output array has shape {0}, but the data needs "
+                         "shape {1}".format(out.shape,
+                                            (len(paths),) + shape))
+    for name in paths[1:]:
+        _check_data_header(name, shape, dtype)
+    
+    def load(position):
+        _load_into(paths[position], out[position], shape, dtype)
+    
+    pool = ThreadPool(workers)
+    try:
+        pool.map(load, range(len(paths)))
+    finally:
+        pool.close()
+        pool.join()
+    return out
+
+
+def _check_data_header(name, shape, dtype):
+    """Check that an MRC file holds data of the expected shape and dtype.
+    
+    Only the file's header is read.
+    """
+    with _get_mrc_class(name)(name, header_only=True) as mrc:
+        file_shape = utils.data_shape_from_header(mrc.header)
+        file_dtype = utils.loaded_dtype_from_header(mrc.header)
+    if file_shape != shape or file_dtype != dtype:
+        raise ValueError("File '{0}' has data of shape {1} and dtype '{2}', "
+                         "but expected shape {3} and dtype '{4}'"
+                         .format(name, file_shape, file_dtype, shape, dtype))
+
+
+def _load_into(name, out, shape, dtype):
+    """Read the data from an MRC file into an existing array.
+    
+    The file's header must already have been checked with
+    :func:`_check_data_header`. The data is streamed from the file in blocks
+    of sections, which are copied into ``out`` as they are read.
+    """
+    with _get_mrc_class(name)(name, header_only=True) as mrc:
+        leading_shape = shape[:-2]
+        start = 0
+        for block in mrc._iter_section_blocks():
+            for offset, section in enumerate(block):
+                if leading_shape:
+                    index = np.unravel_index(start + offset, leading_shape)
+                    out[index] = section
+                else:
+                    out[...] = section
+            start += len(block)
+
+
+def validate(name, print_file=None, quick=False):
     """Validate an MRC file.
     
-    This function first opens the file by calling :func:`open` (with
-    ``permissive=True``), then calls :meth:`~mrcfile.mrcfile.MrcFile.validate`,
-    which runs a series of tests to check whether the file complies with the
-    MRC2014 format specification.
+    This function first opens the file in permissive mode, then calls
+    :meth:`~mrcfile.mrcfile.MrcFile.validate`, which runs a series of tests to
+    check whether the file complies with the MRC2014 format specification.
+    
+    Memory use is bounded regardless of the size of the file. Uncompressed
+    files are opened with :func:`mmap`, and compressed files are opened with
+    ``header_only=True`` and then decompressed a block at a time to check the
+    data statistics and file size.
     
     If the file is completely valid, this function returns :data:`True`,
     otherwise it returns :data:`False`. Messages explaining the validation
@@ -220,8 +858,18 @@ def validate(name, print_file=None):
     documentation of the :mod:`warnings` module for information on how to
     suppress or capture warning output.
     
-    Because the file is opened by calling :func:`open`, gzip- and
-    bzip2-compressed MRC files can be validated easily using this function.
+    Gzip- and bzip2-compressed MRC files can be validated easily using this
+    function.
+    
+    For fast checking of large numbers of files, set ``quick`` to :data:`True`.
+    In quick mode, only the header and a random sample of the data sections of
+    uncompressed files are read from disk, and the data statistics are
+    estimated from the sampled sections (see
+    :meth:`MrcObject.validate() <mrcfile.mrcobject.MrcObject.validate>` for
+    details). The header is still checked exactly, and the file size is still
+    checked against the size expected from the header. Files which pass the
+    quick checks are very likely to be valid, but an exact validation should be
+    run to confirm any problems that are found.
     
     After the file has been opened, it is checked for problems. The tests are:
     
@@ -231,7 +879,7 @@ def validate(name, print_file=None):
        ``0x44 0x44 0x00 0x00``, ``0x44 0x41 0x00 0x00`` or
        ``0x11 0x11 0x00 0x00``.
     #. MRC mode: the ``mode`` field should be one of the supported mode
-       numbers: 0, 1, 2, 4 or 6.
+       numbers: 0, 1, 2, 4, 6 or 12.
     #. Map and cell dimensions: The header fields ``nx``, ``ny``, ``nz``,
        ``mx``, ``my``, ``mz``, ``cella.x``, ``cella.y`` and ``cella.z`` must
        all be positive numbers.
@@ -258,6 +906,8 @@ def validate(name, print_file=None):
             the validation. This is passed directly to the ``file`` argument of
             Python's :func:`print` function. The default is :data:`None`, which
             means output will be printed to :data:`sys.stdout`.
+        quick: Estimate the data statistics from a sample of sections rather
+            than checking all of the data. The default is :data:`False`.
     
     Returns:
         :data:`True` if the file is valid, or :data:`False` if the file does
@@ -272,5 +922,12 @@ def validate(name, print_file=None):
             ID string, an incorrect machine stamp, an unknown mode number, or
             is not the same size as expected from the header.
     """
-    with open(name, permissive=True) as mrc:
+    NewMrc = _get_mrc_class(name)
+    if NewMrc is MrcFile:
+        sample = QUICK_VALIDATION_SECTIONS if quick else None
+        with MrcMemmap(name, permissive=True) as mrc:
+            return mrc.validate(print_file=print_file, sample=sample)
+    
+    # Compressed files cannot be sampled, so stream through all of the data
+    with NewMrc(name, permissive=True, header_only=True) as mrc:
         return mrc.validate(print_file=print_file)
@@ -0,0 +1,65 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+"""
+_opening
+--------
+
+Internal helpers for choosing the class used to open an existing MRC file.
+
+These are kept out of the package's ``__init__`` so that the modules which the
+package imports (such as :mod:`~mrcfile.bricks` and :mod:`~mrcfile.pyramid`)
+can use them too.
+
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import os
+
+from .bzip2mrcfile import Bzip2MrcFile
+from .constants import MAP_ID, MAP_ID_OFFSET_BYTES
+from .gzipmrcfile import GzipMrcFile
+from .mrcfile import MrcFile
+from .mrcmemmap import MrcMemmap
+
+
+def _get_mrc_class(name):
+    """Return the class to use to open the named file.
+    
+    This is :class:`~mrcfile.mrcfile.MrcFile` unless the file exists and is
+    compressed, in which case the appropriate compressed file class is
+    returned.
+    """
+    NewMrc = MrcFile
+    if os.path.exists(name):
+        with io.open(name, 'rb') as f:
+            start = f.read(MAP_ID_OFFSET_BYTES + len(MAP_ID))
+        # Check for map ID string to avoid trying to decompress normal files
+        # where the nx value happens to include the magic number for a
+        # compressed format. (This still risks failing to correctly decompress
+        # compressed files which happen to have 'MAP ' at position 208, but
+        # that is less likely and if it does occur, the CompressedMrcFile
+        # class can always be used directly instead.)
+        if start[-len(MAP_ID):] != MAP_ID:
+            if start[:2] == b'\x1f\x8b':
+                NewMrc = GzipMrcFile
+            elif start[:2] == b'BZ':
+                NewMrc = Bzip2MrcFile
+    return NewMrc
+
+
+def _open_source(name):
+    """Open an existing file to read its data a part at a time.
+    
+    Uncompressed files are opened read-only with
+    :class:`~mrcfile.mrcmemmap.MrcMemmap`, so only the parts of the data which
+    are used are read from disk. Compressed files cannot be memory-mapped, and
+    are opened normally (so the whole data block is decompressed into memory).
+    """
+    NewMrc = _get_mrc_class(name)
+    if NewMrc is MrcFile:
+        return MrcMemmap(name)
+    return NewMrc(name)
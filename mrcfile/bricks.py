@@ -0,0 +1,387 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+"""
+bricks
+------
+
+Bricked sidecar files, for fast reading of any region of a large MRC file.
+
+The data in an MRC file is stored in C order, so whole sections can be read
+quickly but planes along the other axes, and small subvolumes, are scattered
+through the file. A bricked sidecar file holds a second copy of the data,
+divided into small bricks (cubes of 64 voxels along each side by default) which
+are each stored contiguously, and optionally compressed, with an index giving
+the position of each brick. Any region of the data can then be read by
+fetching only the bricks it touches.
+
+The MRC file is always the master copy of the data: the sidecar file is only
+an index for fast reading. It records the size and modification time of the
+MRC file, and by default is rejected if the MRC file has changed since the
+sidecar was built.
+
+The sidecar file starts with a header (see
+:data:`~mrcfile.dtypes.BRICKS_HEADER_DTYPE`), followed by an index with one
+entry per brick (see :data:`~mrcfile.dtypes.BRICK_INDEX_DTYPE`), in C order
+over the grid of bricks, and then the bricks themselves. Each brick is stored
+as the raw bytes of a C-ordered array in the data's dtype, compressed with
+:mod:`zlib` or :mod:`bz2` if requested. Bricks at the high end of each axis are
+cut short to fit the data.
+
+Functions:
+    :func:`build`: Write a bricked sidecar file for an MRC file.
+
+Classes:
+    :class:`BrickedReader`: Read regions of data from a bricked sidecar file.
+    :class:`BrickedArray`: An array-like view of bricked data, which reads
+    bricks on demand.
+
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import bz2
+from collections import OrderedDict
+import io
+import itertools
+import os
+import zlib
+
+import numpy as np
+
+from ._opening import _open_source
+from .constants import BRICKS_MAGIC, BRICKS_FORMAT_VERSION, BRICKS_SUFFIX
+from .dtypes import BRICKS_HEADER_DTYPE, BRICK_INDEX_DTYPE
+from .lazyarrays import LazyArray
+
+
+# Functions to compress and decompress each brick, for each compression format
+_CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'bzip2': (bz2.compress, bz2.decompress),
+}
+
+# Default number of decompressed bricks to keep in memory in a BrickedReader
+DEFAULT_CACHED_BRICKS = 64
+
+
+def build(name, brick=64, compression=None, sidecar=None, overwrite=False):
+    """Write a bricked sidecar file for an MRC file.
+    
+    The data is read from the MRC file one brick at a time (uncompressed MRC
+    files are memory-mapped), so memory use is bounded by the brick size.
+    
+    Args:
+        name: The name of the MRC file.
+        brick: The length of each side of a brick, as a single integer or a
+            tuple with one value for each axis of the data. The default is
+            64.
+        compression: The compression format to use for each brick: ``'zlib'``,
+            ``'bzip2'`` or :data:`None` (the default) for no compression.
+        sidecar: The name of the sidecar file. The default is the name of the
+            MRC file with ``.bricks`` appended.
+        overwrite: Flag to force overwriting of an existing sidecar file. If
+            :data:`False` and the sidecar file already exists, an exception is
+            raised.
+    
+    Returns:
+        The name of the sidecar file.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the compression format is not
+            recognised, or the brick size is invalid.
+        :class:`~exceptions.ValueError`: If the sidecar file already exists
+            and ``overwrite`` is :data:`False`.
+    """
+    if compression is not None and compression not in _CODECS:
+        raise ValueError("Unknown compression format '{0}'"
+                         .format(compression))
+    if sidecar is None:
+        sidecar = name + BRICKS_SUFFIX
+    if os.path.exists(sidecar) and not overwrite:
+        raise ValueError("File '{0}' already exists; set overwrite=True "
+                         "to overwrite it".format(sidecar))
+    
+    source_stat = os.stat(name)
+    with _open_source(name) as mrc:
+        data = mrc.data
+        brick_shape = _brick_shape(brick, data.ndim)
+        grid = _grid_shape(data.shape, brick_shape)
+        
+        header = np.zeros((), dtype=BRICKS_HEADER_DTYPE)
+        header['magic'] = BRICKS_MAGIC
+        header['version'] = BRICKS_FORMAT_VERSION
+        header['ndim'] = data.ndim
+        header['shape'][:data.ndim] = data.shape
+        header['brick_shape'][:data.ndim] = brick_shape
+        header['dtype'] = data.dtype.str.encode('ascii')
+        header['compression'] = (compression or '').encode('ascii')
+        header['source_size'] = source_stat.st_size
+        header['source_mtime'] = source_stat.st_mtime
+        index = np.zeros(int(np.prod(grid)), dtype=BRICK_INDEX_DTYPE)
+        
+        try:
+            with io.open(sidecar, 'wb') as sidecar_file:
+                sidecar_file.write(header.tobytes())
+                # Leave space for the index, which is written at the end
+                sidecar_file.write(index.tobytes())
+                offset = sidecar_file.tell()
+                for position, brick_index in enumerate(np.ndindex(*grid)):
+                    region = tuple(slice(number * size, (number + 1) * size)
+                                   for number, size in zip(brick_index,
+                                                           brick_shape))
+                    values = np.ascontiguousarray(data[region])
+                    payload = values.tobytes()
+                    if compression is not None:
+                        payload = _CODECS[compression][0](payload)
+                    sidecar_file.write(payload)
+                    index[position] = (offset, len(payload))
+                    offset += len(payload)
+                sidecar_file.seek(header.nbytes)
+                sidecar_file.write(index.tobytes())
+        except Exception:
+            # Don't leave an incomplete sidecar file behind
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+            raise
+    return sidecar
+
+
+def _brick_shape(brick, ndim):
+    """Convert a brick size argument to a tuple with one value per axis."""
+    try:
+        brick_shape = (int(brick),) * ndim
+    except TypeError:
+        brick_shape = tuple(int(size) for size in brick)
+    if len(brick_shape) != ndim or min(brick_shape) < 1:
+        raise ValueError("Brick size {0} is not valid for {1}-dimensional "
+                         "data".format(brick, ndim))
+    return brick_shape
+
+
+def _grid_shape(shape, brick_shape):
+    """Return the number of bricks along each axis."""
+    return tuple(-(-length // size) for length, size in zip(shape,
+                                                            brick_shape))
+
+
+class BrickedReader(object):
+    
+    """Read regions of data from a bricked sidecar file.
+    
+    Usage:
+        Open the reader with the name of the MRC file (not the sidecar file),
+        and read regions with :meth:`read_region` or by slicing the
+        :attr:`data` attribute:
+        
+        >>> with BrickedReader('tomogram.mrc') as reader:
+        ...     xz_plane = reader.read_region((slice(None), 100, slice(None)))
+        ...     subvolume = reader.data[10:20, 30:40, 50:60]
+        
+        Only the bricks which contain the requested values are read from the
+        sidecar file. The most recently used bricks are kept in memory, so
+        reading nearby regions repeatedly (for example, while scrolling
+        through a view) is fast.
+    
+    """
+    
+    def __init__(self, name, sidecar=None, check_source=True,
+                 cached_bricks=DEFAULT_CACHED_BRICKS):
+        """Initialise a new :class:`BrickedReader` object.
+        
+        Args:
+            name: The name of the MRC file.
+            sidecar: The name of the sidecar file. The default is the name of
+                the MRC file with ``.bricks`` appended.
+            check_source: If :data:`True` (the default), check that the MRC
+                file has not changed since the sidecar file was built. If
+                :data:`False`, the MRC file is not needed at all.
+            cached_bricks: The number of decompressed bricks to keep in
+                memory.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the sidecar file is not valid,
+                or ``check_source`` is :data:`True` and the MRC file has
+                changed since the sidecar was built.
+        """
+        super(BrickedReader, self).__init__()
+        if sidecar is None:
+            sidecar = name + BRICKS_SUFFIX
+        self._cache = OrderedDict()
+        self._cached_bricks = cached_bricks
+        self._file = io.open(sidecar, 'rb')
+        try:
+            header_bytes = self._file.read(BRICKS_HEADER_DTYPE.itemsize)
+            if len(header_bytes) < BRICKS_HEADER_DTYPE.itemsize:
+                raise ValueError("File '{0}' is not a bricked sidecar file"
+                                 .format(sidecar))
+            header = np.frombuffer(header_bytes, dtype=BRICKS_HEADER_DTYPE)[0]
+            if header['magic'] != BRICKS_MAGIC:
+                raise ValueError("File '{0}' is not a bricked sidecar file"
+                                 .format(sidecar))
+            if header['version'] != BRICKS_FORMAT_VERSION:
+                raise ValueError("Bricked sidecar file version {0} is not "
+                                 "supported".format(header['version']))
+            if check_source:
+                source_stat = os.stat(name)
+                if (source_stat.st_size != header['source_size']
+                        or source_stat.st_mtime != header['source_mtime']):
+                    raise ValueError("Bricked sidecar file '{0}' is out of "
+                                     "date: '{1}' has changed since it was "
+                                     "built".format(sidecar, name))
+            ndim = int(header['ndim'])
+            self._shape = tuple(int(length)
+                                for length in header['shape'][:ndim])
+            self._brick_shape = tuple(int(size)
+                                      for size in header['brick_shape'][:ndim])
+            self._dtype = np.dtype(header['dtype'].decode('ascii'))
+            compression = header['compression'].decode('ascii')
+            self._compression = compression or None
+            if compression and compression not in _CODECS:
+                raise ValueError("Unknown compression format '{0}'"
+                                 .format(compression))
+            self._grid = _grid_shape(self._shape, self._brick_shape)
+            count = int(np.prod(self._grid))
+            index_nbytes = count * BRICK_INDEX_DTYPE.itemsize
+            index_bytes = self._file.read(index_nbytes)
+            if len(index_bytes) != index_nbytes:
+                raise ValueError("Bricked sidecar file '{0}' is truncated"
+                                 .format(sidecar))
+            self._index = np.frombuffer(index_bytes, dtype=BRICK_INDEX_DTYPE)
+        except Exception:
+            self._file.close()
+            raise
+        self._data = BrickedArray(self._shape, self._dtype, self._brick_shape,
+                                  self._read_brick)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def __repr__(self):
+        return "BrickedReader('{0}')".format(self._file.name)
+    
+    @property
+    def shape(self):
+        """The shape of the data array."""
+        return self._shape
+    
+    @property
+    def dtype(self):
+        """The :class:`numpy dtype <numpy.dtype>` of the data array."""
+        return self._dtype
+    
+    @property
+    def brick_shape(self):
+        """The shape of each whole brick."""
+        return self._brick_shape
+    
+    @property
+    def compression(self):
+        """The compression format of the bricks, or :data:`None`."""
+        return self._compression
+    
+    @property
+    def data(self):
+        """The data, as a :class:`BrickedArray` which reads bricks on
+        demand."""
+        return self._data
+    
+    def read_region(self, index):
+        """Read a region of the data.
+        
+        Args:
+            index: An index into the data array, made of integers, slices and
+                :data:`Ellipsis`, as for :class:`numpy arrays
+                <numpy.ndarray>`.
+        
+        Returns:
+            A new :class:`numpy array <numpy.ndarray>` containing the values.
+        """
+        return self._data[index]
+    
+    def close(self):
+        """Close the sidecar file and discard any cached bricks."""
+        self._file.close()
+        self._cache.clear()
+    
+    def _read_brick(self, brick_index):
+        """Return the values in the brick with the given position in the grid
+        of bricks."""
+        cached = self._cache.pop(brick_index, None)
+        if cached is None:
+            position = np.ravel_multi_index(brick_index, self._grid)
+            entry = self._index[position]
+            self._file.seek(int(entry['offset']))
+            payload = self._file.read(int(entry['nbytes']))
+            if self._compression is not None:
+                payload = _CODECS[self._compression][1](payload)
+            shape = tuple(min(size, length - number * size)
+                          for number, size, length in zip(brick_index,
+                                                          self._brick_shape,
+                                                          self._shape))
+            cached = np.frombuffer(payload, dtype=self._dtype).reshape(shape)
+            while self._cache and len(self._cache) >= self._cached_bricks:
+                self._cache.popitem(last=False)
+        if self._cached_bricks > 0:
+            self._cache[brick_index] = cached
+        return cached
+
+
+class BrickedArray(LazyArray):
+    
+    """An array-like view of bricked data, which reads bricks on demand.
+    
+    Indexing the array reads each brick which contains any of the requested
+    values, and copies the values into a new :class:`numpy array
+    <numpy.ndarray>`. The array is read-only.
+    
+    """
+    
+    def __init__(self, shape, dtype, brick_shape, read_brick):
+        """Initialise a new :class:`BrickedArray`.
+        
+        Args:
+            shape: The shape of the array.
+            dtype: The :class:`numpy dtype <numpy.dtype>` of the array.
+            brick_shape: The shape of each whole brick.
+            read_brick: A function which takes the position of a brick in the
+                grid of bricks, as a tuple, and returns its values as a
+                :class:`numpy array <numpy.ndarray>`.
+        """
+        super(BrickedArray, self).__init__(shape, dtype)
+        self.brick_shape = tuple(brick_shape)
+        self._read_brick = read_brick
+    
+    def _get(self, index):
+        positions = []
+        for item, length in zip(index, self.shape):
+            if isinstance(item, slice):
+                positions.append(np.arange(*item.indices(length)))
+            else:
+                positions.append(np.array([item]))
+        result = np.empty(tuple(len(axis) for axis in positions),
+                          dtype=self.dtype)
+        if result.size > 0:
+            brick_numbers = [axis // size for axis, size
+                             in zip(positions, self.brick_shape)]
+            for brick_index in itertools.product(*[np.unique(numbers)
+                                                   for numbers
+                                                   in brick_numbers]):
+                brick_index = tuple(int(number) for number in brick_index)
+                values = self._read_brick(brick_index)
+                selected = [np.flatnonzero(numbers == number)
+                            for numbers, number in zip(brick_numbers,
+                                                       brick_index)]
+                local = [axis[chosen] - number * size
+                         for axis, chosen, number, size
+                         in zip(positions, selected, brick_index,
+                                self.brick_shape)]
+                result[np.ix_(*selected)] = values[np.ix_(*local)]
+        # Remove the axes which were indexed by integers
+        return result.reshape(tuple(len(axis) for axis, item
+                                    in zip(positions, index)
+                                    if isinstance(item, slice)))
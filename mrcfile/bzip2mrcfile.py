@@ -32,6 +32,10 @@ class Bzip2MrcFile(MrcFile):
     
     """
     
+    # The extended header is read straight away, since seeking back to it
+    # later would mean decompressing the start of the file again
+    _defer_extended_header = False
+    
     def __repr__(self):
         return "Bzip2MrcFile('{0}', mode='{1}')".format(self._fname,
                                                         self._mode)
@@ -63,11 +67,17 @@ class Bzip2MrcFile(MrcFile):
         BZ2File objects need special handling.
         """
         if not self._read_only:
+            if self._data is None and self._header_only:
+                # The whole file must be rewritten, so read the data first
+                self._ensure_readable_stream()
+                self._iostream.seek(self.header.nbytes + self.header.nsymbt)
+                self._read_data()
             self._iostream.close()
             self._iostream = bz2.BZ2File(self._fname, mode='w')
             
             # Arrays converted to bytes so gzip can calculate sizes correctly
             self._iostream.write(self.header.tobytes())
             self._iostream.write(self.extended_header.tobytes())
-            self._iostream.write(self.data.tobytes())
+            self._iostream.write(self._extended_header_padding())
+            self._iostream.write(self._encode_data().tobytes())
             # no equivalent for flush() with BZ2File
@@ -0,0 +1,450 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+"""
+chunkstore
+----------
+
+Chunked directory stores, for writing and reading MRC data in independent
+pieces.
+
+A single MRC file is awkward to write from many processes at once, and
+compressed MRC files can only be read from the start. A chunk store instead
+holds the data as a directory of separate files, one for each chunk of the
+data array (cubes of 64 voxels along each side by default), each compressed
+independently. Different processes can write different chunks at the same
+time, and any region can be read by fetching only the chunks it touches. The
+layout is similar to a `zarr <https://zarr.readthedocs.io/>`_ directory store,
+but needs no extra libraries.
+
+A store directory contains:
+
+* ``metadata.json``: The format name and version, and the data shape, dtype,
+  chunk shape and compression codec.
+* ``header.bin`` and ``extended_header.bin``: The MRC header and extended
+  header (including any reserved space), exactly as they were stored in the
+  MRC file, so a file can be exported and imported again without changing it.
+* One file per chunk, named after its position in the grid of chunks (for
+  example, ``0.2.1``), holding the raw bytes of a C-ordered array in the
+  data's dtype, compressed with the store's codec. Chunks at the high end of
+  each axis are cut short to fit the data. Chunks which have not been written
+  are read as zeros.
+
+The data is stored as it is presented by ``mrcfile``: packed 4-bit data is
+stored unpacked and quantised data is stored as float32 values. These are
+converted back when the store is imported.
+
+Functions:
+    :func:`export`: Write the contents of an MRC file to a new chunk store.
+    :func:`import_`: Write the contents of a chunk store to a new MRC file.
+
+Classes:
+    :class:`ChunkStore`: Read and write the chunks of a chunk store.
+
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import bz2
+import io
+import json
+import os
+import shutil
+import zlib
+
+import numpy as np
+
+try:
+    import lzma
+except ImportError:
+    # Not available in Python 2
+    lzma = None
+
+from . import utils
+from ._opening import _get_mrc_class
+from .bricks import BrickedArray, _brick_shape, _grid_shape
+from .constants import CHUNKSTORE_FORMAT, CHUNKSTORE_FORMAT_VERSION
+from .dtypes import HEADER_DTYPE
+from .mrcmemmap import MrcMemmap
+
+
+# Functions to compress and decompress each chunk, for each codec
+_CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'bzip2': (bz2.compress, bz2.decompress),
+}
+if lzma is not None:
+    _CODECS['lzma'] = (lzma.compress, lzma.decompress)
+
+METADATA_NAME = 'metadata.json'
+HEADER_NAME = 'header.bin'
+EXTENDED_HEADER_NAME = 'extended_header.bin'
+
+
+def export(name, store_dir, chunks=64, codec='zlib', overwrite=False):
+    """Write the contents of an MRC file to a new chunk store.
+    
+    The data is streamed from the MRC file a block of sections at a time (and
+    decompressed as it is read, for compressed files). Only one slab of
+    chunks, one chunk deep along the first axis of the data, is held in memory
+    at once.
+    
+    Args:
+        name: The name of the MRC file.
+        store_dir: The name of the directory to create for the store.
+        chunks: The length of each side of a chunk, as a single integer or a
+            tuple with one value for each axis of the data. The default is
+            64.
+        codec: The compression codec to use for each chunk: ``'zlib'`` (the
+            default), ``'bzip2'``, ``'lzma'`` (Python 3 only) or :data:`None`
+            for no compression.
+        overwrite: Flag to force overwriting of an existing store. If
+            :data:`False` and the directory already exists, an exception is
+            raised. Only an existing chunk store can be overwritten, never any
+            other directory.
+    
+    Returns:
+        A :class:`ChunkStore` object for the new store, opened for writing.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the codec is not recognised, or
+            the chunk size is invalid.
+        :class:`~exceptions.ValueError`: If the directory already exists and
+            ``overwrite`` is :data:`False`, or it is not a chunk store.
+    """
+    if codec is not None and codec not in _CODECS:
+        raise ValueError("Unknown compression codec '{0}'".format(codec))
+    with _get_mrc_class(name)(name, header_only=True) as mrc:
+        shape = utils.data_shape_from_header(mrc.header)
+        dtype = utils.loaded_dtype_from_header(mrc.header)
+        chunk_shape = _brick_shape(chunks, len(shape))
+        _make_store_dir(store_dir, overwrite)
+        metadata = {
+            'format': CHUNKSTORE_FORMAT,
+            'version': CHUNKSTORE_FORMAT_VERSION,
+            'shape': list(shape),
+            'dtype': dtype.str,
+            'chunks': list(chunk_shape),
+            'codec': codec,
+        }
+        # Write bytes, since json.dumps() returns a byte string on Python 2
+        with io.open(os.path.join(store_dir, METADATA_NAME), 'wb') as f:
+            f.write(json.dumps(metadata, indent=2,
+                               sort_keys=True).encode('utf-8'))
+        with io.open(os.path.join(store_dir, HEADER_NAME), 'wb') as f:
+            f.write(mrc.header.tobytes())
+        with io.open(os.path.join(store_dir, EXTENDED_HEADER_NAME),
+                     'wb') as f:
+            f.write(mrc.extended_header.tobytes())
+            f.write(mrc._extended_header_padding())
+        
+        store = ChunkStore(store_dir, mode='r+')
+        _write_chunk_slabs(store, mrc._iter_section_blocks())
+    return store
+
+
+def _write_chunk_slabs(store, blocks):
+    """Write streamed data sections to a store, one slab of chunks at a time.
+    
+    A slab is one chunk deep along the first axis of the data. Sections are
+    copied into a slab until it is full, and then all of the chunks in it are
+    written. (For 2D data, the single section is the whole slab.)
+    """
+    shape = store.shape
+    if len(shape) == 2:
+        depth = shape[0]
+        sections_per_item = 1
+    else:
+        depth = store.chunks[0]
+        sections_per_item = int(np.prod(shape[1:-2], dtype=np.int64))
+    slab = np.empty((depth,) + shape[1:], dtype=store.dtype)
+    slab_sections = slab.reshape((-1,) + shape[-2:])
+    start = filled = 0
+    for block in blocks:
+        for section in block:
+            slab_sections[filled] = section
+            filled += 1
+            count = min(depth, shape[0] - start)
+            if len(shape) == 2 or filled == count * sections_per_item:
+                _write_chunk_slab(store, slab[:count], start)
+                start += count
+                filled = 0
+
+
+def _write_chunk_slab(store, values, start):
+    """Write all of the chunks in one slab, which starts at position ``start``
+    along the first axis of the data."""
+    first_grid_index = start // store.chunks[0]
+    for chunk_index in np.ndindex(*store.chunk_grid):
+        if len(store.shape) > 2 and chunk_index[0] != first_grid_index:
+            continue
+        region = store.chunk_region(chunk_index)
+        local = ((slice(region[0].start - start, region[0].stop - start),)
+                 + region[1:])
+        store.write_chunk(chunk_index, values[local])
+
+
+def _make_store_dir(store_dir, overwrite):
+    """Create an empty directory for a new chunk store."""
+    if os.path.exists(store_dir):
+        if not overwrite:
+            raise ValueError("Directory '{0}' already exists; set "
+                             "overwrite=True to overwrite it"
+                             .format(store_dir))
+        # Check the directory is a store before deleting anything in it
+        ChunkStore(store_dir)
+        shutil.rmtree(store_dir)
+    os.makedirs(store_dir)
+
+
+def import_(store_dir, name, update_header_stats=False, overwrite=False):
+    """Write the contents of a chunk store to a new MRC file.
+    
+    The header and extended header are written exactly as they were stored,
+    and then the data is copied into the new file one chunk at a time through
+    a memory map.
+    
+    Args:
+        store_dir: The name of the store directory.
+        name: The name of the new MRC file.
+        update_header_stats: If :data:`True`, the header's data statistics are
+            recalculated from the data (for example, if chunks have been
+            written since the store was exported). The default is
+            :data:`False`, which keeps the statistics from the stored header.
+        overwrite: Flag to force overwriting of an existing file. If
+            :data:`False` and the file already exists, an exception is raised.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the store is not valid, or its
+            header does not match its data.
+        :class:`~exceptions.ValueError`: If the file already exists and
+            ``overwrite`` is :data:`False`.
+    """
+    store = ChunkStore(store_dir)
+    if os.path.exists(name) and not overwrite:
+        raise ValueError("File '{0}' already exists; set overwrite=True "
+                         "to overwrite it".format(name))
+    header = store.header
+    if utils.data_shape_from_header(header) != store.shape:
+        raise ValueError("Header in store '{0}' does not match the shape of "
+                         "its data".format(store_dir))
+    with io.open(name, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(store.extended_header_bytes)
+        f.truncate(f.tell() + utils.data_nbytes_from_header(header))
+    with MrcMemmap(name, mode='r+') as mrc:
+        for chunk_index in np.ndindex(*store.chunk_grid):
+            mrc.data[store.chunk_region(chunk_index)] = \
+                store.read_chunk(chunk_index)
+        if update_header_stats:
+            mrc.update_header_stats()
+
+
+class ChunkStore(object):
+    
+    """Read and write the chunks of a chunk store.
+    
+    No files are held open, so :class:`ChunkStore` objects do not need to be
+    closed, and any number of them (in different threads or processes) can
+    use the same store at once. Each chunk is written to a temporary file
+    which is then renamed, so readers never see a partly written chunk.
+    
+    Usage:
+        Read regions by slicing the :attr:`data` attribute, or process the
+        store chunk by chunk:
+        
+        >>> store = ChunkStore('tomogram.chunks', mode='r+')
+        >>> subvolume = store.data[10:20, 30:40, 50:60]
+        >>> for chunk_index in np.ndindex(*store.chunk_grid):
+        ...     store.write_chunk(chunk_index,
+        ...                       process(store.read_chunk(chunk_index)))
+    
+    """
+    
+    def __init__(self, store_dir, mode='r'):
+        """Initialise a new :class:`ChunkStore` object.
+        
+        Args:
+            store_dir: The name of the store directory.
+            mode: ``'r'`` (the default) to read the store, or ``'r+'`` to read
+                and write chunks.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the mode is not ``'r'`` or
+                ``'r+'``, or the directory is not a valid chunk store.
+        """
+        super(ChunkStore, self).__init__()
+        if mode not in ['r', 'r+']:
+            raise ValueError("Mode '{0}' not supported".format(mode))
+        try:
+            with io.open(os.path.join(store_dir, METADATA_NAME), 'r') as f:
+                metadata = json.loads(f.read())
+        except (IOError, OSError, ValueError):
+            raise ValueError("Directory '{0}' is not a chunk store"
+                             .format(store_dir))
+        if (not isinstance(metadata, dict)
+                or metadata.get('format') != CHUNKSTORE_FORMAT):
+            raise ValueError("Directory '{0}' is not a chunk store"
+                             .format(store_dir))
+        if metadata.get('version') != CHUNKSTORE_FORMAT_VERSION:
+            raise ValueError("Chunk store version {0} is not supported"
+                             .format(metadata.get('version')))
+        codec = metadata['codec']
+        if codec is not None and codec not in _CODECS:
+            raise ValueError("Unknown compression codec '{0}'".format(codec))
+        self._store_dir = store_dir
+        self._mode = mode
+        self._shape = tuple(int(length) for length in metadata['shape'])
+        self._dtype = np.dtype(str(metadata['dtype']))
+        self._chunks = tuple(int(size) for size in metadata['chunks'])
+        self._codec = codec
+        self._grid = _grid_shape(self._shape, self._chunks)
+        self._data = BrickedArray(self._shape, self._dtype, self._chunks,
+                                  self.read_chunk)
+    
+    def __repr__(self):
+        return "ChunkStore('{0}', mode='{1}')".format(self._store_dir,
+                                                     self._mode)
+    
+    @property
+    def shape(self):
+        """The shape of the data array."""
+        return self._shape
+    
+    @property
+    def dtype(self):
+        """The :class:`numpy dtype <numpy.dtype>` of the data array."""
+        return self._dtype
+    
+    @property
+    def chunks(self):
+        """The shape of each whole chunk."""
+        return self._chunks
+    
+    @property
+    def chunk_grid(self):
+        """The number of chunks along each axis."""
+        return self._grid
+    
+    @property
+    def codec(self):
+        """The compression codec of the chunks, or :data:`None`."""
+        return self._codec
+    
+    @property
+    def header(self):
+        """A copy of the stored MRC header, as a :class:`numpy record array
+        <numpy.recarray>`."""
+        with io.open(os.path.join(self._store_dir, HEADER_NAME), 'rb') as f:
+            header_bytes = f.read()
+        header = np.rec.fromstring(header_bytes, dtype=HEADER_DTYPE, shape=())
+        header.flags.writeable = True
+        byte_order = utils.byte_order_from_machine_stamp(header.machst)
+        header.dtype = header.dtype.newbyteorder(byte_order)
+        return header
+    
+    @property
+    def extended_header_bytes(self):
+        """The stored extended header (including any reserved space), as
+        bytes."""
+        with io.open(os.path.join(self._store_dir, EXTENDED_HEADER_NAME),
+                     'rb') as f:
+            return f.read()
+    
+    @property
+    def data(self):
+        """The data, as a :class:`~mrcfile.bricks.BrickedArray` which reads
+        chunks on demand."""
+        return self._data
+    
+    def chunk_region(self, chunk_index):
+        """Return the region of the data array covered by a chunk.
+        
+        Args:
+            chunk_index: The position of the chunk in the grid of chunks, as a
+                tuple.
+        
+        Returns:
+            A tuple of slices, which can be used to index the data array.
+        """
+        return tuple(slice(number * size, min((number + 1) * size, length))
+                     for number, size, length in zip(chunk_index, self._chunks,
+                                                     self._shape))
+    
+    def read_chunk(self, chunk_index):
+        """Read the values in a chunk.
+        
+        Args:
+            chunk_index: The position of the chunk in the grid of chunks, as a
+                tuple.
+        
+        Returns:
+            A :class:`numpy array <numpy.ndarray>` of the chunk's values. If
+            the chunk has never been written, it is filled with zeros.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the chunk file is the wrong
+                size for the chunk.
+        """
+        shape = self._chunk_shape(chunk_index)
+        try:
+            with io.open(self._chunk_path(chunk_index), 'rb') as f:
+                payload = f.read()
+        except (IOError, OSError):
+            if os.path.exists(self._chunk_path(chunk_index)):
+                raise
+            return np.zeros(shape, dtype=self._dtype)
+        if self._codec is not None:
+            payload = _CODECS[self._codec][1](payload)
+        if len(payload) != int(np.prod(shape)) * self._dtype.itemsize:
+            raise ValueError("Chunk file '{0}' is the wrong size"
+                             .format(self._chunk_path(chunk_index)))
+        return np.frombuffer(payload, dtype=self._dtype).reshape(shape)
+    
+    def write_chunk(self, chunk_index, values):
+        """Write the values in a chunk.
+        
+        Args:
+            chunk_index: The position of the chunk in the grid of chunks, as a
+                tuple.
+            values: The new values, which must be broadcastable to the shape
+                of the chunk. They are converted to the store's dtype.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the store is read-only.
+        """
+        if self._mode != 'r+':
+            raise ValueError("Chunk store is read-only")
+        values = np.broadcast_to(np.asarray(values, dtype=self._dtype),
+                                 self._chunk_shape(chunk_index))
+        payload = np.ascontiguousarray(values).tobytes()
+        if self._codec is not None:
+            payload = _CODECS[self._codec][0](payload)
+        path = self._chunk_path(chunk_index)
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with io.open(temp_path, 'wb') as f:
+            f.write(payload)
+        if os.path.exists(path) and os.name == 'nt':
+            # Windows cannot rename onto an existing file
+            os.remove(path)
+        os.rename(temp_path, path)
+    
+    def _chunk_shape(self, chunk_index):
+        """Return the shape of a chunk, which is smaller than :attr:`chunks`
+        at the high end of each axis."""
+        if len(chunk_index) != len(self._grid) or not all(
+                0 <= number < count
+                for number, count in zip(chunk_index, self._grid)):
+            raise IndexError("Chunk index {0} is out of range for a grid of "
+                             "{1} chunks".format(tuple(chunk_index),
+                                                 self._grid))
+        return tuple(min(size, length - number * size)
+                     for number, size, length in zip(chunk_index, self._chunks,
+                                                     self._shape))
+    
+    def _chunk_path(self, chunk_index):
+        """Return the file name of a chunk."""
+        return os.path.join(self._store_dir,
+                            '.'.join(str(int(number))
+                                     for number in chunk_index))
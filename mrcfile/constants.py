@@ -21,3 +21,31 @@ MAP_ID_OFFSET_BYTES = 208  # location of 'MAP ' string in an MRC file
 IMAGE_STACK_SPACEGROUP = 0
 VOLUME_SPACEGROUP = 1
 VOLUME_STACK_SPACEGROUP = 401
+
+# Number of bytes to read or write at once when streaming through a data block
+STREAM_BLOCK_BYTES = 64 * 1024 * 1024
+
+# Mode number for 4-bit data packed two values per byte (an IMOD extension)
+PACKED_4BIT_MODE = 101
+
+# IMOD's header stamp and flag bits, stored in the header's extra2 space. When
+# the stamp is present, mode 0 data is signed only if the signed bytes flag is
+# set, and otherwise it is unsigned.
+IMOD_STAMP = 1146047817
+IMOD_SIGNED_BYTES_FLAG = 1
+
+# Tag stored in the header's extra2 space to mark quantised data
+QUANTIZATION_TAG = b'QNT1'
+
+# Tag stored in the header's extra2 space to mark an extended header with
+# reserved space at the end
+EXTENDED_HEADER_RESERVE_TAG = b'XRS1'
+
+# Identifier, version and default file name suffix for bricked sidecar files
+BRICKS_MAGIC = b'MRCBRICK'
+BRICKS_FORMAT_VERSION = 1
+BRICKS_SUFFIX = '.bricks'
+
+# Identifier and version recorded in the metadata of chunked directory stores
+CHUNKSTORE_FORMAT = 'mrcfile-chunkstore'
+CHUNKSTORE_FORMAT_VERSION = 1
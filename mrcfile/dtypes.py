@@ -77,6 +77,125 @@ HEADER_DTYPE = np.dtype([
     ('label', 'S80', 10)   # 10 labels of 80 characters
 ])
 
+# Fields used by IMOD in the header's extra2 space. (nint and nreal describe the
+# layout of SERI and AGAR extended headers.) This dtype is the same size
+# as the header, so it can be used to view the header and access the fields
+# directly without changing the main header dtype.
+IMOD_HEADER_DTYPE = np.dtype({
+    'names': ['nint', 'nreal', 'imod_stamp', 'imod_flags'],
+    'formats': ['i2', 'i2', 'i4', 'i4'],
+    'offsets': [128, 130, 152, 156],
+    'itemsize': HEADER_DTYPE.itemsize
+})
+
+# Fields used by mrcfile in the header's extra2 space to record the scale and
+# offset of quantised data. This dtype is also the same size as the header.
+QUANTIZATION_HEADER_DTYPE = np.dtype({
+    'names': ['quant_tag', 'quant_scale', 'quant_offset'],
+    'formats': ['S4', 'f4', 'f4'],
+    'offsets': [112, 116, 120],
+    'itemsize': HEADER_DTYPE.itemsize
+})
+
+# Fields used by mrcfile in the header's extra2 space to record how much of the
+# extended header is in use, if space has been reserved at the end of it. This
+# dtype is also the same size as the header.
+EXTENDED_HEADER_RESERVE_HEADER_DTYPE = np.dtype({
+    'names': ['exthdr_tag', 'exthdr_used'],
+    'formats': ['S4', 'i4'],
+    'offsets': [132, 136],
+    'itemsize': HEADER_DTYPE.itemsize
+})
+
+# Per-frame metadata records in an FEI1 extended header, as written by Thermo
+# Fisher (FEI) software. These are always little-endian. Only the fields in the
+# first part of each record are listed; the rest is left as raw bytes.
+FEI1_EXTENDED_HEADER_DTYPE = np.dtype([
+    ('metadata_size', '<i4'),      # Size of each record in bytes
+    ('metadata_version', '<i4'),
+    ('bitmask_1', '<u4'),          # Flags indicating which fields are valid
+    ('timestamp', '<f8'),
+    ('microscope_type', 'S16'),
+    ('d_number', 'S16'),
+    ('application', 'S16'),
+    ('application_version', 'S16'),
+    ('ht', '<f8'),                 # High tension in volts
+    ('dose', '<f8'),               # Dose in electrons per square metre
+    ('alpha_tilt', '<f8'),         # Stage tilt angles in degrees
+    ('beta_tilt', '<f8'),
+    ('x_stage', '<f8'),            # Stage position in metres
+    ('y_stage', '<f8'),
+    ('z_stage', '<f8'),
+    ('tilt_axis_angle', '<f8'),
+    ('dual_axis_rotation', '<f8'),
+    ('pixel_size_x', '<f8'),       # Pixel size in metres
+    ('pixel_size_y', '<f8'),
+    ('unused_range', 'V48'),
+    ('defocus', '<f8'),
+    ('stem_defocus', '<f8'),
+    ('applied_defocus', '<f8'),
+    ('instrument_mode', '<i4'),
+    ('projection_mode', '<i4'),
+    ('objective_lens_mode', 'S16'),
+    ('high_magnification_mode', 'S16'),
+    ('probe_mode', '<i4'),
+    ('eftem_on', '?'),
+    ('magnification', '<f8'),
+    ('bitmask_2', '<u4'),
+    ('camera_length', '<f8'),
+    ('spot_index', '<i4'),
+    ('illuminated_area', '<f8'),
+    ('intensity', '<f8'),
+    ('convergence_angle', '<f8'),
+    ('illumination_mode', 'S16'),
+    ('wide_convergence_angle_range', '?'),
+    ('slit_inserted', '?'),
+    ('slit_width', '<f8'),
+    ('acceleration_voltage_offset', '<f8'),
+    ('drift_tube_voltage', '<f8'),
+    ('energy_shift', '<f8'),
+    ('shift_offset_x', '<f8'),
+    ('shift_offset_y', '<f8'),
+    ('shift_x', '<f8'),
+    ('shift_y', '<f8'),
+    ('integration_time', '<f8'),
+    ('binning_width', '<i4'),
+    ('binning_height', '<i4'),
+    ('camera_name', 'S16'),
+    ('readout_area_left', '<i4'),
+    ('readout_area_top', '<i4'),
+    ('readout_area_right', '<i4'),
+    ('readout_area_bottom', '<i4'),
+    ('direct_detector_electron_counting', '?'),
+    ('direct_detector_align_frames', '?'),
+    ('reserved', 'V299')           # Remaining fields, up to 768 bytes
+])
+
+# Symmetry operator records in a CCP4 or MRCO extended header: each operator is
+# stored as an 80-character line of text.
+SYMMETRY_EXTENDED_HEADER_DTYPE = np.dtype('S80')
+
+# Header of a bricked sidecar file (see the bricks module). All values are
+# little-endian. Shapes have one value per axis, padded with zeros to four axes.
+BRICKS_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),               # Contains 'MRCBRICK' to identify file type
+    ('version', '<i4'),            # Version of the sidecar format
+    ('ndim', '<i4'),               # Number of dimensions of the data
+    ('shape', '<i8', 4),           # Shape of the data array
+    ('brick_shape', '<i8', 4),     # Shape of each (whole) brick
+    ('dtype', 'S8'),               # numpy dtype string of the data
+    ('compression', 'S8'),         # Compression of each brick, or empty
+    ('source_size', '<i8'),        # Size of the MRC file in bytes
+    ('source_mtime', '<f8'),       # Modification time of the MRC file
+])
+
+# Entry in the index of a bricked sidecar file, giving the position of one
+# brick in the file and its (possibly compressed) size
+BRICK_INDEX_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('nbytes', '<u8'),
+])
+
 VOXEL_SIZE_DTYPE = np.dtype([
     ('x', 'f4'),
     ('y', 'f4'),
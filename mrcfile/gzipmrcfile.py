@@ -18,6 +18,7 @@ from __future__ import (absolute_import, division, print_function,
 
 import gzip
 
+from .constants import STREAM_BLOCK_BYTES
 from .mrcfile import MrcFile
 
 
@@ -29,6 +30,10 @@ class GzipMrcFile(MrcFile):
     
     """
     
+    # The extended header is read straight away, since seeking back to it
+    # later would mean decompressing the start of the file again
+    _defer_extended_header = False
+    
     def __repr__(self):
         return "GzipMrcFile('{0}', mode='{1}')".format(self._fileobj.name,
                                                        self._mode)
@@ -56,17 +61,29 @@ class GzipMrcFile(MrcFile):
             self._iostream = gzip.GzipFile(fileobj=self._fileobj, mode='rb')
     
     def _get_file_size(self):
-        """Override _get_file_size() to avoid seeking from end."""
+        """Override _get_file_size() to avoid seeking from end.
+        
+        The rest of the stream is read and discarded a block at a time, so the
+        whole file does not need to fit in memory.
+        """
         self._ensure_readable_gzip_stream()
-        pos = self._iostream.tell()
-        extra = len(self._iostream.read())
-        return pos + extra
+        size = self._iostream.tell()
+        while True:
+            block = self._iostream.read(STREAM_BLOCK_BYTES)
+            if not block:
+                return size
+            size += len(block)
     
     def flush(self):
         """Override :meth:`~mrcfile.mrcinterpreter.MrcInterpreter.flush` since
         GzipFile objects need special handling.
         """
         if not self._read_only:
+            if self._data is None and self._header_only:
+                # The whole file must be rewritten, so read the data first
+                self._ensure_readable_gzip_stream()
+                self._iostream.seek(self.header.nbytes + self.header.nsymbt)
+                self._read_data()
             self._iostream.close()
             self._fileobj.seek(0)
             self._iostream = gzip.GzipFile(fileobj=self._fileobj, mode='wb')
@@ -74,6 +91,7 @@ class GzipMrcFile(MrcFile):
             # Arrays converted to bytes so gzip can calculate sizes correctly
             self._iostream.write(self.header.tobytes())
             self._iostream.write(self.extended_header.tobytes())
-            self._iostream.write(self.data.tobytes())
+            self._iostream.write(self._extended_header_padding())
+            self._iostream.write(self._encode_data().tobytes())
             self._iostream.flush()
             self._fileobj.truncate()
@@ -0,0 +1,622 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+"""
+lazyarrays
+----------
+
+Module which exports array-like classes which read and write their values on
+demand, rather than holding them all in memory.
+
+These are used where a plain :class:`numpy memmap <numpy.memmap>` cannot
+represent the data directly, for example when the values stored in the file
+need to be converted before use.
+
+Classes:
+    :class:`LazyArray`: Base class for array-like objects which load data on
+    demand.
+    :class:`Packed4BitArray`: An array of 4-bit values, unpacked from (and
+    packed into) a byte array on demand.
+    :class:`DequantizedArray`: An array of float32 values, converted from (and
+    to) an array of quantised integers on demand.
+    :class:`WindowedMemmapArray`: An array in a file, which is memory-mapped
+    a window of sections at a time.
+    :class:`TransposedArray`: A view of another array-like object with its
+    axes permuted.
+    :class:`FileRegionArray`: The data of an MRC file, read from the file by
+    name each time a region is requested.
+
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import numbers
+import os
+import threading
+
+import numpy as np
+
+from . import utils
+
+
+class _ArrayFlags(object):
+    
+    """Minimal stand-in for :attr:`numpy.ndarray.flags`, holding only the
+    ``writeable`` flag."""
+    
+    def __init__(self, writeable):
+        self.writeable = writeable
+
+
+class LazyArray(object):
+    
+    """Base class for array-like objects which load their data on demand.
+    
+    A :class:`LazyArray` has a fixed shape and dtype, and supports reading and
+    writing values by indexing with integers, slices and :data:`Ellipsis` (but
+    not with index arrays or :data:`numpy.newaxis`). Indexing always returns a
+    new :class:`numpy array <numpy.ndarray>` containing a copy of the values,
+    rather than a view. The whole array can be loaded into memory by calling
+    :func:`numpy.asarray`, but for large data sets it is better to read small
+    parts at a time by slicing.
+    
+    Subclasses must implement :meth:`_get` and, if they are writeable,
+    :meth:`_set`.
+    
+    """
+    
+    def __init__(self, shape, dtype, base=None):
+        """Initialise a new :class:`LazyArray`.
+        
+        Args:
+            shape: The shape of the array, as a tuple.
+            dtype: The :class:`numpy dtype <numpy.dtype>` of the array.
+            base: The array (for example, a :class:`numpy memmap
+                <numpy.memmap>`) which holds the stored values, if there is
+                one.
+        """
+        self._shape = tuple(int(length) for length in shape)
+        self._dtype = np.dtype(dtype)
+        self._base = base
+    
+    def __repr__(self):
+        return "{0}(shape={1}, dtype={2})".format(type(self).__name__,
+                                                  self.shape, self.dtype)
+    
+    @property
+    def base(self):
+        """The array which holds the stored values, or :data:`None`."""
+        return self._base
+    
+    @property
+    def flags(self):
+        """The flags of the :attr:`base` array.
+        
+        Setting ``flags.writeable`` to :data:`False` makes this array
+        read-only too. If there is no base array, the array is read-only and
+        only ``flags.writeable`` is available.
+        """
+        if self._base is None:
+            return _ArrayFlags(False)
+        return self._base.flags
+    
+    @property
+    def shape(self):
+        """The shape of the array."""
+        return self._shape
+    
+    @property
+    def dtype(self):
+        """The :class:`numpy dtype <numpy.dtype>` of the array."""
+        return self._dtype
+    
+    @property
+    def ndim(self):
+        """The number of dimensions of the array."""
+        return len(self._shape)
+    
+    @property
+    def size(self):
+        """The number of elements in the array."""
+        size = 1
+        for length in self._shape:
+            size *= length
+        return size
+    
+    @property
+    def nbytes(self):
+        """The number of bytes the array would occupy if loaded into
+        memory."""
+        return self.size * self.dtype.itemsize
+    
+    def __len__(self):
+        if self.ndim == 0:
+            raise TypeError("len() of unsized object")
+        return self._shape[0]
+    
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+    
+    def __array__(self, dtype=None):
+        array = self[...]
+        if dtype is not None:
+            array = array.astype(dtype, copy=False)
+        return array
+    
+    def __getitem__(self, key):
+        return np.asarray(self._get(self._normalise_index(key)),
+                          dtype=self.dtype)
+    
+    def __setitem__(self, key, value):
+        self._set(self._normalise_index(key), value)
+    
+    def copy(self):
+        """Return a copy of the whole array as a :class:`numpy array
+        <numpy.ndarray>`."""
+        return self[...]
+    
+    def flush(self):
+        """Flush the :attr:`base` array, if it supports flushing."""
+        if hasattr(self._base, 'flush'):
+            self._base.flush()
+    
+    def _get(self, index):
+        """Return the values at the given index.
+        
+        Args:
+            index: A tuple with one integer or :class:`slice` for each
+                dimension of the array. Integers are guaranteed to be in the
+                range ``0 <= i < length`` for their dimension.
+        
+        Returns:
+            A :class:`numpy array <numpy.ndarray>` containing the values.
+        """
+        raise NotImplementedError
+    
+    def _set(self, index, value):
+        """Set the values at the given index.
+        
+        Args:
+            index: A tuple with one integer or :class:`slice` for each
+                dimension of the array, as for :meth:`_get`.
+            value: The new values, which must be broadcastable to the shape
+                of the indexed region.
+        """
+        raise ValueError("{0} is read-only".format(type(self).__name__))
+    
+    def _normalise_index(self, key):
+        """Convert an index to a tuple with one item for each dimension.
+        
+        Raises:
+            :class:`~exceptions.IndexError`: If the index is out of range or
+                has too many dimensions.
+            :class:`~exceptions.TypeError`: If the index contains anything
+                other than integers, slices and :data:`Ellipsis`.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(item is Ellipsis for item in key):
+            position = [item is Ellipsis for item in key].index(True)
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:position] + fill + key[position + 1:]
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for array")
+        key = key + (slice(None),) * (self.ndim - len(key))
+        index = []
+        for item, length in zip(key, self.shape):
+            if isinstance(item, slice):
+                index.append(item)
+            elif (isinstance(item, (numbers.Integral, np.integer))
+                  and not isinstance(item, bool)):
+                position = int(item)
+                if position < 0:
+                    position += length
+                if not 0 <= position < length:
+                    raise IndexError("index {0} is out of bounds for axis "
+                                     "with size {1}".format(item, length))
+                index.append(position)
+            else:
+                raise TypeError("{0} only supports indexing with integers, "
+                                "slices and Ellipsis"
+                                .format(type(self).__name__))
+        return tuple(index)
+
+
+class Packed4BitArray(LazyArray):
+    
+    """An array of 4-bit values stored in a packed byte array.
+    
+    Each byte of the packed array holds two values, with the first value in the
+    lower four bits. Each row (the last axis) starts at a new byte, so if the
+    row length is odd, the upper four bits of the last byte in each row are
+    unused. This is the layout used for MRC mode 101.
+    
+    Values are unpacked to uint8 when read. Only the bytes which hold the
+    requested values are unpacked, so this class can be used with a
+    memory-mapped packed array to read parts of very large data sets. Values
+    written to the array must be in the range 0--15.
+    
+    """
+    
+    def __init__(self, packed, row_length):
+        """Initialise a new :class:`Packed4BitArray`.
+        
+        Args:
+            packed: The packed uint8 array (for example, a :class:`numpy
+                memmap <numpy.memmap>`). The last axis holds the packed
+                values for each row.
+            row_length: The number of 4-bit values in each row.
+        """
+        shape = packed.shape[:-1] + (row_length,)
+        super(Packed4BitArray, self).__init__(shape, np.uint8, base=packed)
+    
+    def _get(self, index):
+        row_index = index[-1]
+        row_length = self.shape[-1]
+        if isinstance(row_index, slice):
+            positions = np.arange(*row_index.indices(row_length))
+        else:
+            positions = np.array(row_index)
+        if positions.size == 0:
+            rows = self._base[index[:-1] + (slice(0, 0),)]
+            return np.empty(rows.shape[:-1] + (0,), dtype=np.uint8)
+        # Only unpack the bytes containing the requested values
+        first_byte = int(positions.min()) // 2
+        last_byte = int(positions.max()) // 2 + 1
+        packed = self._base[index[:-1] + (slice(first_byte, last_byte),)]
+        unpacked = utils.unpack_4bit_data(packed)
+        return unpacked[..., positions - 2 * first_byte]
+    
+    def _set(self, index, value):
+        # Unpack whole rows, update them and pack them again
+        rows_index = index[:-1] + (slice(None),)
+        rows = utils.unpack_4bit_data(np.asarray(self._base[rows_index]),
+                                      self.shape[-1])
+        rows[..., index[-1]] = utils.check_4bit_data(value)
+        self._base[rows_index] = utils.pack_4bit_data(rows)
+
+
+class DequantizedArray(LazyArray):
+    
+    """A float32 array stored as quantised integers.
+    
+    Values are converted from the stored integers when read, by multiplying by
+    the scale and adding the offset, and converted back (with rounding) when
+    written. Only the requested values are converted, so this class can be used
+    with a memory-mapped integer array to read parts of very large data sets.
+    
+    The float32 values have the same byte order as the stored integers.
+    
+    """
+    
+    def __init__(self, quantized, scale, offset):
+        """Initialise a new :class:`DequantizedArray`.
+        
+        Args:
+            quantized: The integer array (for example, a :class:`numpy memmap
+                <numpy.memmap>`).
+            scale: The quantisation scale.
+            offset: The quantisation offset.
+        """
+        byte_order = quantized.dtype.byteorder
+        if quantized.dtype.itemsize == 1:
+            byte_order = '='
+        dtype = np.dtype(np.float32).newbyteorder(byte_order)
+        super(DequantizedArray, self).__init__(quantized.shape, dtype,
+                                               base=quantized)
+        self.scale = scale
+        self.offset = offset
+    
+    def _get(self, index):
+        return utils.dequantize_data(self._base[index], self.scale, self.offset)
+    
+    def _set(self, index, value):
+        self._base[index] = utils.quantize_data(value, self.scale, self.offset,
+                                                self._base.dtype)
+
+
+class WindowedMemmapArray(LazyArray):
+    
+    """An array stored in a file, which is memory-mapped a window at a time.
+    
+    A plain :class:`numpy memmap <numpy.memmap>` maps the whole array, and
+    every page that is accessed stays resident until the operating system
+    decides to reclaim it. When scanning through a very large file, this can
+    use a lot of memory (and in a container with a memory limit, cause the
+    process to be killed). This class instead maps a fixed number of sections
+    (items along the first axis) at a time. When a section outside the current
+    window is accessed, the old window is flushed, released with
+    ``MADV_DONTNEED`` (where the C library's ``madvise()`` is available)
+    and unmapped, and a new window is mapped.
+    
+    Values are copied out of (or into) the window when the array is indexed,
+    so no references to the mapped memory are kept elsewhere.
+    
+    """
+    
+    def __init__(self, fileobj, dtype, shape, offset=0, window=1, mode='r+',
+                 advice=None):
+        """Initialise a new :class:`WindowedMemmapArray`.
+        
+        Args:
+            fileobj: The open file object which contains the array.
+            dtype: The :class:`numpy dtype <numpy.dtype>` of the stored values.
+            shape: The shape of the array.
+            offset: The position of the start of the array in the file.
+            window: The number of sections to map at a time.
+            mode: The mode to use for the memory maps: ``'r'`` for read-only,
+                or ``'r+'`` for read and write.
+            advice: The name of a ``MADV_*`` constant to pass to the C
+                library's ``madvise()`` each time a window is mapped, or
+                :data:`None`.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the window is smaller than one
+                section, or the file is too small to contain the array.
+        """
+        if window < 1:
+            raise ValueError("Window must contain at least one section")
+        super(WindowedMemmapArray, self).__init__(shape, dtype)
+        fileobj.seek(0, os.SEEK_END)
+        if fileobj.tell() < offset + self.nbytes:
+            raise ValueError("mmap length is greater than file size")
+        self._fileobj = fileobj
+        self._offset = offset
+        self._window = int(window)
+        self._mode = mode
+        self._advice = advice
+        self._flags = _ArrayFlags(mode != 'r')
+        self._window_start = None
+        self._window_map = None
+    
+    @property
+    def flags(self):
+        """The array's flags. Only ``flags.writeable`` is available."""
+        return self._flags
+    
+    @property
+    def window(self):
+        """The number of sections mapped at a time."""
+        return self._window
+    
+    def flush(self):
+        """Write any changes in the current window to the file."""
+        if self._window_map is not None and self._mode != 'r':
+            self._window_map.flush()
+    
+    def release(self):
+        """Flush and unmap the current window, if there is one."""
+        if self._window_map is not None:
+            self.flush()
+            utils._advise_memory(self._window_map, 'MADV_DONTNEED')
+            self._window_map = None
+            self._window_start = None
+    
+    def _section_nbytes(self):
+        nbytes = self.dtype.itemsize
+        for length in self.shape[1:]:
+            nbytes *= length
+        return nbytes
+    
+    def _map_window(self, position):
+        """Return a memmap of the window containing the given section.
+        
+        For a 0-dimensional array, the whole array is mapped.
+        """
+        if self.ndim == 0:
+            start = 0
+        else:
+            start = (position // self._window) * self._window
+        if start != self._window_start:
+            self.release()
+            if self.ndim == 0:
+                shape = ()
+            else:
+                count = min(self._window, self.shape[0] - start)
+                shape = (count,) + self.shape[1:]
+            self._window_map = np.memmap(
+                self._fileobj, dtype=self.dtype, mode=self._mode,
+                offset=self._offset + start * self._section_nbytes(),
+                shape=shape)
+            self._window_start = start
+            if self._advice is not None:
+                utils._advise_memory(self._window_map, self._advice)
+        return self._window_map
+    
+    def _window_groups(self, first_index):
+        """Split a first-axis index into groups of positions in the same
+        window.
+        
+        Yields:
+            Tuples of (start, stop, window, local), where ``start`` and
+            ``stop`` give the range of the group in the indexed result,
+            ``window`` is the mapped window and ``local`` is an array of
+            positions within the window.
+        """
+        positions = np.arange(*first_index.indices(self.shape[0]))
+        windows = positions // self._window
+        start = 0
+        while start < len(positions):
+            stop = start + 1
+            while stop < len(positions) and windows[stop] == windows[start]:
+                stop += 1
+            window = self._map_window(positions[start])
+            yield (start, stop, window,
+                   positions[start:stop] - self._window_start)
+            start = stop
+    
+    def _empty_result(self, rest):
+        """Return an empty array with the shape of an empty first-axis slice
+        indexed by ``rest``."""
+        empty = np.empty((0,) + self.shape[1:], dtype=self.dtype)
+        return empty[(slice(0, 0),) + rest]
+    
+    def _get(self, index):
+        if self.ndim == 0:
+            return np.array(self._map_window(0))
+        first, rest = index[0], index[1:]
+        if not isinstance(first, slice):
+            window = self._map_window(first)
+            return np.array(window[(first - self._window_start,) + rest])
+        pieces = [self._empty_result(rest)]
+        for _, _, window, local in self._window_groups(first):
+            pieces.append(window[(local,) + rest])
+        return np.concatenate(pieces)
+    
+    def _set(self, index, value):
+        if not self._flags.writeable:
+            raise ValueError("assignment destination is read-only")
+        if self.ndim == 0:
+            self._map_window(0)[()] = value
+            return
+        first, rest = index[0], index[1:]
+        if not isinstance(first, slice):
+            window = self._map_window(first)
+            window[(first - self._window_start,) + rest] = value
+            return
+        result_shape = self._empty_result(rest).shape[1:]
+        count = len(range(*first.indices(self.shape[0])))
+        value = np.broadcast_to(np.asarray(value), (count,) + result_shape)
+        for start, stop, window, local in self._window_groups(first):
+            window[(local,) + rest] = value[start:stop]
+
+
+class TransposedArray(LazyArray):
+    
+    """A view of an array-like object with its axes permuted.
+    
+    This is the lazy equivalent of :func:`numpy.transpose`, for arrays such as
+    the other :class:`LazyArray` classes which cannot be transposed directly
+    without loading all of their values. Each index is converted to an index
+    into the base array, and only the requested values are read or written.
+    
+    """
+    
+    def __init__(self, array, axes):
+        """Initialise a new :class:`TransposedArray`.
+        
+        Args:
+            array: The array-like object to transpose.
+            axes: A permutation of the axes of ``array``, as for
+                :func:`numpy.transpose`. Axis ``i`` of this array is axis
+                ``axes[i]`` of the base array.
+        """
+        axes = tuple(int(axis) for axis in axes)
+        if sorted(axes) != list(range(len(array.shape))):
+            raise ValueError("Axes {0} are not a permutation of the array's "
+                             "axes".format(axes))
+        shape = tuple(array.shape[axis] for axis in axes)
+        super(TransposedArray, self).__init__(shape, array.dtype, base=array)
+        self.axes = axes
+    
+    def _base_index(self, index):
+        """Convert an index into this array to an index into the base array.
+        
+        Returns:
+            A tuple ``(base_index, order)``, where ``order`` gives the axes to
+            transpose the result of indexing the base array into the order of
+            this array.
+        """
+        base_index = [None] * self.ndim
+        for item, axis in zip(index, self.axes):
+            base_index[axis] = item
+        kept = [axis for item, axis in zip(index, self.axes)
+                if isinstance(item, slice)]
+        base_order = sorted(kept)
+        return tuple(base_index), [base_order.index(axis) for axis in kept]
+    
+    def _get(self, index):
+        base_index, order = self._base_index(index)
+        return np.transpose(np.asarray(self._base[base_index]), order)
+    
+    def _set(self, index, value):
+        base_index, order = self._base_index(index)
+        shape = tuple(len(range(*item.indices(length)))
+                      for item, length in zip(index, self.shape)
+                      if isinstance(item, slice))
+        value = np.broadcast_to(np.asarray(value, dtype=self.dtype), shape)
+        self._base[base_index] = np.transpose(value, np.argsort(order))
+
+
+class FileRegionArray(LazyArray):
+    
+    """The data array of an MRC file, read by file name on demand.
+    
+    Uncompressed files are not held open: each read opens the file through a
+    read-only memory map, reads only the requested region and closes it
+    again. This makes the array cheap to copy and safe to pickle, so it can
+    be shared with other processes (for example, as the source of a
+    :func:`dask array <mrcfile.to_dask>`), each of which then reads its own
+    part of the file.
+    
+    Compressed files cannot be read from an arbitrary position, so they must
+    have a bricked sidecar file (see :mod:`mrcfile.bricks`), which is used
+    instead. Each thread keeps its own
+    :class:`~mrcfile.bricks.BrickedReader` open, so the sidecar's index is
+    read only once and its cache of decoded bricks is reused between reads.
+    Call :meth:`close` to close the readers. They are not pickled with the
+    array.
+    
+    """
+    
+    def __init__(self, name, shape, dtype, sidecar=None):
+        """Initialise a new :class:`FileRegionArray`.
+        
+        Args:
+            name: The name of the MRC file.
+            shape: The shape of the file's data array.
+            dtype: The :class:`numpy dtype <numpy.dtype>` of the file's data
+                array (after unpacking or dequantising, if necessary).
+            sidecar: The name of a bricked sidecar file to read from instead
+                of the MRC file, or :data:`None` (the default) to read the MRC
+                file directly.
+        """
+        super(FileRegionArray, self).__init__(shape, dtype)
+        self.name = name
+        self.sidecar = sidecar
+        self._init_readers()
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['_readers', '_readers_lock', '_local']:
+            del state[key]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_readers()
+    
+    def close(self):
+        """Close the sidecar file readers opened by all threads."""
+        with self._readers_lock:
+            readers = self._readers
+            self._init_readers()
+        for reader in readers:
+            reader.close()
+    
+    def _init_readers(self):
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._local = threading.local()
+    
+    def _reader(self):
+        """Return this thread's sidecar file reader, opening it if needed."""
+        reader = getattr(self._local, 'reader', None)
+        if reader is None:
+            # Imported here because the bricks module depends on this one
+            from .bricks import BrickedReader
+            reader = BrickedReader(self.name, sidecar=self.sidecar)
+            self._local.reader = reader
+            with self._readers_lock:
+                self._readers.append(reader)
+        return reader
+    
+    def _get(self, index):
+        if self.sidecar is not None:
+            return self._reader().read_region(index)
+        # Imported here because the mrcmemmap module depends on this one
+        from .mrcmemmap import MrcMemmap
+        with MrcMemmap(self.name, mode='r') as mrc:
+            return np.array(mrc.data[index])
@@ -19,6 +19,8 @@ from __future__ import (absolute_import, division, print_function,
 import os
 import warnings
 
+from . import utils
+from .constants import STREAM_BLOCK_BYTES
 from .mrcinterpreter import MrcInterpreter
 
 
@@ -28,7 +30,7 @@ class MrcFile(MrcInterpreter):
     
     The header and data are handled as numpy arrays - see
     :class:`~mrcfile.mrcobject.MrcObject` for details.
-        
+    
     :class:`MrcFile` supports a permissive read mode for attempting to open
     corrupt or invalid files. See
     :class:`mrcfile.mrcinterpreter.MrcInterpreter` or the :doc:`usage guide
@@ -50,7 +52,7 @@ class MrcFile(MrcInterpreter):
     """
     
     def __init__(self, name, mode='r', overwrite=False, permissive=False,
-                 **kwargs):
+                 header_only=False, cache=None, **kwargs):
         """Initialise a new :class:`MrcFile` object.
         
         The given file name is opened in the given mode. For mode ``r`` or
@@ -70,12 +72,22 @@ class MrcFile(MrcInterpreter):
             permissive: Read the file in permissive mode. (See
                 :class:`mrcfile.mrcinterpreter.MrcInterpreter` for details.)
                 The default is :data:`False`.
+            header_only: Only read the header and extended header from the
+                file, not the data block. (See
+                :class:`mrcfile.mrcinterpreter.MrcInterpreter` for details.)
+                The default is :data:`False`.
+            cache: Set to ``'drop'`` to avoid filling the operating system's
+                page cache with data which will only be read once. As the
+                data block is read, the part of the file which has already
+                been read is dropped from the cache, and the next part is
+                requested in advance. The default is :data:`None`, for normal
+                caching.
         
         Raises:
             :class:`~exceptions.ValueError`: If the mode is not one of ``r``,
-                ``r+`` or ``w+``, the file is not a valid MRC file, or if the
-                mode is ``w+``, the file already exists and overwrite is
-                :data:`False`.
+                ``r+`` or ``w+``, the cache option is not recognised, the file
+                is not a valid MRC file, or if the mode is ``w+``, the file
+                already exists and overwrite is :data:`False`.
             :class:`~exceptions.OSError`: If the mode is ``r`` or ``r+`` and
                 the file does not exist.
         
@@ -84,10 +96,13 @@ class MrcFile(MrcInterpreter):
                 data block is longer than expected from the dimensions in the
                 header.
         """
-        super(MrcFile, self).__init__(permissive=permissive, **kwargs)
+        super(MrcFile, self).__init__(permissive=permissive,
+                                      header_only=header_only, **kwargs)
         
         if mode not in ['r', 'r+', 'w+']:
             raise ValueError("Mode '{0}' not supported".format(mode))
+        if cache not in [None, 'drop']:
+            raise ValueError("Cache option '{0}' not supported".format(cache))
         
         if ('w' in mode and os.path.exists(name) and not overwrite):
             raise ValueError("File '{0}' already exists; set overwrite=True "
@@ -95,6 +110,7 @@ class MrcFile(MrcInterpreter):
         
         self._mode = mode
         self._read_only = (self._mode == 'r')
+        self._cache = cache
         
         self._open_file(name)
         
@@ -107,6 +123,15 @@ class MrcFile(MrcInterpreter):
             self._close_file()
             raise
     
+    # Read the extended header only when it is first accessed. This is turned
+    # off for compressed files, where seeking back to it would mean
+    # decompressing the start of the file again.
+    _defer_extended_header = True
+    
+    # Largest read to make at once with cache='drop', so that the part of the
+    # file already read can be dropped from the page cache as reading goes on
+    _cache_block_bytes = STREAM_BLOCK_BYTES
+    
     def __repr__(self):
         return "MrcFile('{0}', mode='{1}')".format(self._iostream.name,
                                                    self._mode)
@@ -124,14 +149,101 @@ class MrcFile(MrcInterpreter):
         if self.data is not None:
             actual_size = self._get_file_size()
             expected_size = (self.header.nbytes
-                             + self.extended_header.nbytes
-                             + self.data.nbytes)
+                             + int(self.header.nsymbt)
+                             + utils.data_nbytes_from_header(self.header))
             
             if actual_size > expected_size:
                 msg = ("MRC file is {0} bytes larger than expected"
                        .format(actual_size - expected_size))
                 warnings.warn(msg, RuntimeWarning)
     
+    def _read_data_bytes(self, nbytes, read_ahead=0):
+        """Override :meth:`_read_data_bytes` to advise the operating system
+        about caching, if ``cache='drop'`` was given.
+        
+        Large reads (such as the whole data block, when the file is opened)
+        are split into blocks of at most :data:`STREAM_BLOCK_BYTES`. After
+        each block, the part of the file before the current position is
+        dropped from the page cache, and the next block (or, after the last
+        block, the next ``read_ahead`` bytes) is requested. This keeps the
+        amount of the file in the page cache bounded. It uses
+        :func:`os.posix_fadvise`, and nothing is done on platforms which do
+        not support it.
+        """
+        read = super(MrcFile, self)._read_data_bytes
+        if self._cache != 'drop':
+            return read(nbytes)
+        block_bytes = self._cache_block_bytes
+        if nbytes <= block_bytes:
+            data_bytes = read(nbytes)
+            self._advise_cache(read_ahead)
+            return data_bytes
+        data_bytes = bytearray(nbytes)
+        position = 0
+        while position < nbytes:
+            count = min(block_bytes, nbytes - position)
+            block = read(count)
+            data_bytes[position:position + len(block)] = block
+            position += len(block)
+            if len(block) < count:
+                # End of the stream: return what was read
+                self._advise_cache(0)
+                del data_bytes[position:]
+                break
+            remaining = nbytes - position
+            self._advise_cache(min(block_bytes, remaining) if remaining
+                               else read_ahead)
+        return data_bytes
+    
+    def _advise_cache(self, read_ahead):
+        """Drop the part of the file already read from the page cache, and
+        ask for the next ``read_ahead`` bytes to be loaded.
+        
+        Positions are taken from the underlying file descriptor, so this also
+        works for compressed files (where the data is decompressed from the
+        file in sequence).
+        """
+        if not hasattr(os, 'posix_fadvise'):
+            return
+        try:
+            fd = self._iostream.fileno()
+            position = os.lseek(fd, 0, os.SEEK_CUR)
+            if position > 0:
+                os.posix_fadvise(fd, 0, position, os.POSIX_FADV_DONTNEED)
+            if read_ahead > 0:
+                os.posix_fadvise(fd, position, read_ahead,
+                                 os.POSIX_FADV_WILLNEED)
+        except (AttributeError, OSError, ValueError):
+            # Caching advice is only a hint, so ignore streams which do not
+            # support it
+            pass
+    
+    def _read_extended_header(self):
+        """Override :meth:`_read_extended_header` to skip over the extended
+        header without reading it.
+        
+        The extended header is read from the file by
+        :meth:`_load_extended_header` when the :attr:`extended_header`
+        attribute is first accessed, so opening a file with a very large
+        extended header (particularly in header-only mode) is fast if the
+        extended header is not needed.
+        """
+        if self._defer_extended_header and self.header.nsymbt > 0:
+            self._extended_header = None
+            self._iostream.seek(int(self.header.nsymbt), os.SEEK_CUR)
+        else:
+            super(MrcFile, self)._read_extended_header()
+    
+    def _load_extended_header(self):
+        """Read the extended header from the file, leaving the file position
+        unchanged."""
+        position = self._iostream.tell()
+        try:
+            self._iostream.seek(self.header.nbytes)
+            super(MrcFile, self)._read_extended_header()
+        finally:
+            self._iostream.seek(position)
+    
     def _get_file_size(self):
         """Return the size of the underlying file object, in bytes."""
         pos = self._iostream.tell()
@@ -153,7 +265,7 @@ class MrcFile(MrcInterpreter):
         """Close the file object."""
         self._iostream.close()
     
-    def validate(self, print_file=None):
+    def validate(self, print_file=None, sample=None):
         """Validate this MRC file.
         
         The tests are:
@@ -164,7 +276,7 @@ class MrcFile(MrcInterpreter):
            ``0x44 0x44 0x00 0x00``, ``0x44 0x41 0x00 0x00`` or
            ``0x11 0x11 0x00 0x00``.
         #. MRC mode: the ``mode`` field should be one of the supported mode
-           numbers: 0, 1, 2, 4 or 6.
+           numbers: 0, 1, 2, 4, 6 or 12.
         #. Map and cell dimensions: The header fields ``nx``, ``ny``, ``nz``,
            ``mx``, ``my``, ``mz``, ``cella.x``, ``cella.y`` and ``cella.z``
            must all be positive numbers.
@@ -192,23 +304,35 @@ class MrcFile(MrcInterpreter):
                 argument of Python's :func:`print` function. The default is
                 :data:`None`, which means output will be printed to
                 :data:`sys.stdout`.
+            sample: Estimate the data statistics from a random sample of
+                sections instead of all of the data. See
+                :meth:`MrcObject.validate()
+                <mrcfile.mrcobject.MrcObject.validate>` for details. The
+                default is :data:`None`, to check all of the data.
         
         Returns:
             :data:`True` if the file is valid, or :data:`False` if the file
             does not meet the MRC format specification in any way.
         """
-        valid = super(MrcFile, self).validate(print_file=print_file)
+        valid = super(MrcFile, self).validate(print_file=print_file,
+                                              sample=sample)
         
-        if self.data is not None:
+        try:
+            data_nbytes = utils.data_nbytes_from_header(self.header)
+        except ValueError:
+            data_nbytes = None
+        
+        if self._data_is_available() and data_nbytes is not None:
             # Check file size
             file_size = self._get_file_size()
             mrc_size = (self.header.nbytes
-                        + self.extended_header.nbytes
-                        + self.data.nbytes)
+                        + int(self.header.nsymbt)
+                        + data_nbytes)
             if (file_size != mrc_size):
-                print("File is larger than expected. Actual size: {0} bytes; "
-                      "expected size: {1} bytes (calculated from header)"
-                      .format(file_size, mrc_size),
+                size_error = 'larger' if file_size > mrc_size else 'smaller'
+                print("File is {0} than expected. Actual size: {1} bytes; "
+                      "expected size: {2} bytes (calculated from header)"
+                      .format(size_error, file_size, mrc_size),
                       file=print_file)
                 valid = False
         else:
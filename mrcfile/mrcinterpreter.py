@@ -16,6 +16,7 @@ Classes:
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import os
 import warnings
 
 import numpy as np
@@ -23,7 +24,7 @@ import numpy as np
 from . import utils
 from .dtypes import HEADER_DTYPE
 from .mrcobject import MrcObject
-from .constants import MAP_ID
+from .constants import MAP_ID, STREAM_BLOCK_BYTES, PACKED_4BIT_MODE
 
 
 class MrcInterpreter(MrcObject):
@@ -50,7 +51,7 @@ class MrcInterpreter(MrcObject):
     #. The machine stamp is invalid and so the data's byte order cannot be
        determined.
     #. The mode number is not recognised. Currently accepted modes are 0, 1, 2,
-       4 and 6.
+       4, 6, 12 and 101.
     #. The data block is not large enough for the specified data type and
        dimensions.
     
@@ -63,6 +64,14 @@ class MrcInterpreter(MrcObject):
     header, and then call :meth:`_read` again to read the data correctly. See
     the :doc:`usage guide <../usage_guide>` for more details.
     
+    If ``header_only`` is set to :data:`True`, only the header and extended
+    header are read and the :attr:`data` attribute is set to :data:`None`.
+    This is much faster for large files if the data is not needed. Data
+    statistics can still be calculated for validation, by streaming through
+    the data block a chunk at a time. In a writeable header-only object, the
+    header can be modified (and the extended header replaced with one of the
+    same size) without rewriting the data block.
+    
     Methods:
     
     * :meth:`flush`
@@ -72,10 +81,13 @@ class MrcInterpreter(MrcObject):
     
     * :meth:`_read`
     * :meth:`_read_data`
+    * :meth:`_read_data_bytes`
+    * :meth:`_extended_header_padding`
     
     """
     
-    def __init__(self, iostream=None, permissive=False, **kwargs):
+    def __init__(self, iostream=None, permissive=False, header_only=False,
+                 **kwargs):
         """Initialise a new MrcInterpreter object.
         
         This initialiser reads the stream if it is given. In general,
@@ -93,6 +105,8 @@ class MrcInterpreter(MrcObject):
                 default is :data:`None`.
             permissive: Read the stream in permissive mode. The default is
                 :data:`False`.
+            header_only: Only read the header and extended header from the
+                stream, not the data block. The default is :data:`False`.
         
         Raises:
             :class:`~exceptions.ValueError`: If ``iostream`` is given and the
@@ -102,6 +116,7 @@ class MrcInterpreter(MrcObject):
         
         self._iostream = iostream
         self._permissive = permissive
+        self._header_only = header_only
         
         # If iostream is given, initialise by reading it
         if self._iostream is not None:
@@ -140,7 +155,8 @@ class MrcInterpreter(MrcObject):
         
         Before calling this method, the stream should be open and positioned at
         the start of the header. This method will advance the stream to the end
-        of the data block.
+        of the data block (or to the start of the data block, if this object
+        is in header-only mode).
         
         Raises:
             :class:`~exceptions.ValueError`: If the file is not a valid MRC
@@ -148,7 +164,10 @@ class MrcInterpreter(MrcObject):
         """
         self._read_header()
         self._read_extended_header()
-        self._read_data()
+        if self._header_only:
+            self._data = None
+        else:
+            self._read_data()
 
     def _read_header(self):
         """Read the MRC header from the I/O stream.
@@ -201,9 +220,13 @@ class MrcInterpreter(MrcObject):
         """Read the extended header from the stream.
         
         If there is no extended header, a zero-length array is assigned to the
-        extended_header attribute.
+        extended_header attribute. Any space reserved at the end of the
+        extended header is skipped over and not included in the array.
         """
         ext_header_str = self._iostream.read(int(self.header.nsymbt))
+        reserve = utils.extended_header_reserve_from_header(self.header)
+        if reserve > 0:
+            ext_header_str = ext_header_str[:int(self.header.nsymbt) - reserve]
         self._extended_header = np.fromstring(ext_header_str, dtype='V1')
         self._extended_header.flags.writeable = not self._read_only
     
@@ -225,12 +248,9 @@ class MrcInterpreter(MrcObject):
                 raise
         
         shape = utils.data_shape_from_header(self.header)
+        nbytes = utils.data_nbytes_from_header(self.header)
         
-        nbytes = dtype.itemsize
-        for axis_length in shape:
-            nbytes *= axis_length
-        
-        data_bytes = self._iostream.read(nbytes)
+        data_bytes = self._read_data_bytes(nbytes)
         
         if len(data_bytes) < nbytes:
             msg = ("Expected {0} bytes in data block but could only read {1}"
@@ -242,9 +262,150 @@ class MrcInterpreter(MrcObject):
             else:
                 raise ValueError(msg)
         
-        self._data = np.frombuffer(data_bytes, dtype=dtype).reshape(shape)
+        self._data = self._decode_data(data_bytes, dtype, shape)
         self._data.flags.writeable = not self._read_only
     
+    def _read_data_bytes(self, nbytes, read_ahead=0):
+        """Read part of the data block from the stream.
+        
+        Subclasses can override this to act on each read, for example to give
+        advice to the operating system about caching.
+        
+        Args:
+            nbytes: The number of bytes to read.
+            read_ahead: The number of bytes which are expected to be read next.
+                This is ignored here.
+        
+        Returns:
+            The bytes that were read, which might be fewer than ``nbytes`` if
+            the end of the stream is reached.
+        """
+        return self._iostream.read(nbytes)
+    
+    def _decode_data(self, data_bytes, dtype, shape):
+        """Convert bytes from the data block into a data array.
+        
+        Packed 4-bit data (mode 101) is unpacked into a new uint8 array, and
+        quantised data is converted into a new float32 array. Otherwise, the
+        returned array shares memory with ``data_bytes``.
+        
+        Args:
+            data_bytes: The bytes from the file.
+            dtype: The dtype of the data array, from the header.
+            shape: The shape of the data array.
+        
+        Returns:
+            A :class:`numpy array <numpy.ndarray>` with the given shape.
+        """
+        if self.header.mode == PACKED_4BIT_MODE:
+            packed_shape = shape[:-1] + ((shape[-1] + 1) // 2,)
+            packed = np.frombuffer(data_bytes, dtype=dtype).reshape(packed_shape)
+            return utils.unpack_4bit_data(packed, shape[-1])
+        data = np.frombuffer(data_bytes, dtype=dtype).reshape(shape)
+        quantization = utils.quantization_from_header(self.header)
+        if quantization is not None:
+            data = utils.dequantize_data(data, *quantization)
+        return data
+    
+    def _encode_data(self):
+        """Return the data array in the form it should be written to the
+        file.
+        
+        Packed 4-bit data (mode 101) is packed two values to a byte, and
+        quantised data is converted back to integers. For all other modes the
+        data array is returned unchanged, if it is already C-contiguous.
+        """
+        if self.header.mode == PACKED_4BIT_MODE:
+            return utils.pack_4bit_data(self.data)
+        quantization = utils.quantization_from_header(self.header)
+        if quantization is not None:
+            return utils.quantize_data(self.data, quantization[0],
+                                       quantization[1],
+                                       utils.data_dtype_from_header(self.header))
+        return np.ascontiguousarray(self.data)
+    
+    def _data_is_available(self):
+        """Override :meth:`~mrcfile.mrcobject.MrcObject._data_is_available`
+        to allow the data to be streamed in header-only mode."""
+        return self._data is not None or self._header_only
+    
+    def _iter_section_blocks(self, max_bytes=STREAM_BLOCK_BYTES):
+        """Override :meth:`~mrcfile.mrcobject.MrcObject._iter_section_blocks`
+        to stream the data from the I/O stream in header-only mode.
+        
+        If the data array has not been read, the stream is moved to the start
+        of the data block and then read a block at a time, so only one block is
+        held in memory at once.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the data is being streamed and
+                the header's mode is not recognised, or the data block is not
+                large enough for the dimensions given in the header.
+        """
+        if self._data is not None:
+            for block in super(MrcInterpreter, self)._iter_section_blocks(
+                    max_bytes):
+                yield block
+            return
+        
+        dtype = utils.data_dtype_from_header(self.header)
+        shape = utils.data_shape_from_header(self.header)
+        section_shape = shape[-2:]
+        n_sections = 1
+        for axis_length in shape[:-2]:
+            n_sections *= axis_length
+        row_length = section_shape[1]
+        if self.header.mode == PACKED_4BIT_MODE:
+            row_length = (row_length + 1) // 2
+        section_nbytes = dtype.itemsize * section_shape[0] * row_length
+        per_block = max(1, max_bytes // max(section_nbytes, 1))
+        
+        self._iostream.seek(self.header.nbytes + int(self.header.nsymbt))
+        for start in range(0, n_sections, per_block):
+            count = min(per_block, n_sections - start)
+            nbytes = count * section_nbytes
+            next_count = min(per_block, n_sections - start - count)
+            data_bytes = self._read_data_bytes(
+                nbytes, read_ahead=next_count * section_nbytes)
+            if len(data_bytes) < nbytes:
+                raise ValueError("Expected {0} bytes in data block but could "
+                                 "only read {1}"
+                                 .format(n_sections * section_nbytes,
+                                         start * section_nbytes
+                                         + len(data_bytes)))
+            yield self._decode_data(data_bytes, dtype,
+                                    (count,) + section_shape)
+    
+    def set_extended_header(self, extended_header, reserve=None):
+        """Replace the extended header.
+        
+        In header-only mode, the data block has not been read and so cannot be
+        moved, and the new extended header (including any reserved space) must
+        take up the same number of bytes as the existing one. An extended
+        header with reserved space can therefore grow into that space.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If this object is in header-only
+                mode with no data array and the new extended header would
+                change the size of the existing one.
+        """
+        if self._data is None and self._header_only:
+            nbytes = extended_header.nbytes
+            if (nbytes + self._extended_header_reserve_for(nbytes, reserve)
+                    != self.header.nsymbt):
+                raise ValueError("Cannot change the size of the extended "
+                                 "header when the data block has not been "
+                                 "read")
+        super(MrcInterpreter, self).set_extended_header(extended_header,
+                                                        reserve)
+    
+    def _extended_header_padding(self):
+        """Get the zero bytes which fill the space reserved after the extended
+        header in the stream.
+        """
+        reserve = int(self.header.nsymbt) - self.extended_header.nbytes
+        return b'\0' * max(reserve, 0)
+    
     def close(self):
         """Flush to the stream and clear the header and data attributes."""
         if self._header is not None and not self._iostream.closed:
@@ -258,6 +419,11 @@ class MrcInterpreter(MrcObject):
         
         This implementation seeks to the start of the stream, writes the
         header, extended header and data arrays, and then truncates the stream.
+        If the data has not been read (in header-only mode), only the header and
+        extended header are written and the data block is left unchanged. If
+        the extended header has not been loaded (see
+        :meth:`~mrcfile.mrcobject.MrcObject._load_extended_header`), it is
+        left unchanged too.
         
         Subclasses should override this implementation for streams which do not
         support :meth:`~io.IOBase.seek` or :meth:`~io.IOBase.truncate`.
@@ -265,7 +431,13 @@ class MrcInterpreter(MrcObject):
         if not self._read_only:
             self._iostream.seek(0)
             self._iostream.write(self.header)
-            self._iostream.write(self.extended_header)
-            self._iostream.write(np.ascontiguousarray(self.data))
-            self._iostream.truncate()
+            if self._extended_header is None:
+                # The extended header has not been loaded, so is unchanged
+                self._iostream.seek(int(self.header.nsymbt), os.SEEK_CUR)
+            else:
+                self._iostream.write(self.extended_header)
+                self._iostream.write(self._extended_header_padding())
+            if self.data is not None:
+                self._iostream.write(self._encode_data())
+                self._iostream.truncate()
             self._iostream.flush()
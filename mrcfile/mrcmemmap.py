@@ -16,6 +16,7 @@ Classes:
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import errno
 import os
 import warnings
 
@@ -23,6 +24,18 @@ import numpy as np
 
 import mrcfile.utils as utils
 from .mrcfile import MrcFile
+from .lazyarrays import (LazyArray, Packed4BitArray, DequantizedArray,
+                         WindowedMemmapArray)
+from .constants import PACKED_4BIT_MODE, STREAM_BLOCK_BYTES
+
+
+# Names of the madvise() advice constants for each access pattern
+_ACCESS_ADVICE = {
+    'sequential': 'MADV_SEQUENTIAL',
+    'random': 'MADV_RANDOM',
+    'willneed': 'MADV_WILLNEED',
+    'hugepage': 'MADV_HUGEPAGE',
+}
 
 
 class MrcMemmap(MrcFile):
@@ -36,58 +49,221 @@ class MrcMemmap(MrcFile):
     
     Usage is the same as for :class:`~mrcfile.mrcfile.MrcFile`.
     
+    Packed 4-bit data (mode 101) and quantised data cannot be represented
+    directly by a memmap array. Instead, the data attribute is a
+    :class:`~mrcfile.lazyarrays.Packed4BitArray` or
+    :class:`~mrcfile.lazyarrays.DequantizedArray` which wraps a memmap of the
+    stored values. Indexing it with integers and slices converts only the
+    values that are requested.
+    
     Note that memmap arrays use a fairly small chunk size and so performance
     could be poor on file systems that are optimised for infrequent large I/O
     operations.
     
-    If required, it is possible to create a very large empty file by creating a
-    new MrcMemmap and then calling :meth:`_open_memmap` to create the memmap
-    array, which can then be filled slice-by-slice. Be aware that the contents
-    of a new, empty memmap array depend on your platform: the data values
-    could be garbage or zeros.
+    An access pattern can be given when the file is opened, to tell the
+    operating system how the data will be read (see :meth:`__init__`), and
+    :meth:`prefetch` can be used to ask for upcoming sections to be read in the
+    background. These hints are given with the C library's ``madvise()``
+    function, through :mod:`ctypes`. On platforms which do not support it, a
+    :class:`~exceptions.RuntimeWarning` is issued when an access pattern is
+    given, and the hints are ignored.
+    
+    For scanning through files which are too large to fit in memory, a
+    ``window`` can also be given when the file is opened. Only that many
+    sections are then mapped at a time (see
+    :class:`~mrcfile.lazyarrays.WindowedMemmapArray`), which keeps the memory
+    used by the mapping bounded.
+    
+    To create a very large empty file which can then be filled slice-by-slice,
+    use :func:`mrcfile.new_mmap`, which preallocates the data block on disk
+    without creating any array in memory.
     
     """
     
+    def __init__(self, name, mode='r', overwrite=False, permissive=False,
+                 header_only=False, access=None, window=None, **kwargs):
+        """Initialise a new :class:`MrcMemmap` object.
+        
+        The arguments are the same as for
+        :meth:`MrcFile.__init__() <mrcfile.mrcfile.MrcFile.__init__>`, with
+        one addition:
+        
+        Args:
+            access: A hint about how the data will be accessed, which is
+                passed to the operating system each time the data is mapped.
+                This should be one of ``'sequential'`` (for reading through
+                the data in order, which allows more aggressive read-ahead),
+                ``'random'`` (for reading small parts of the data in no
+                particular order, which prevents wasteful read-ahead),
+                ``'willneed'`` (to start reading the whole data block into the
+                page cache immediately), ``'hugepage'`` (to use huge pages for
+                the mapping, where supported) or :data:`None` (the default;
+                for no hint).
+            window: The number of sections (items along the first axis of the
+                data array) to map into memory at a time. If this is given,
+                the data attribute is a
+                :class:`~mrcfile.lazyarrays.WindowedMemmapArray` instead of a
+                plain memmap, so the amount of the file which is mapped (and
+                can be resident in memory) stays bounded however much of the
+                data is read. The default is :data:`None`, to map the whole
+                data block.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the access pattern is not
+                recognised, or the window is smaller than one section.
+        """
+        if access is not None and access not in _ACCESS_ADVICE:
+            raise ValueError("Unknown access pattern '{0}'".format(access))
+        if window is not None and window < 1:
+            raise ValueError("Window must contain at least one section")
+        advice = _ACCESS_ADVICE.get(access)
+        if advice is not None and not utils._memory_advice_supported(advice):
+            warnings.warn("Access pattern '{0}' is not supported on this "
+                          "platform and will be ignored".format(access),
+                          RuntimeWarning)
+        self._access = access
+        self._window = window
+        self._extended_header_map = None
+        super(MrcMemmap, self).__init__(name, mode=mode, overwrite=overwrite,
+                                        permissive=permissive,
+                                        header_only=header_only, **kwargs)
+    
     def __repr__(self):
         return "MrcMemmap('{0}', mode='{1}')".format(self._iostream.name,
                                                      self._mode)
     
-    def set_extended_header(self, extended_header):
+    def set_extended_header(self, extended_header, reserve=None):
         """Replace the file's extended header.
         
         Note that the file's entire data block must be moved if the extended
-        header size changes. Setting a new extended header can therefore be
-        very time consuming with large files, if the new extended header
-        occupies a different number of bytes than the previous one.
+        header size changes. This is done within the file a block at a time,
+        so memory use is bounded, but it can still be very time consuming
+        with large files if the new extended header occupies a different
+        number of bytes than the previous one. If space has been reserved at
+        the end of the extended header (see
+        :meth:`~mrcfile.mrcobject.MrcObject.set_extended_header`), a new
+        extended header which fits in that space is written in place and the
+        data block is not moved.
         """
         self._check_writeable()
-        if extended_header.nbytes != self._extended_header.nbytes:
-            data_copy = self._data.copy()
+        if self._data is None and self._header_only:
+            # Let the superclass check the size is unchanged
+            super(MrcMemmap, self).set_extended_header(extended_header,
+                                                       reserve)
+            return
+        nbytes = extended_header.nbytes
+        reserve = self._extended_header_reserve_for(nbytes, reserve)
+        if nbytes + reserve != self.header.nsymbt:
+            if np.may_share_memory(extended_header, self._extended_header):
+                # The new extended header is part of the old one, which is
+                # about to be overwritten by the moved data
+                extended_header = np.array(extended_header)
+            stored = self._stored_array()
+            stored_dtype = stored.dtype
+            data_nbytes = stored.nbytes
+            shape = self._data.shape
             self._close_data()
+            old_start = self.header.nbytes + int(self.header.nsymbt)
+            new_start = self.header.nbytes + nbytes + reserve
+            if new_start > old_start:
+                self._iostream.truncate(new_start + data_nbytes)
+            self._move_data_block(old_start, new_start, data_nbytes)
+            if new_start < old_start:
+                self._iostream.truncate(new_start + data_nbytes)
             self._extended_header = extended_header
-            self.header.nsymbt = extended_header.nbytes
-            header_nbytes = self.header.nbytes + extended_header.nbytes
-            self._iostream.truncate(header_nbytes + data_copy.nbytes)
-            self._open_memmap(data_copy.dtype, data_copy.shape)
-            np.copyto(self._data, data_copy)
+            utils.set_header_extended_header_size(self.header, nbytes, reserve)
+            self._open_memmap(stored_dtype, shape)
         else:
             self._extended_header = extended_header
+            utils.set_header_extended_header_size(self.header, nbytes, reserve)
+    
+    def _move_data_block(self, source, destination, nbytes,
+                         max_bytes=STREAM_BLOCK_BYTES):
+        """Move a block of bytes within the file.
+        
+        The bytes are copied in chunks of at most ``max_bytes``, working from
+        the end of the block if it is moving towards the end of the file, or
+        from the start otherwise, so the source and destination can overlap.
+        The file must already be large enough to hold the destination block.
+        
+        Args:
+            source: The current offset of the block in the file.
+            destination: The new offset of the block.
+            nbytes: The size of the block.
+            max_bytes: The maximum size of each chunk.
+        """
+        if source == destination:
+            return
+        starts = range(0, nbytes, max_bytes)
+        if destination > source:
+            starts = reversed(starts)
+        for start in starts:
+            size = min(max_bytes, nbytes - start)
+            self._iostream.seek(source + start)
+            chunk = self._iostream.read(size)
+            self._iostream.seek(destination + start)
+            self._iostream.write(chunk)
+        self._iostream.flush()
     
     def flush(self):
         """Flush the header and data arrays to the file buffer."""
         if not self._read_only:
             self._iostream.seek(0)
             self._iostream.write(self.header)
-            self._iostream.write(self.extended_header)
+            if (self._extended_header is not None
+                    and self._extended_header is self._extended_header_map):
+                # Changes are written straight to the file
+                self._extended_header.flush()
+                self._iostream.seek(int(self.header.nsymbt), os.SEEK_CUR)
+            else:
+                self._iostream.write(self.extended_header)
+                self._iostream.write(self._extended_header_padding())
             
             # Flushing the file before the mmap makes the mmap flush faster
             self._iostream.flush()
-            self._data.flush()
-            self._iostream.flush()
-            
-            # Seek to end of data block so stream is left in the same position
-            # as normal
-            self._iostream.seek(self._data.nbytes, os.SEEK_CUR)
+            if self._data is not None:
+                self._data.flush()
+                self._iostream.flush()
+                
+                # Seek to end of data block so stream is left in the same
+                # position as normal
+                self._iostream.seek(self._stored_array().nbytes,
+                                    os.SEEK_CUR)
+    
+    def _read_extended_header(self):
+        """Override :meth:`_read_extended_header` to memory-map the extended
+        header.
+        
+        Records in the extended header can then be read and changed without
+        reading or rewriting the rest of it. Extended headers which are empty,
+        or which extend beyond the end of the file, are read normally instead.
+        Any space reserved at the end of the extended header is not mapped.
+        """
+        nsymbt = int(self.header.nsymbt)
+        nbytes = nsymbt - utils.extended_header_reserve_from_header(self.header)
+        start = self.header.nbytes
+        if nbytes <= 0 or self._get_file_size() < start + nbytes:
+            self._iostream.seek(start)
+            super(MrcMemmap, self)._read_extended_header()
+            return
+        acc_mode = 'r' if self._read_only else 'r+'
+        self._extended_header_map = np.memmap(self._iostream, dtype='V1',
+                                              mode=acc_mode, offset=start,
+                                              shape=(nbytes,))
+        self._extended_header = self._extended_header_map
+        self._iostream.seek(start + nsymbt)
+    
+    def close(self):
+        """Override :meth:`close` to make a memory-mapped extended header
+        read-only after the file is closed.
+        
+        Changes to the array through any remaining references would otherwise
+        still change the file contents.
+        """
+        super(MrcMemmap, self).close()
+        if self._extended_header_map is not None:
+            self._extended_header_map.flags.writeable = False
+            self._extended_header_map = None
     
     def _read_data(self):
         """Read the data block from the file.
@@ -109,19 +285,191 @@ class MrcMemmap(MrcFile):
         
         shape = utils.data_shape_from_header(self.header)
         
+        if self._permissive:
+            # Check the file is large enough, since opening a memmap on a file
+            # which is too small would raise an exception
+            nbytes = utils.data_nbytes_from_header(self.header)
+            header_nbytes = self.header.nbytes + self.header.nsymbt
+            available = max(self._get_file_size() - header_nbytes, 0)
+            if available < nbytes:
+                msg = ("Expected {0} bytes in data block but could only read "
+                       "{1}".format(nbytes, available))
+                warnings.warn(msg, RuntimeWarning)
+                self._data = None
+                return
+        
         self._open_memmap(dtype, shape)
     
     def _open_memmap(self, dtype, shape):
-        """Open a new memmap array pointing at the file's data block."""
+        """Open a new memmap array pointing at the file's data block.
+        
+        Args:
+            dtype: The dtype of the values stored in the file.
+            shape: The shape of the data array.
+        """
         acc_mode = 'r' if self._read_only else 'r+'
         header_nbytes = self.header.nbytes + self.header.nsymbt
         
+        mapped_shape = shape
+        if self.header.mode == PACKED_4BIT_MODE:
+            # Map the packed bytes and unpack them on demand
+            mapped_shape = shape[:-1] + ((shape[-1] + 1) // 2,)
+        
         self._iostream.flush()
-        self._data = np.memmap(self._iostream,
+        if self._window is not None:
+            advice = _ACCESS_ADVICE.get(self._access)
+            memmap = WindowedMemmapArray(self._iostream, dtype, mapped_shape,
+                                         offset=header_nbytes,
+                                         window=self._window, mode=acc_mode,
+                                         advice=advice)
+        else:
+            memmap = np.memmap(self._iostream,
                                dtype=dtype,
                                mode=acc_mode,
                                offset=header_nbytes,
-                               shape=shape)
+                               shape=mapped_shape)
+        
+        quantization = utils.quantization_from_header(self.header)
+        if self.header.mode == PACKED_4BIT_MODE:
+            self._data = Packed4BitArray(memmap, shape[-1])
+        elif quantization is not None:
+            self._data = DequantizedArray(memmap, *quantization)
+        else:
+            self._data = memmap
+        
+        if self._access is not None and self._window is None:
+            self._advise(_ACCESS_ADVICE[self._access])
+    
+    def prefetch(self, index):
+        """Ask the operating system to start reading part of the data.
+        
+        This returns immediately, and the requested part of the file is read
+        into the page cache in the background, so it is ready by the time it is
+        accessed. For example, when processing a stack of images one at a time,
+        call ``prefetch(slice(i + 1, i + 3))`` before processing image ``i``.
+        (Slices are clipped to the size of the data, as for normal indexing.)
+        
+        This is only a hint, and nothing is done if the platform does not
+        support it.
+        
+        Args:
+            index: An integer or :class:`slice` selecting the sections (or
+                volumes, for a volume stack) to read, along the first axis of
+                the data array.
+        
+        Returns:
+            :data:`True` if the hint was given to the operating system, or
+            :data:`False` if it is not supported.
+        """
+        if self._data is None or self._data.ndim == 0:
+            return False
+        length = self._data.shape[0]
+        if isinstance(index, slice):
+            positions = range(*index.indices(length))
+            if len(positions) == 0:
+                return False
+            first, last = min(positions), max(positions)
+        else:
+            first = last = int(index)
+            if first < 0:
+                first = last = first + length
+            if not 0 <= first < length:
+                raise IndexError("index {0} is out of bounds for axis with "
+                                 "size {1}".format(index, length))
+        stride = self._stored_array().nbytes // length
+        return self._advise('MADV_WILLNEED', first * stride,
+                            (last + 1) * stride)
+    
+    def _stored_array(self):
+        """Return the memmap (or windowed memmap) of the stored values."""
+        stored = self._data
+        while isinstance(stored, LazyArray) and stored.base is not None:
+            stored = stored.base
+        return stored
+    
+    def _advise(self, advice, start=0, stop=None):
+        """Pass advice about part of the data block to the operating system.
+        
+        Args:
+            advice: The name of the :mod:`mmap` constant to use, for example
+                ``'MADV_WILLNEED'``.
+            start: The start of the region, in bytes from the start of the
+                data block.
+            stop: The end of the region, or :data:`None` for the end of the
+                data block.
+        
+        Returns:
+            :data:`True` if the advice was given, or :data:`False` if it is
+            not supported on this platform.
+        """
+        stored = self._stored_array()
+        if not isinstance(stored, np.memmap):
+            return False
+        return utils._advise_memory(stored, advice, start, stop)
+    
+    def _allocate_data(self, shape, dtype, sparse=True):
+        """Allocate a new data block in the file and open a memmap of it.
+        
+        The header is updated to match the new shape and dtype, and the header
+        statistics are reset. No array is created in memory.
+        
+        Args:
+            shape: The shape of the new data array.
+            dtype: The :class:`numpy dtype <numpy.dtype>` of the new data
+                array.
+            sparse: If :data:`True`, the file is simply extended to the right
+                size, which on most file systems creates a sparse file with no
+                disk space allocated for the data block until it is written.
+                If :data:`False`, disk space is reserved for the whole data
+                block immediately.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the file is read-only, or
+                there is no MRC mode for the given dtype.
+        """
+        self._check_writeable()
+        dtype = np.dtype(dtype)
+        mode = utils.mode_from_dtype(dtype)
+        shape = tuple(int(length) for length in shape)
+        self._close_data()
+        utils.set_header_quantization(self.header, None)
+        self.header.mode = mode
+        data_start = self.header.nbytes + self.header.nsymbt
+        data_nbytes = dtype.itemsize
+        for length in shape:
+            data_nbytes *= length
+        self._iostream.flush()
+        self._iostream.truncate(data_start)
+        if not sparse:
+            self._preallocate(data_start, data_nbytes)
+        self._iostream.truncate(data_start + data_nbytes)
+        self._open_memmap(dtype, shape)
+        self.update_header_from_data()
+        self.reset_header_stats()
+    
+    def _preallocate(self, offset, nbytes):
+        """Reserve disk space for part of the file.
+        
+        :func:`os.posix_fallocate` is used where it is available. Otherwise,
+        or if the file system does not support it, the region is filled with
+        zeros a block at a time.
+        """
+        if hasattr(os, 'posix_fallocate') and nbytes > 0:
+            try:
+                os.posix_fallocate(self._iostream.fileno(), offset, nbytes)
+                return
+            except OSError as err:
+                unsupported = (getattr(errno, 'EOPNOTSUPP', None),
+                               getattr(errno, 'ENOSYS', None), errno.EINVAL)
+                if err.errno not in unsupported:
+                    raise
+        self._iostream.seek(offset)
+        remaining = nbytes
+        while remaining > 0:
+            size = min(remaining, STREAM_BLOCK_BYTES)
+            self._iostream.write(bytes(bytearray(size)))
+            remaining -= size
+        self._iostream.flush()
     
     def _close_data(self):
         """Delete the existing memmap array, if it exists.
@@ -133,12 +481,59 @@ class MrcMemmap(MrcFile):
         if self._data is not None:
             self._data.flush()
             self._data.flags.writeable = False
+            stored = self._stored_array()
+            if isinstance(stored, WindowedMemmapArray):
+                stored.release()
             self._data = None
     
-    def _set_new_data(self, data):
+    def set_data_from_sections(self, sections, mode=None):
+        """Override of :meth:`set_data_from_sections` to write each section
+        straight into the file.
+        
+        The number of sections does not need to be known in advance. If an
+        exception is raised part-way through, the data block will be
+        incomplete and the :attr:`data` attribute will be :data:`None`.
+        """
+        self._check_writeable()
+        self._close_data()
+        utils.set_header_quantization(self.header, None)
+        self._iostream.seek(self.header.nbytes + self.header.nsymbt)
+        count = 0
+        for section, mode, dtype in self._iter_checked_sections(sections,
+                                                                mode):
+            section_shape = section.shape
+            section = np.ascontiguousarray(section, dtype)
+            if mode == PACKED_4BIT_MODE:
+                section = utils.pack_4bit_data(section)
+            self._iostream.write(section)
+            count += 1
+        self._iostream.truncate()
+        self.header.mode = mode
+        self._open_memmap(dtype, (count,) + section_shape)
+        self.update_header_from_data()
+        self.update_header_stats()
+    
+    def _set_new_data(self, data, dtype=None):
         """Override of :meth:`_set_new_data` to handle opening a new memmap and
-        copying data into it."""
-        file_size = self.header.nbytes + self.header.nsymbt + data.nbytes
+        copying data into it.
+        
+        The data is copied into the memmap a block at a time (converting it to
+        the new dtype if necessary), so no full-size temporary copy is made.
+        """
+        if dtype is None:
+            dtype = data.dtype
+        stored_dtype = dtype
+        if utils.quantization_from_header(self.header) is not None:
+            stored_dtype = (utils.dtype_from_mode(self.header.mode)
+                            .newbyteorder(dtype.byteorder))
+        stored_shape = data.shape
+        if self.header.mode == PACKED_4BIT_MODE and data.ndim > 0:
+            stored_shape = data.shape[:-1] + ((data.shape[-1] + 1) // 2,)
+        data_nbytes = stored_dtype.itemsize
+        for axis_length in stored_shape:
+            data_nbytes *= axis_length
+        file_size = self.header.nbytes + self.header.nsymbt + data_nbytes
         self._iostream.truncate(file_size)
-        self._open_memmap(data.dtype, data.shape)
-        np.copyto(self._data, data, casting='no')
+        self._open_memmap(stored_dtype, data.shape)
+        for index in utils.block_slices(data.shape, stored_dtype.itemsize):
+            self._data[index] = data[index]
@@ -17,13 +17,52 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 from datetime import datetime
+import math
 
 import numpy as np
 
 from . import utils
 from .dtypes import HEADER_DTYPE, VOXEL_SIZE_DTYPE
+from .lazyarrays import LazyArray, TransposedArray
 from .constants import (MAP_ID, MRC_FORMAT_VERSION, IMAGE_STACK_SPACEGROUP,
-                        VOLUME_SPACEGROUP, VOLUME_STACK_SPACEGROUP)
+                        VOLUME_SPACEGROUP, VOLUME_STACK_SPACEGROUP,
+                        STREAM_BLOCK_BYTES, PACKED_4BIT_MODE)
+
+
+# Number of standard errors allowed between sampled estimates of the data
+# statistics and the header values before an error is reported (corresponds to
+# roughly 99.99% confidence for normally-distributed section statistics)
+SAMPLED_STATS_Z_SCORE = 3.89
+
+# Two-sided 99.99% critical values of Student's t distribution, as pairs of
+# (degrees of freedom, value). These replace SAMPLED_STATS_Z_SCORE for small
+# samples, where the standard error itself is only roughly estimated.
+_SAMPLED_STATS_T_SCORES = ((1, 6366.2), (2, 99.99), (3, 28.00), (4, 15.54),
+                           (5, 11.18), (6, 9.08), (7, 7.89), (8, 7.12),
+                           (9, 6.59), (10, 6.21), (12, 5.69), (15, 5.24),
+                           (20, 4.84), (30, 4.48), (40, 4.32), (60, 4.17),
+                           (120, 4.03))
+
+# Seed for choosing sampled sections, so that repeated validation of the same
+# file always checks the same sections and gives the same result
+SAMPLED_STATS_SEED = 0
+
+
+def _sampled_stats_critical_value(dof):
+    """Return the number of standard errors to allow for an estimate with the
+    given number of degrees of freedom.
+    
+    Values between those in the table are interpolated linearly in
+    ``1 / dof``, which is accurate to about 1% for these quantiles.
+    """
+    points = _SAMPLED_STATS_T_SCORES + ((float('inf'), SAMPLED_STATS_Z_SCORE),)
+    for (dof_low, t_low), (dof_high, t_high) in zip(points, points[1:]):
+        if dof <= dof_high:
+            dof = max(dof, dof_low)
+            fraction = (1.0 / dof_low - 1.0 / dof) / (1.0 / dof_low
+                                                      - 1.0 / dof_high)
+            return t_low + fraction * (t_high - t_low)
+    return SAMPLED_STATS_Z_SCORE
 
 
 class MrcObject(object):
@@ -62,6 +101,7 @@ class MrcObject(object):
     
     * :attr:`header`
     * :attr:`extended_header`
+    * :attr:`extended_header_records`
     * :attr:`data`
     * :attr:`voxel_size`
     
@@ -69,6 +109,8 @@ class MrcObject(object):
     
     * :meth:`set_extended_header`
     * :meth:`set_data`
+    * :meth:`as_canonical`
+    * :meth:`set_axis_order`
     * :meth:`is_single_image`
     * :meth:`is_image_stack`
     * :meth:`is_volume`
@@ -85,6 +127,8 @@ class MrcObject(object):
     * :attr:`_read_only`
     * :meth:`_check_writeable`
     * :meth:`_create_default_attributes`
+    * :meth:`_load_extended_header`
+    * :meth:`_extended_header_reserve_for`
     * :meth:`_close_data`
     * :meth:`_set_new_data`
     
@@ -181,58 +225,331 @@ class MrcObject(object):
         
         The extended header may be modified in place. To replace it completely,
         call :meth:`set_extended_header`.
+        
+        Subclasses may defer loading the extended header until this attribute
+        is first accessed (see :meth:`_load_extended_header`).
         """
+        if self._extended_header is None and self._header is not None:
+            self._load_extended_header()
         return self._extended_header
     
-    def set_extended_header(self, extended_header):
+    def _load_extended_header(self):
+        """Load an extended header which has not been read yet.
+        
+        This is called when the :attr:`extended_header` attribute is accessed
+        while the header is present but the extended header is not. This
+        implementation does nothing; subclasses which defer reading the
+        extended header should override it.
+        """
+        pass
+    
+    @property
+    def extended_header_records(self):
+        """Get a structured view of the records in the extended header.
+        
+        The record dtype is chosen from the ``header.exttyp`` field (see
+        :func:`~mrcfile.utils.extended_header_dtype`), and the returned
+        :class:`numpy array <numpy.ndarray>` shares memory with the extended
+        header, so values for all records can be read (or, if the extended
+        header is writeable, changed) in a single operation. For example, the
+        tilt angle of every frame in an FEI1 file is
+        ``mrc.extended_header_records['alpha_tilt']``.
+        
+        Any bytes at the end of the extended header which do not make up a
+        whole record are not included.
+        
+        Returns:
+            A structured :class:`numpy array <numpy.ndarray>` with one item per
+            record, or :data:`None` if the extended header type is not
+            recognised.
+        """
+        dtype = utils.extended_header_dtype(self.header, self.extended_header)
+        if dtype is None:
+            return None
+        raw = self.extended_header.reshape(-1).view('V1')
+        count = raw.size // dtype.itemsize
+        return raw[:count * dtype.itemsize].view(dtype)
+    
+    def set_extended_header(self, extended_header, reserve=None):
         """Replace the extended header.
         
         If you set the extended header you should also set the
         ``header.exttyp`` field to indicate the type of extended header.
+        
+        Space can be reserved at the end of the extended header so it can grow
+        later without the data block having to be moved. The reserved space is
+        included in ``header.nsymbt`` and filled with zeros in the file (see
+        :func:`~mrcfile.utils.extended_header_reserve_from_header`).
+        
+        Args:
+            extended_header: The new extended header.
+            reserve: The number of bytes to reserve after the extended header.
+                The default is :data:`None`, which keeps any space which is
+                already reserved if the new extended header fits in it.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If ``reserve`` is negative.
         """
         self._check_writeable()
+        nbytes = extended_header.nbytes
+        reserve = self._extended_header_reserve_for(nbytes, reserve)
         self._extended_header = extended_header
-        self.header.nsymbt = extended_header.nbytes
+        utils.set_header_extended_header_size(self.header, nbytes, reserve)
+    
+    def _extended_header_reserve_for(self, nbytes, reserve=None):
+        """Work out how much space to reserve after a new extended header.
+        
+        Args:
+            nbytes: The size of the new extended header.
+            reserve: The requested reserve, or :data:`None` to keep the current
+                total size of the extended header if the new one fits in it,
+                and otherwise reserve nothing.
+        
+        Returns:
+            The number of bytes to reserve.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If ``reserve`` is negative.
+        """
+        if reserve is not None:
+            if reserve < 0:
+                raise ValueError("Extended header reserve cannot be negative")
+            return reserve
+        if utils.extended_header_reserve_from_header(self.header) > 0:
+            return max(int(self.header.nsymbt) - nbytes, 0)
+        return 0
     
     @property
     def data(self):
         """Get the data as a :class:`numpy array <numpy.ndarray>`."""
         return self._data
     
-    def set_data(self, data):
+    def set_data(self, data, mode=None, quantize=None, error_bound=None,
+                 copy=True):
         """Replace the data array.
         
         This replaces the current data with the given array (or a copy of it),
         and updates the header to match the new data dimensions. The data
         statistics (min, max, mean and rms) stored in the header will also be
         updated.
+        
+        Floating point data can be stored in a lossy, quantised form by giving
+        the ``quantize`` argument. The data is then stored as integers in mode
+        0 or 1, with a scale and offset recorded in the header's ``extra2``
+        field, and the :attr:`data` attribute contains the float32 values
+        which will be read back from the file. Note that other software will
+        read the stored integers, not the float32 values.
+        
+        Args:
+            data: The new data array.
+            mode: The MRC mode to use for the data. By default, this is chosen
+                from the data's dtype (see
+                :func:`~mrcfile.utils.mode_from_dtype`). A different mode can be
+                given if the data can be converted to the mode's dtype without
+                loss, for example to store int8 data in mode 1 for
+                compatibility with older software. Mode 101 can be given to
+                store integer data in the range 0--15 as packed 4-bit values.
+            quantize: ``'int8'`` or ``'int16'`` to store floating point data as
+                quantised integers of that type. The mode is then 0 or 1
+                respectively, and any other ``mode`` is an error.
+            error_bound: For quantised data, the largest absolute error
+                allowed between the given values and the stored ones.
+            copy: If :data:`True` (the default), the data is converted to a
+                valid dtype and C-contiguous layout if necessary. If
+                :data:`False`, the data must already be valid, and a
+                :class:`~exceptions.ValueError` is raised if it is not. In that
+                case the array is used directly without copying it (or, for
+                :class:`~mrcfile.mrcmemmap.MrcMemmap`, written straight into
+                the file).
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the data cannot be stored in
+                the given mode, or cannot be quantised within the error bound
+                or in the given mode, or ``copy`` is :data:`False` and the
+                data would need to be converted.
         """
         self._check_writeable()
         
-        # Check if the new data's dtype is valid without changes
-        mode = utils.mode_from_dtype(data.dtype)
-        new_dtype = (utils.dtype_from_mode(mode)
-                     .newbyteorder(data.dtype.byteorder))
+        quantization = None
+        if quantize is not None:
+            if not copy:
+                raise ValueError("Quantised data cannot be set without "
+                                 "copying it")
+            quantized_mode, quantization = self._quantization_for_data(
+                data, quantize, error_bound)
+            if mode is not None and mode != quantized_mode:
+                raise ValueError("Mode {0} cannot be used for data quantised "
+                                 "as '{1}', which is stored in mode {2}"
+                                 .format(mode, quantize, quantized_mode))
+            mode = quantized_mode
+            new_dtype = (np.dtype(np.float32)
+                         .newbyteorder(data.dtype.byteorder))
+        else:
+            mode, new_dtype = self._mode_and_dtype_for_data(data, mode)
         
-        # Copy the data if necessary to ensure correct dtype and C ordering
-        new_data = np.asanyarray(data, new_dtype, order='C')
+        if not copy and not (data.dtype == new_dtype
+                             and data.flags.c_contiguous):
+            raise ValueError("Data would need to be converted to C-contiguous "
+                             "dtype '{0}' and cannot be used without copying"
+                             .format(new_dtype))
         
         # Replace the old data array with the new one, and update the header
         self._close_data()
-        self._set_new_data(new_data)
+        self.header.mode = mode
+        if quantization is not None:
+            utils.set_header_quantization(self.header, *quantization)
+        else:
+            utils.set_header_quantization(self.header, None)
+        self._set_new_data(data, new_dtype)
         self.update_header_from_data()
         self.update_header_stats()
     
+    def set_data_from_sections(self, sections, mode=None):
+        """Replace the data array with a 3D array built from 2D sections.
+        
+        This is useful when the data is produced a section at a time, for
+        example by a detector or a processing pipeline. With
+        :class:`~mrcfile.mrcmemmap.MrcMemmap`, each section is written
+        straight into the file, so the full data array never needs to be held
+        in memory.
+        
+        The header is updated as for :meth:`set_data`. For 3D data, the space
+        group is not changed (see :meth:`update_header_from_data`).
+        
+        Args:
+            sections: An iterable of 2D arrays, all with the same shape.
+            mode: The MRC mode to use for the data, as for :meth:`set_data`.
+                By default, this is chosen from the dtype of the first section.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If there are no sections, the
+                sections are not all 2D arrays of the same shape, or they
+                cannot be stored in the given mode.
+        """
+        self._check_writeable()
+        converted = []
+        for section, mode, new_dtype in self._iter_checked_sections(sections,
+                                                                    mode):
+            converted.append(np.asarray(section, new_dtype))
+        self.set_data(np.stack(converted), mode=mode)
+    
+    def _iter_checked_sections(self, sections, mode):
+        """Check sections for :meth:`set_data_from_sections`.
+        
+        Yields:
+            Tuples of ``(section, mode, dtype)``, where ``section`` is a 2D
+            :class:`numpy array <numpy.ndarray>`, and ``mode`` and ``dtype``
+            are chosen from the first section.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If there are no sections, or a
+                section is invalid.
+        """
+        shape = new_dtype = None
+        for section in sections:
+            section = np.asanyarray(section)
+            if section.ndim != 2:
+                raise ValueError("Sections must be 2-dimensional arrays")
+            if shape is None:
+                shape = section.shape
+                mode, new_dtype = self._mode_and_dtype_for_data(section, mode)
+            elif section.shape != shape:
+                raise ValueError("Sections must all have the same shape; "
+                                 "expected {0} but found {1}"
+                                 .format(shape, section.shape))
+            elif mode == PACKED_4BIT_MODE:
+                utils.check_4bit_data(section)
+            elif not np.can_cast(section.dtype, new_dtype, 'safe'):
+                raise ValueError("Data of dtype '{0}' cannot be stored in "
+                                 "mode {1}".format(section.dtype, mode))
+            yield section, mode, new_dtype
+        if shape is None:
+            raise ValueError("No sections were given")
+    
+    def _mode_and_dtype_for_data(self, data, mode=None):
+        """Choose the MRC mode and in-memory dtype for the given data.
+        
+        Args:
+            data: The new data array.
+            mode: The requested MRC mode, or :data:`None` to choose the mode
+                from the data's dtype.
+        
+        Returns:
+            A tuple ``(mode, dtype)``.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the data cannot be stored in
+                the given mode.
+        """
+        if mode is None:
+            mode = utils.mode_from_dtype(data.dtype)
+        new_dtype = (utils.dtype_from_mode(mode)
+                     .newbyteorder(data.dtype.byteorder))
+        if mode == 0 and data.dtype.kind == 'u':
+            # Unsigned bytes are also stored in mode 0, with a header flag
+            new_dtype = np.dtype(np.uint8)
+        if mode == PACKED_4BIT_MODE:
+            utils.check_4bit_data(data)
+        elif not np.can_cast(data.dtype, new_dtype, 'safe'):
+            raise ValueError("Data of dtype '{0}' cannot be stored in mode {1}"
+                             .format(data.dtype, mode))
+        return mode, new_dtype
+    
+    def _quantization_for_data(self, data, quantize, error_bound):
+        """Choose the mode, scale and offset for quantising the given data.
+        
+        The data range is found in a single pass through blocks of the data,
+        so memory-mapped data does not need to be read into memory all at
+        once.
+        
+        Returns:
+            A tuple ``(mode, (scale, offset))``.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the data or quantisation type
+                is invalid, or the data cannot be quantised within the error
+                bound.
+        """
+        if quantize not in ('int8', 'int16'):
+            raise ValueError("Data can only be quantised to 'int8' or "
+                             "'int16', not '{0}'".format(quantize))
+        if data.dtype.kind != 'f':
+            raise ValueError("Only floating point data can be quantised")
+        stored_dtype = np.dtype(quantize)
+        blocks = (data[index] for index in
+                  utils.block_slices(data.shape, data.dtype.itemsize))
+        quantization = utils.quantization_params(blocks, stored_dtype,
+                                                 error_bound)
+        return utils.mode_from_dtype(stored_dtype), quantization
+    
     def _close_data(self):
         """Close the data array."""
         self._data = None
     
-    def _set_new_data(self, data):
+    def _set_new_data(self, data, dtype=None):
         """Replace the data array with a new one.
         
-        The new data array is not checked - it must already be valid for use in
-        an MRC file.
+        The header's mode (and quantisation, if any) must already have been
+        set for the new data. The new data array is not otherwise checked - it
+        must already be valid for use in an MRC file.
+        
+        Args:
+            data: The new data array.
+            dtype: The dtype to convert the data to. If the data already has
+                this dtype and is C-contiguous, it is used without copying.
+                If :data:`None`, the data is used as it is.
         """
+        if dtype is not None:
+            data = np.asanyarray(data, dtype, order='C')
+        quantization = utils.quantization_from_header(self.header)
+        if quantization is not None:
+            # Keep the values which will be read back from the file
+            stored_dtype = (utils.dtype_from_mode(self.header.mode)
+                            .newbyteorder(data.dtype.byteorder))
+            data = utils.dequantize_data(
+                utils.quantize_data(data, quantization[0], quantization[1],
+                                    stored_dtype),
+                quantization[0], quantization[1])
         self._data = data
     
     @property
@@ -296,6 +613,63 @@ class MrcObject(object):
         self.header.cella.y = y_size * self.header.my
         self.header.cella.z = z_size * self.header.mz
     
+    def as_canonical(self):
+        """Get a view of the data with its axes in the standard order.
+        
+        The header's ``mapc``, ``mapr`` and ``maps`` fields record which axes
+        (X, Y or Z) the columns, rows and sections of the data correspond to.
+        This method returns the data transposed so that the sections are along
+        Z, the rows along Y and the columns along X, as for a file with the
+        standard axis mapping. (For volume stacks, the first axis is left in
+        place.)
+        
+        No data is copied: for a normal or memory-mapped array, the result is
+        a transposed view from :func:`numpy.transpose`, and for array-like
+        data which loads values on demand, it is a
+        :class:`~mrcfile.lazyarrays.TransposedArray`. If the axis mapping is
+        already standard, the data array itself is returned.
+        
+        Returns:
+            The transposed data, or :data:`None` if there is no data array.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If the header's axis mapping is
+                invalid, or the data is 2D and its sections are not along Z.
+        """
+        data = self.data
+        if data is None:
+            return None
+        order = utils.axis_order_from_header(self.header)
+        axes = utils.transpose_axes(order, 'xyz', data.ndim)
+        if axes == tuple(range(data.ndim)):
+            return data
+        if isinstance(data, LazyArray):
+            return TransposedArray(data, axes)
+        return np.transpose(data, axes)
+    
+    def set_axis_order(self, order):
+        """Set the axis mapping in the header.
+        
+        This records which axes the columns, rows and sections of the data
+        correspond to, by setting the header's ``mapc``, ``mapr`` and ``maps``
+        fields. Only the header is changed: the data array is not moved or
+        transposed, and the dimension and cell size fields are left as they
+        are. Use :meth:`as_canonical` to view the data in the standard axis
+        order.
+        
+        Args:
+            order: The axes of the columns, rows and sections, as a string of
+                the letters ``x``, ``y`` and ``z``. For example, ``'xyz'`` is
+                the standard order, and ``'zxy'`` means the columns are along
+                Z, the rows along X and the sections along Y.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If ``order`` is not a permutation
+                of ``'xyz'``.
+        """
+        self._check_writeable()
+        utils.set_header_axis_order(self.header, order)
+    
     def is_single_image(self):
         """Identify whether the file represents a single image.
         
@@ -372,6 +746,12 @@ class MrcObject(object):
         and the dimension fields ``nx``, ``ny``, ``nz``, ``mx``, ``my`` and
         ``mz``.
         
+        The mode is set from the data's dtype, except that uint8 data in a
+        header which is already mode 101 is left as packed 4-bit data, and
+        floating point data in a quantised header is left as quantised. For
+        mode 0, the IMOD flags in the header are also updated to record whether
+        the data is signed or unsigned.
+        
         If the data is 2D, the space group is set to 0 (image stack). For 3D
         data the space group is not changed, and for 4D data the space group is
         set to 401 (simple P1 volume stack) unless it is already in the volume
@@ -393,17 +773,42 @@ class MrcObject(object):
         
         # Check the dtype is one we can handle and update mode to match
         header = self.header
-        header.mode = utils.mode_from_dtype(self.data.dtype)
+        mode = utils.mode_from_dtype(self.data.dtype)
+        if header.mode == PACKED_4BIT_MODE:
+            keep_mode = self.data.dtype == np.uint8
+        elif utils.quantization_from_header(header) is not None:
+            keep_mode = self.data.dtype.kind == 'f'
+        else:
+            keep_mode = False
+        if not keep_mode:
+            utils.set_header_quantization(header, None)
+            header.mode = mode
         
         # Ensure header byte order and machine stamp match the data's byte order
         data_byte_order = self.data.dtype.byteorder
         header_byte_order = header.mode.dtype.byteorder
         if (data_byte_order != '|'
             and not utils.byte_orders_equal(data_byte_order, header_byte_order)):
+            # The extra2 field is not swapped as a whole, so the fields stored
+            # in it must be copied across separately
+            imod_fields = utils.imod_header_fields(header).copy()
+            quantization = utils.quantization_from_header(header)
+            reserve = utils.extended_header_reserve_from_header(header)
             header.byteswap(True)
             header.dtype = header.dtype.newbyteorder(data_byte_order)
+            swapped_fields = utils.imod_header_fields(header)
+            for name in imod_fields.dtype.names:
+                swapped_fields[name] = imod_fields[name]
+            if quantization is not None:
+                utils.set_header_quantization(header, *quantization)
+            if reserve > 0:
+                utils.set_header_extended_header_size(
+                    header, int(header.nsymbt) - reserve, reserve)
         header.machst = utils.machine_stamp_from_byte_order(header.mode.dtype
                                                             .byteorder)
+        if header.mode == 0:
+            utils.set_header_byte_signedness(header,
+                                             self.data.dtype.kind != 'u')
         
         shape = self.data.shape
         axes = len(shape)
@@ -443,13 +848,17 @@ class MrcObject(object):
         """
         self._check_writeable()
         
-        self.header.dmin = self.data.min()
-        self.header.dmax = self.data.max()
-        
-        # Use a float64 accumulator to calculate mean and standard deviation
-        # This prevents overflow errors during calculation
-        self.header.dmean = np.float32(self.data.mean(dtype=np.float64))
-        self.header.rms = np.float32(self.data.std(dtype=np.float64))
+        # Calculate the statistics a block at a time, so memory-mapped data
+        # does not need to be read into memory all at once
+        stats = utils.stats_from_blocks(self._iter_section_blocks())
+        if stats is None:
+            self.reset_header_stats()
+            return
+        data_min, data_max, data_mean, data_rms = stats
+        self.header.dmin = data_min
+        self.header.dmax = data_max
+        self.header.dmean = np.float32(data_mean)
+        self.header.rms = np.float32(data_rms)
     
     def reset_header_stats(self):
         """Set the header statistics to indicate that the values are unknown."""
@@ -473,7 +882,7 @@ class MrcObject(object):
             print('{0:15s} : {1}'.format(item, self.header[item]),
                   file=print_file)
     
-    def validate(self, print_file=None):
+    def validate(self, print_file=None, sample=None):
         """Validate this MrcObject.
         
         This method runs a series of tests to check whether this object
@@ -485,7 +894,7 @@ class MrcObject(object):
            ``0x44 0x44 0x00 0x00``, ``0x44 0x41 0x00 0x00`` or
            ``0x11 0x11 0x00 0x00``.
         #. MRC mode: the ``mode`` field should be one of the supported mode
-           numbers: 0, 1, 2, 4 or 6.
+           numbers: 0, 1, 2, 4, 6 or 12.
         #. Map and cell dimensions: The header fields ``nx``, ``ny``, ``nz``,
            ``mx``, ``my``, ``mz``, ``cella.x``, ``cella.y`` and ``cella.z``
            must all be positive numbers.
@@ -506,16 +915,32 @@ class MrcObject(object):
         #. Data statistics: The statistics in the header should be correct for
            the actual data, or marked as undetermined.
         
+        If ``sample`` is given, the data statistics are estimated from a random
+        subset of the sections instead of being calculated from the whole data
+        array. This is much faster for very large memory-mapped files, but
+        cannot detect every error: the header minimum and maximum are only
+        checked against the range of the sampled values, and the mean and RMS
+        deviation are only reported as errors if they lie outside a confidence
+        interval around the sampled estimates.
+        
         Args:
             print_file: The output text stream to use for printing messages
                 about the validation. This is passed directly to the ``file``
                 argument of Python's :func:`print` function. The default is
                 :data:`None`, which means output will be printed to
                 :data:`sys.stdout`.
+            sample: The sections to use when checking the data statistics. If
+                between 0 and 1, this is the fraction of sections to check;
+                otherwise it is the number of sections. The default is
+                :data:`None`, which means all of the data is checked.
         
         Returns:
             :data:`True` if this MrcObject  is valid, or :data:`False` if it
             does not meet the MRC format specification in any way.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If ``sample`` is not a positive
+                number.
         """
         valid = True
         
@@ -604,13 +1029,23 @@ class MrcObject(object):
             valid = False
         
         # Check data statistics
-        if self.data is not None:
-            real_rms = real_min = real_max = real_mean = 0
-            if len(self.data > 0):
-                real_rms = self.data.std()
-                real_min = self.data.min()
-                real_max = self.data.max()
-                real_mean = self.data.mean()
+        sample_indices = None
+        if self.data is not None and sample is not None:
+            sample_indices = self._choose_sample_sections(sample)
+        if sample_indices is not None:
+            if not self._check_sampled_data_stats(sample_indices, log):
+                valid = False
+        elif self._data_is_available():
+            # Calculate the statistics a block at a time, to keep memory use
+            # bounded for memory-mapped or streamed data
+            try:
+                stats = utils.stats_from_blocks(self._iter_section_blocks())
+            except ValueError as err:
+                log("Data block could not be read: {0}".format(err))
+                return False
+            if stats is None:
+                stats = (0, 0, 0, 0)
+            real_min, real_max, real_mean, real_rms = stats
             if (self.header.rms >= 0 and not np.isclose(real_rms, self.header.rms)):
                 log("Error in data statistics: RMS deviation is {0} but the value "
                     "in the header is {1}".format(real_rms, self.header.rms))
@@ -630,3 +1065,186 @@ class MrcObject(object):
                 valid = False
         
         return valid
+    
+    def _data_is_available(self):
+        """Return :data:`True` if the data can be read.
+        
+        Subclasses which can read the data block directly from a stream, rather
+        than from the :attr:`data` array, should override this method.
+        """
+        return self.data is not None
+    
+    def _iter_section_blocks(self, max_bytes=STREAM_BLOCK_BYTES):
+        """Iterate over the data in blocks of consecutive 2D sections.
+        
+        Each block is a three-dimensional array of at most ``max_bytes`` bytes
+        (or a single section, if one section is larger than that). For
+        memory-mapped data, only one block needs to be read into memory at a
+        time.
+        
+        Subclasses which can read the data block directly from a stream, rather
+        than from the :attr:`data` array, should override this method.
+        
+        Args:
+            max_bytes: The maximum size of each block, in bytes.
+        
+        Yields:
+            Three-dimensional :class:`numpy arrays <numpy.ndarray>`.
+        """
+        data = self.data
+        if data.ndim < 3:
+            yield np.asarray(data)[np.newaxis]
+            return
+        section_nbytes = data.dtype.itemsize * data.shape[-1] * data.shape[-2]
+        per_block = max(1, max_bytes // max(section_nbytes, 1))
+        # Index rather than reshape, so array-like data objects can be used
+        if data.ndim == 3:
+            volume_indices = [()]
+        else:
+            volume_indices = [(volume,) for volume in range(data.shape[0])]
+        for volume_index in volume_indices:
+            for start in range(0, data.shape[-3], per_block):
+                yield data[volume_index + (slice(start, start + per_block),)]
+    
+    def _choose_sample_sections(self, sample):
+        """Choose a random subset of sections to use for estimating the data
+        statistics.
+        
+        The sections are chosen by a generator with a fixed seed, so the same
+        sections are always chosen for a given sample size and data shape.
+        
+        Args:
+            sample: The fraction of sections (if between 0 and 1) or the number
+                of sections to choose.
+        
+        Returns:
+            A sorted array of section indices, or :data:`None` if the sample
+            would include every section (in which case the exact statistics
+            should be calculated instead).
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If ``sample`` is not a positive
+                number.
+        """
+        if not sample > 0:
+            raise ValueError("Sample must be a positive fraction or number of "
+                             "sections; found {0}".format(sample))
+        n_sections = self._section_count()
+        if sample < 1:
+            n_sample = int(math.ceil(sample * n_sections))
+        else:
+            n_sample = int(sample)
+        # At least two sections are needed to estimate the sampling error
+        n_sample = max(n_sample, 2)
+        if n_sample >= n_sections:
+            return None
+        random_state = np.random.RandomState(SAMPLED_STATS_SEED)
+        return np.sort(random_state.choice(n_sections, n_sample,
+                                           replace=False))
+    
+    def _section_count(self):
+        """Return the number of 2D sections in the data array."""
+        if self.data.ndim < 3:
+            return 1
+        return int(np.prod(self.data.shape[:-2]))
+    
+    def _get_section(self, index):
+        """Return the 2D section with the given index.
+        
+        For four-dimensional data, sections are counted through all of the
+        volumes in the stack.
+        """
+        if self.data.ndim == 4:
+            return self.data[index // self.data.shape[1],
+                             index % self.data.shape[1]]
+        return self.data[index]
+    
+    def _check_sampled_data_stats(self, indices, log):
+        """Check the header statistics against estimates from a sample of the
+        data sections.
+        
+        The header minimum and maximum are checked against the range of the
+        sampled values (so a header value is only reported as wrong if a more
+        extreme value is found in the data). The mean and variance are
+        estimated from the per-section statistics, and reported as wrong only
+        if the header values differ from the estimates by more than
+        :data:`SAMPLED_STATS_Z_SCORE` standard errors (or the corresponding
+        critical value of Student's t distribution, for small samples).
+        
+        Args:
+            indices: The indices of the sections to check.
+            log: A function to call with messages about validation errors.
+        
+        Returns:
+            :data:`True` if the header statistics are consistent with the
+            sample, otherwise :data:`False`.
+        """
+        valid = True
+        header = self.header
+        
+        sec_min = []
+        sec_max = []
+        sec_mean = []
+        sec_sq_mean = []
+        for index in indices:
+            # Load one section at a time, with a float64 accumulator to
+            # prevent overflow errors during calculation
+            section = np.asarray(self._get_section(index))
+            sec_min.append(section.min())
+            sec_max.append(section.max())
+            sec_mean.append(section.mean(dtype=np.float64))
+            sec_sq_mean.append(np.square(section, dtype=np.float64).mean())
+        sec_mean = np.array(sec_mean)
+        sec_sq_mean = np.array(sec_sq_mean)
+        
+        # Standard errors of sample means, with a finite population correction
+        n_sample = len(indices)
+        correction = math.sqrt(1.0 - n_sample / self._section_count())
+        critical_value = _sampled_stats_critical_value(n_sample - 1)
+        def standard_error(values):
+            return correction * values.std(ddof=1) / math.sqrt(n_sample)
+        
+        def outside_bounds(estimate, error, value):
+            tolerance = critical_value * error
+            return not np.isclose(estimate, value, atol=tolerance + 1e-08)
+        
+        sample_min = min(sec_min)
+        sample_max = max(sec_max)
+        if header.dmin < header.dmax and header.dmin > sample_min:
+            log("Error in data statistics: minimum is at most {0} (from "
+                "sampled sections) but the value in the header is {1}"
+                .format(sample_min, header.dmin))
+            valid = False
+        if header.dmin < header.dmax and header.dmax < sample_max:
+            log("Error in data statistics: maximum is at least {0} (from "
+                "sampled sections) but the value in the header is {1}"
+                .format(sample_max, header.dmax))
+            valid = False
+        
+        est_mean = sec_mean.mean()
+        mean_error = standard_error(sec_mean)
+        if (header.dmean > min(header.dmin, header.dmax)
+            and outside_bounds(est_mean, mean_error, header.dmean)):
+            log("Error in data statistics: mean is estimated as {0} +/- {1} "
+                "(from sampled sections) but the value in the header is {2}"
+                .format(est_mean, critical_value * mean_error,
+                        header.dmean))
+            valid = False
+        
+        # Variance is E[x^2] - E[x]^2; its standard error is estimated using
+        # the delta method from the per-section moments
+        est_var = max(sec_sq_mean.mean() - est_mean ** 2, 0.0)
+        var_error = standard_error(sec_sq_mean - 2 * est_mean * sec_mean)
+        if (header.rms >= 0
+            and outside_bounds(est_var, var_error, float(header.rms) ** 2)):
+            var_bound = critical_value * var_error
+            log("Error in data statistics: RMS deviation is estimated as {0} "
+                "(range {1} to {2}, from sampled sections) but the value in "
+                "the header is {3}"
+                .format(math.sqrt(est_var),
+                        math.sqrt(max(est_var - var_bound, 0.0)),
+                        math.sqrt(est_var + var_bound),
+                        header.rms))
+            valid = False
+        
+        return valid
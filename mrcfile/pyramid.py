@@ -0,0 +1,225 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+"""
+pyramid
+-------
+
+Multi-resolution pyramids of downsampled copies of a large MRC file.
+
+Each level of a pyramid is a normal MRC file, binned by a further factor of
+two along each axis from the level before: level 1 is binned by 2, level 2 by
+4, level 3 by 8 and so on. (Image stacks are binned only within each image.)
+The voxel size of each level is set to match the binning, so the levels can be
+overlaid on the original data. A viewer can then open the smallest level which
+still has enough detail for its display, rather than reading the whole file.
+
+The level files are named after the original file, with the binning factor
+added: for example, ``tomogram.mrc`` has levels ``tomogram.2x.mrc``,
+``tomogram.4x.mrc`` and so on.
+
+Functions:
+    :func:`build`: Write the levels of a pyramid for an MRC file.
+    :func:`level_name`: Get the file name for a level of a pyramid.
+    :func:`find_levels`: Find the existing levels of a pyramid.
+    :func:`open_level`: Open the smallest level of a pyramid which is at least
+    a given size.
+
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+
+import numpy as np
+
+from . import utils
+from ._opening import _get_mrc_class, _open_source
+from .mrcfile import MrcFile
+from .mrcmemmap import MrcMemmap
+
+
+def build(name, levels=3, method='mean', overwrite=False):
+    """Write the levels of a pyramid for an MRC file.
+    
+    The pyramid is built in a single pass through the original file. Sections
+    are read one at a time, and as soon as enough sections have been read to
+    fill a bin at one level, a section of that level is calculated, written
+    and passed on to the next level. At most one bin's worth of sections is
+    held in memory for each level, so memory use is bounded however large the
+    file is.
+    
+    Items at the end of an axis which do not fill a whole bin are left out of
+    the next level.
+    
+    Args:
+        name: The name of the MRC file.
+        levels: The number of levels to build. The default is 3, for levels
+            binned by 2, 4 and 8.
+        method: The reduction to use for each bin: ``'mean'`` (the default),
+            ``'sum'``, ``'max'`` or ``'min'``. Means and sums are stored as
+            float32 values; maxima and minima keep the original data type.
+        overwrite: Flag to force overwriting of existing level files. If
+            :data:`False` and a level file already exists, an exception is
+            raised.
+    
+    Returns:
+        A list of the names of the level files, from the largest to the
+        smallest.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If ``levels`` is less than 1.
+        :class:`~exceptions.ValueError`: If the data is not 2D or 3D, or is too
+            small for the number of levels.
+        :class:`~exceptions.ValueError`: If the method is not recognised.
+        :class:`~exceptions.ValueError`: If a level file already exists and
+            ``overwrite`` is :data:`False`.
+    """
+    if levels < 1:
+        raise ValueError("Number of pyramid levels must be at least 1, "
+                         "not {0}".format(levels))
+    with _open_source(name) as src:
+        data = src.data
+        if data.ndim not in (2, 3):
+            raise ValueError("Pyramids can only be built for 2D or 3D data")
+        out_dtype = utils.binned_dtype(data.dtype, method)
+        
+        # Image stacks are binned only within each image
+        if data.ndim == 2 or src.is_image_stack():
+            z_factor = 1
+        else:
+            z_factor = 2
+        factors = (z_factor, 2, 2)[-data.ndim:]
+        shapes = [tuple(length // factor ** level
+                        for length, factor in zip(data.shape, factors))
+                  for level in range(1, levels + 1)]
+        if min(min(shape) for shape in shapes) < 1:
+            raise ValueError("Data of shape {0} is too small for {1} "
+                             "pyramid levels".format(data.shape, levels))
+        
+        names = [level_name(name, 2 ** level)
+                 for level in range(1, levels + 1)]
+        outputs = []
+        try:
+            for level, (level_file, level_shape) in enumerate(zip(names,
+                                                                  shapes), 1):
+                out = _new_level(level_file, level_shape, out_dtype, src,
+                                 overwrite)
+                outputs.append(out)
+                out.voxel_size = (src.voxel_size.x * 2 ** level,
+                                  src.voxel_size.y * 2 ** level,
+                                  src.voxel_size.z * z_factor ** level)
+            
+            # Pass each section down the levels, binning as each bin fills
+            pending = [[] for _ in outputs]
+            written = [0] * len(outputs)
+            sections = data.shape[0] if data.ndim == 3 else 1
+            for index in range(sections):
+                section = np.asarray(data[index] if data.ndim == 3 else data)
+                for level, out in enumerate(outputs):
+                    pending[level].append(section)
+                    if len(pending[level]) < z_factor:
+                        break
+                    block = np.stack(pending[level])
+                    pending[level] = []
+                    section = utils.bin_data(block, (z_factor, 2, 2),
+                                             method)[0].astype(out_dtype)
+                    if data.ndim == 2:
+                        out.data[...] = section
+                    else:
+                        out.data[written[level]] = section
+                    written[level] += 1
+            for out in outputs:
+                out.update_header_stats()
+        finally:
+            for out in outputs:
+                out.close()
+    return names
+
+
+def _new_level(name, shape, dtype, src, overwrite):
+    """Create a new, empty file for one level of a pyramid."""
+    out = MrcMemmap(name, mode='w+', overwrite=overwrite)
+    try:
+        out.header.ispg = src.header.ispg
+        out._allocate_data(shape, dtype)
+        out.header.origin = src.header.origin
+    except Exception:
+        out.close()
+        raise
+    return out
+
+
+def level_name(name, factor):
+    """Return the file name for a level of a pyramid.
+    
+    Args:
+        name: The name of the original MRC file.
+        factor: The binning factor of the level.
+    
+    Returns:
+        The file name, made by replacing the extension of ``name`` with (for
+        example) ``.2x.mrc`` for a factor of 2.
+    """
+    return '{0}.{1}x.mrc'.format(os.path.splitext(name)[0], factor)
+
+
+def find_levels(name):
+    """Find the existing levels of a pyramid.
+    
+    Args:
+        name: The name of the original MRC file.
+    
+    Returns:
+        A list of ``(factor, file_name)`` tuples, starting with ``(1, name)``
+        for the original file and followed by each level file which exists, in
+        order of increasing binning factor.
+    """
+    levels = [(1, name)]
+    factor = 2
+    while os.path.exists(level_name(name, factor)):
+        levels.append((factor, level_name(name, factor)))
+        factor *= 2
+    return levels
+
+
+def open_level(name, shape):
+    """Open the smallest level of a pyramid which is at least a given size.
+    
+    This is useful for displaying a view of a large file: the level chosen is
+    the coarsest one with at least as many pixels as the display along each
+    axis.
+    
+    Args:
+        name: The name of the original MRC file.
+        shape: The smallest acceptable data shape. If this has fewer
+            dimensions than the data, it is compared with the last axes of the
+            data (so a 2D shape gives the minimum section size). An item of
+            :data:`None` means any length is acceptable for that axis.
+    
+    Returns:
+        An object for the chosen level file, opened read-only (uncompressed
+        files are memory-mapped). If no level is large enough, the original
+        file is opened.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If ``shape`` has more dimensions than
+            the data.
+    """
+    with _get_mrc_class(name)(name, header_only=True) as mrc:
+        ndim = len(utils.data_shape_from_header(mrc.header))
+    if len(shape) > ndim:
+        raise ValueError("Shape {0} has more dimensions than the {1}D data"
+                         .format(tuple(shape), ndim))
+    chosen = name
+    for factor, level_file in find_levels(name)[1:]:
+        with MrcFile(level_file, header_only=True) as mrc:
+            level_shape = utils.data_shape_from_header(mrc.header)
+        trailing = level_shape[ndim - len(shape):]
+        if all(minimum is None or length >= minimum
+               for length, minimum in zip(trailing, shape)):
+            chosen = level_file
+        else:
+            break
+    return _open_source(chosen)
@@ -12,8 +12,45 @@ Functions
 
 * :func:`data_dtype_from_header`: Work out the data :class:`dtype
   <numpy.dtype>` from an MRC header.
+* :func:`loaded_dtype_from_header`: Get the dtype of the data array as it is
+  presented when the file is read.
+* :func:`imod_header_fields`: Get a view of the IMOD-specific fields in an
+  MRC header.
+* :func:`header_has_unsigned_bytes`: Identify if a header indicates unsigned
+  8-bit data.
+* :func:`set_header_byte_signedness`: Mark a header as having signed or
+  unsigned 8-bit data.
 * :func:`data_shape_from_header`: Work out the data array shape from an MRC
   header
+* :func:`data_nbytes_from_header`: Work out the size of the data block from an
+  MRC header.
+* :func:`stats_from_blocks`: Calculate data statistics from an iterable of
+  data blocks.
+* :func:`block_slices`: Split the first axis of an array into slices of
+  bounded size.
+* :func:`tile_slices`: Split an array into roughly cubic tiles of bounded
+  size.
+* :func:`pack_4bit_data`: Pack an array of 4-bit values into bytes.
+* :func:`unpack_4bit_data`: Unpack an array of bytes into 4-bit values.
+* :func:`check_4bit_data`: Check that data values can be stored in 4 bits.
+* :func:`quantization_from_header`: Get the quantisation scale and offset from
+  an MRC header.
+* :func:`set_header_quantization`: Record the quantisation scale and offset in
+  an MRC header.
+* :func:`quantization_params`: Choose a quantisation scale and offset for a
+  data set.
+* :func:`quantize_data`: Convert floating point data to quantised integers.
+* :func:`dequantize_data`: Convert quantised integers back to float32 data.
+* :func:`bin_data`: Reduce an array by integer factors along each axis.
+* :func:`binned_dtype`: Get the dtype to store binned data in an MRC file.
+* :func:`extended_header_reserve_from_header`: Get the number of bytes
+  reserved at the end of an extended header.
+* :func:`set_header_extended_header_size`: Record the extended header size and
+  reserved space in an MRC header.
+* :func:`extended_header_dtype`: Get the record dtype for an MRC extended
+  header.
+* :func:`register_extended_header_dtype`: Add or replace the record dtype for
+  an extended header type.
 * :func:`mode_from_dtype`: Convert a :class:`numpy dtype <numpy.dtype>` to an
   MRC mode number.
 * :func:`dtype_from_mode`: Convert an MRC mode number to a :class:`numpy dtype
@@ -26,6 +63,12 @@ Functions
   ``>``.
 * :func:`spacegroup_is_volume_stack`: Identify if a space group number
   represents a volume stack.
+* :func:`axis_order_from_header`: Get the axis order string from the axis
+  mapping fields in an MRC header.
+* :func:`set_header_axis_order`: Set the axis mapping fields in an MRC header
+  from an axis order string.
+* :func:`transpose_axes`: Work out how to transpose a data array from one axis
+  order to another.
 
 """
 
@@ -33,11 +76,20 @@ Functions
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import ctypes
+import ctypes.util
+import mmap
 import sys
 
 import numpy as np
 
-from .constants import IMAGE_STACK_SPACEGROUP
+from .constants import (IMAGE_STACK_SPACEGROUP, PACKED_4BIT_MODE, IMOD_STAMP,
+                        IMOD_SIGNED_BYTES_FLAG, QUANTIZATION_TAG,
+                        EXTENDED_HEADER_RESERVE_TAG, STREAM_BLOCK_BYTES)
+from .dtypes import (IMOD_HEADER_DTYPE, QUANTIZATION_HEADER_DTYPE,
+                     EXTENDED_HEADER_RESERVE_HEADER_DTYPE,
+                     FEI1_EXTENDED_HEADER_DTYPE,
+                     SYMMETRY_EXTENDED_HEADER_DTYPE)
 
 
 def data_dtype_from_header(header):
@@ -47,6 +99,10 @@ def data_dtype_from_header(header):
     then makes sure that the byte order of the new dtype matches the byte order
     of the header's ``mode`` field.
     
+    Mode 0 data is normally signed (int8), but if the header has been marked as
+    containing unsigned bytes using IMOD's convention (see
+    :func:`header_has_unsigned_bytes`), uint8 is returned instead.
+    
     Args:
         header: An MRC header as a :class:`numpy record array
             <numpy.recarray>`.
@@ -60,9 +116,101 @@ def data_dtype_from_header(header):
             the given mode.
     """
     mode = header.mode
+    if mode == 0 and header_has_unsigned_bytes(header):
+        return np.dtype(np.uint8)
     return dtype_from_mode(mode).newbyteorder(mode.dtype.byteorder)
 
 
+def loaded_dtype_from_header(header):
+    """Return the dtype of the data array as it is presented when read.
+    
+    This is the same as :func:`data_dtype_from_header`, except for quantised
+    data, which is stored as integers but presented as float32 values (in the
+    header's byte order). Packed 4-bit data is presented as uint8, which is
+    already the dtype for its mode.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+    
+    Returns:
+        The :class:`numpy dtype <numpy.dtype>` of the data array.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If there is no corresponding dtype for
+            the given mode.
+    """
+    dtype = data_dtype_from_header(header)
+    if quantization_from_header(header) is not None:
+        return np.dtype(np.float32).newbyteorder(dtype.byteorder)
+    return dtype
+
+
+def imod_header_fields(header):
+    """Return a view of the IMOD-specific fields in the given header.
+    
+    IMOD stores a stamp (``imod_stamp``) and a set of flags (``imod_flags``) in
+    the header's ``extra2`` space, as well as two fields (``nint`` and
+    ``nreal``) which describe the layout of SERI and AGAR extended headers.
+    The returned view shares memory with the header, so changing its fields
+    changes the header.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+    
+    Returns:
+        A :class:`numpy record array <numpy.recarray>` with ``nint``,
+        ``nreal``, ``imod_stamp`` and ``imod_flags`` fields, in the same byte
+        order as the header.
+    """
+    byte_order = header.mode.dtype.byteorder
+    return header.view(IMOD_HEADER_DTYPE.newbyteorder(byte_order))
+
+
+def header_has_unsigned_bytes(header):
+    """Identify if the given header indicates unsigned 8-bit data.
+    
+    This follows the convention used by IMOD: if the header contains the IMOD
+    stamp, mode 0 data is unsigned unless the signed bytes flag is set.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+    
+    Returns:
+        :data:`True` if the header has the IMOD stamp and the signed bytes flag
+        is not set.
+    """
+    fields = imod_header_fields(header)
+    return (fields.imod_stamp == IMOD_STAMP
+            and not fields.imod_flags & IMOD_SIGNED_BYTES_FLAG)
+
+
+def set_header_byte_signedness(header, signed):
+    """Mark the given header as containing signed or unsigned 8-bit data.
+    
+    To mark the data as unsigned, the IMOD stamp is added to the header and the
+    signed bytes flag is cleared. To mark it as signed, the signed bytes flag
+    is set if the header has the IMOD stamp; otherwise the header is left
+    unchanged, since mode 0 data is signed by default.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+        signed: :data:`True` for signed data, :data:`False` for unsigned.
+    """
+    fields = imod_header_fields(header)
+    if signed:
+        if fields.imod_stamp == IMOD_STAMP:
+            fields.imod_flags |= IMOD_SIGNED_BYTES_FLAG
+    else:
+        if fields.imod_stamp != IMOD_STAMP:
+            fields.imod_stamp = IMOD_STAMP
+            fields.imod_flags = 0
+        fields.imod_flags &= ~IMOD_SIGNED_BYTES_FLAG
+
+
 def data_shape_from_header(header):
     """Return the data shape indicated by the given header.
     
@@ -89,7 +237,654 @@ def data_shape_from_header(header):
     return shape
 
 
-_dtype_to_mode = dict(f2=2, f4=2, i1=0, i2=1, u1=6, u2=6, c8=4)
+def data_nbytes_from_header(header):
+    """Return the size in bytes of the data block indicated by the given
+    header.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+    
+    For mode 101 (packed 4-bit data), each row of the data is packed into
+    ``ceil(nx / 2)`` bytes.
+    
+    Returns:
+        The number of bytes in the data block, as a Python :class:`int`.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If there is no corresponding dtype for
+            the header's mode.
+    """
+    nbytes = data_dtype_from_header(header).itemsize
+    shape = data_shape_from_header(header)
+    if header.mode == PACKED_4BIT_MODE:
+        shape = shape[:-1] + ((shape[-1] + 1) // 2,)
+    for axis_length in shape:
+        nbytes *= axis_length
+    return nbytes
+
+
+def stats_from_blocks(blocks):
+    """Calculate the minimum, maximum, mean and RMS deviation of a data set
+    given as a series of blocks.
+    
+    Only one block is held in memory at a time, so this function can be used to
+    calculate statistics for data sets which are too large to load all at once
+    (for example, by iterating over slices of a memory-mapped array). Blocks
+    are combined using a float64 accumulator and a pairwise update of the mean
+    and sum of squared deviations, so the results match those from numpy's
+    :meth:`~numpy.ndarray.mean` and :meth:`~numpy.ndarray.std` methods.
+    
+    Args:
+        blocks: An iterable of :class:`numpy arrays <numpy.ndarray>`, which
+            must all have the same dtype.
+    
+    Returns:
+        A tuple ``(min, max, mean, rms)``, or :data:`None` if the blocks
+        contain no data values. For floating point and complex data, the mean
+        and RMS deviation are returned with the precision of the data (as
+        numpy's :meth:`~numpy.ndarray.mean` and :meth:`~numpy.ndarray.std`
+        methods would do) but at least single precision; otherwise they are
+        returned as float64 values.
+    """
+    count = 0
+    data_min = data_max = mean = m2 = None
+    dtype = None
+    for block in blocks:
+        block = np.asarray(block)
+        if block.size == 0:
+            continue
+        dtype = block.dtype
+        if dtype.kind == 'c':
+            acc_dtype = np.complex128
+        else:
+            acc_dtype = np.float64
+        block_min = block.min()
+        block_max = block.max()
+        block_mean = block.mean(dtype=acc_dtype)
+        block_m2 = np.square(np.abs(np.subtract(block, block_mean,
+                                                dtype=acc_dtype))).sum()
+        block_count = block.size
+        if count == 0:
+            data_min, data_max = block_min, block_max
+            mean, m2 = block_mean, block_m2
+        else:
+            data_min = min(data_min, block_min)
+            data_max = max(data_max, block_max)
+            total = count + block_count
+            delta = block_mean - mean
+            mean = mean + delta * block_count / total
+            m2 = m2 + block_m2 + abs(delta) ** 2 * count * block_count / total
+        count += block_count
+    if count == 0:
+        return None
+    rms = np.sqrt(m2 / count)
+    if dtype.kind in 'fc':
+        result_dtype = np.promote_types(dtype, np.float32)
+        mean = result_dtype.type(mean)
+        rms = np.empty(0, result_dtype).real.dtype.type(rms)
+    return data_min, data_max, mean, rms
+
+
+def block_slices(shape, itemsize, max_bytes=STREAM_BLOCK_BYTES):
+    """Split the first axis of an array into slices of bounded size.
+    
+    This can be used to process a large (for example, memory-mapped) array a
+    block at a time, so that only one block needs to be held in memory.
+    
+    Args:
+        shape: The shape of the array.
+        itemsize: The number of bytes in each item of the array.
+        max_bytes: The maximum number of bytes in each block. If a single item
+            of the first axis is larger than this, each block contains one
+            item.
+    
+    Returns:
+        A list of :class:`slice` objects which together cover the first axis
+        of the array. For a zero-dimensional array, a single empty tuple is
+        returned instead, so it can still be used as an index.
+    """
+    if len(shape) == 0:
+        return [()]
+    row_nbytes = itemsize
+    for axis_length in shape[1:]:
+        row_nbytes *= axis_length
+    per_block = max(1, max_bytes // max(row_nbytes, 1))
+    return [slice(start, start + per_block)
+            for start in range(0, shape[0], per_block)]
+
+
+def tile_slices(shape, itemsize, max_bytes=STREAM_BLOCK_BYTES):
+    """Split an array into roughly cubic tiles of bounded size.
+    
+    The array is divided recursively, halving the longest axis each time,
+    until each tile is no larger than ``max_bytes``. Tiles are returned in the
+    order of the recursion, so neighbouring tiles are close together along
+    every axis. This suits operations such as transposing, where a tile is read
+    from one layout and written to another: each tile covers a reasonably long
+    run along every axis, whatever the axis order, without needing to know the
+    sizes of any caches.
+    
+    Args:
+        shape: The shape of the array.
+        itemsize: The number of bytes in each item of the array.
+        max_bytes: The maximum number of bytes in each tile. Tiles are never
+            smaller than a single item.
+    
+    Returns:
+        A list of tuples of :class:`slice` objects, with one slice for each
+        axis, which together cover the whole array.
+    """
+    tiles = []
+    pending = [tuple((0, int(length)) for length in shape)]
+    while pending:
+        bounds = pending.pop()
+        nbytes = itemsize
+        for start, stop in bounds:
+            nbytes *= stop - start
+        lengths = [stop - start for start, stop in bounds]
+        if nbytes <= max_bytes or max(lengths) <= 1:
+            tiles.append(tuple(slice(start, stop) for start, stop in bounds))
+            continue
+        axis = lengths.index(max(lengths))
+        start, stop = bounds[axis]
+        middle = start + (stop - start) // 2
+        # Push the second half first so the first half is processed first
+        for half in [(middle, stop), (start, middle)]:
+            pending.append(bounds[:axis] + (half,) + bounds[axis + 1:])
+    return tiles
+
+
+def pack_4bit_data(data):
+    """Pack an array of 4-bit values into bytes.
+    
+    Values are packed two to a byte, with the first value in the lower four
+    bits. Each row (the last axis of the array) starts at a new byte, so if the
+    row length is odd, the upper four bits of the last byte in each row are set
+    to zero. This is the layout used for MRC mode 101.
+    
+    Args:
+        data: A :class:`numpy array <numpy.ndarray>` of values in the range
+            0--15. Higher bits of each value are discarded.
+    
+    Returns:
+        A new uint8 array with the same shape as ``data`` except for the last
+        axis, which has length ``ceil(nx / 2)``.
+    """
+    data = np.asarray(data)
+    if data.shape[-1] % 2:
+        padding = np.zeros(data.shape[:-1] + (1,), dtype=data.dtype)
+        data = np.concatenate((data, padding), axis=-1)
+    low = data[..., 0::2].astype(np.uint8) & 0x0F
+    high = data[..., 1::2].astype(np.uint8) & 0x0F
+    return low | (high << 4)
+
+
+def unpack_4bit_data(packed, row_length=None):
+    """Unpack an array of bytes into 4-bit values.
+    
+    This is the inverse of :func:`pack_4bit_data`.
+    
+    Args:
+        packed: A uint8 :class:`numpy array <numpy.ndarray>` of packed data.
+        row_length: The number of values in each row. If this is odd, the
+            unused upper four bits of the last byte of each row are dropped.
+            If not given, two values are returned for every byte.
+    
+    Returns:
+        A new uint8 array of values in the range 0--15, with the same shape as
+        ``packed`` except for the last axis, which has length ``row_length``.
+    """
+    packed = np.asarray(packed, dtype=np.uint8)
+    data = np.empty(packed.shape[:-1] + (2 * packed.shape[-1],),
+                    dtype=np.uint8)
+    np.bitwise_and(packed, 0x0F, out=data[..., 0::2])
+    np.right_shift(packed, 4, out=data[..., 1::2])
+    if row_length is not None and row_length != data.shape[-1]:
+        data = np.ascontiguousarray(data[..., :row_length])
+    return data
+
+
+def check_4bit_data(data):
+    """Check that the given data can be stored as 4-bit values.
+    
+    Args:
+        data: An array-like object.
+    
+    Returns:
+        The data as a :class:`numpy array <numpy.ndarray>`.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the data are not integers, or
+            contain values outside the range 0--15.
+    """
+    data = np.asarray(data)
+    if data.dtype.kind not in 'iub':
+        raise ValueError("4-bit data must be integers, not dtype '{0}'"
+                         .format(data.dtype))
+    if data.size > 0 and (data.min() < 0 or data.max() > 15):
+        raise ValueError("4-bit data values must be in the range 0 to 15")
+    return data
+
+
+def quantization_from_header(header):
+    """Return the quantisation scale and offset recorded in the given header.
+    
+    Quantised data is stored as integers in mode 0 or 1, and converted to
+    floating point values by multiplying by the scale and adding the offset.
+    The scale and offset are stored in the header's ``extra2`` field, marked by
+    a tag.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+    
+    Returns:
+        A tuple ``(scale, offset)``, or :data:`None` if the data is not
+        quantised.
+    """
+    if header.mode not in (0, 1):
+        return None
+    byte_order = header.mode.dtype.byteorder
+    fields = header.view(QUANTIZATION_HEADER_DTYPE.newbyteorder(byte_order))
+    if fields.quant_tag != QUANTIZATION_TAG:
+        return None
+    return float(fields.quant_scale), float(fields.quant_offset)
+
+
+def set_header_quantization(header, scale=None, offset=None):
+    """Record the quantisation scale and offset in the given header.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+        scale: The quantisation scale, or :data:`None` to mark the data as not
+            quantised.
+        offset: The quantisation offset.
+    """
+    byte_order = header.mode.dtype.byteorder
+    fields = header.view(QUANTIZATION_HEADER_DTYPE.newbyteorder(byte_order))
+    if scale is None:
+        if fields.quant_tag == QUANTIZATION_TAG:
+            fields.quant_tag = b''
+            fields.quant_scale = 0
+            fields.quant_offset = 0
+    else:
+        fields.quant_tag = QUANTIZATION_TAG
+        fields.quant_scale = scale
+        fields.quant_offset = offset
+
+
+def quantization_params(blocks, dtype, error_bound=None):
+    """Choose a quantisation scale and offset for a data set.
+    
+    The data range is found in a single pass through the blocks, and mapped
+    onto the symmetric range of the integer dtype (for example -32767 to 32767
+    for int16). The scale and offset are rounded to float32 precision, since
+    that is how they are stored in the header.
+    
+    Args:
+        blocks: An iterable of floating point :class:`numpy arrays
+            <numpy.ndarray>` which together make up the data set.
+        dtype: The integer dtype to quantise to (int8 or int16).
+        error_bound: If given, the largest absolute error allowed between the
+            original and quantised values.
+    
+    Returns:
+        A tuple ``(scale, offset)`` of Python floats.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the data contains NaN or infinite
+            values, or cannot be quantised within the error bound.
+    """
+    data_min = data_max = None
+    for block in blocks:
+        block = np.asarray(block)
+        if block.size == 0:
+            continue
+        block_min = float(block.min())
+        block_max = float(block.max())
+        if data_min is None:
+            data_min, data_max = block_min, block_max
+        else:
+            data_min = min(data_min, block_min)
+            data_max = max(data_max, block_max)
+    if data_min is None:
+        data_min = data_max = 0.0
+    if not (np.isfinite(data_min) and np.isfinite(data_max)):
+        raise ValueError("Data containing NaN or infinite values cannot be "
+                         "quantised")
+    int_max = np.iinfo(dtype).max
+    offset = float(np.float32((data_max + data_min) / 2.0))
+    half_range = max(data_max - offset, offset - data_min)
+    scale = float(np.float32(half_range / int_max)) if half_range > 0 else 1.0
+    if scale * int_max < half_range:
+        # Rounding the scale to float32 made it too small to cover the range
+        scale = float(np.nextafter(np.float32(scale), np.float32(np.inf)))
+    # The error is at most half a quantisation step, plus the float32 rounding
+    # error when the values are converted back
+    max_error = (scale / 2.0 + (half_range + max(abs(data_min), abs(data_max)))
+                 * np.finfo(np.float32).eps)
+    if error_bound is not None and max_error > error_bound:
+        raise ValueError("Data cannot be quantised to {0} with an error of at "
+                         "most {1}; the smallest possible error is {2}"
+                         .format(np.dtype(dtype).name, error_bound, max_error))
+    return scale, offset
+
+
+def quantize_data(data, scale, offset, dtype):
+    """Convert floating point data to quantised integers.
+    
+    Args:
+        data: A floating point :class:`numpy array <numpy.ndarray>`.
+        scale: The quantisation scale.
+        offset: The quantisation offset.
+        dtype: The integer dtype of the result.
+    
+    Returns:
+        A new array of integers ``round((data - offset) / scale)``, clipped to
+        the range of the dtype.
+    """
+    dtype = np.dtype(dtype)
+    int_max = np.iinfo(dtype).max
+    values = np.rint((np.asarray(data, dtype=np.float64) - offset) / scale)
+    return np.clip(values, -int_max, int_max).astype(dtype)
+
+
+def dequantize_data(data, scale, offset):
+    """Convert quantised integers back to float32 data.
+    
+    Args:
+        data: An integer :class:`numpy array <numpy.ndarray>`.
+        scale: The quantisation scale.
+        offset: The quantisation offset.
+    
+    Returns:
+        A new float32 array of ``data * scale + offset``, with the same byte
+        order as ``data``.
+    """
+    data = np.asarray(data)
+    byte_order = data.dtype.byteorder if data.dtype.itemsize > 1 else '='
+    values = data * np.float32(scale) + np.float32(offset)
+    return values.astype(np.dtype(np.float32).newbyteorder(byte_order))
+
+
+# Reduction functions used by bin_data(), keyed by method name
+_bin_methods = {
+    'mean': np.mean,
+    'sum': np.sum,
+    'max': np.max,
+    'min': np.min,
+}
+
+
+def bin_data(data, factors, method='mean'):
+    """Reduce an array by integer factors along each axis.
+    
+    Each bin of ``factors`` items (for example, each 2x2x2 cube for factors of
+    ``(2, 2, 2)``) is reduced to a single value, by reshaping the array so
+    each bin has its own axes and reducing over those axes. Items at the end
+    of an axis which do not fill a whole bin are discarded.
+    
+    Args:
+        data: The array to bin. This can be a :class:`numpy array
+            <numpy.ndarray>` or any array-like object which can be sliced.
+        factors: The binning factor for each axis of the array.
+        method: The reduction to use for each bin: ``'mean'`` (the default),
+            ``'sum'``, ``'max'`` or ``'min'``.
+    
+    Returns:
+        A new :class:`numpy array <numpy.ndarray>` with the length of each axis
+        divided (rounding down) by its binning factor. The dtype is chosen by
+        numpy for the reduction, so for example the mean of integers is
+        float64.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the factors are not positive
+            integers with one for each axis, or the method is not recognised.
+    """
+    if method not in _bin_methods:
+        raise ValueError("Unknown binning method '{0}'".format(method))
+    factors = tuple(int(factor) for factor in factors)
+    shape = tuple(data.shape)
+    if len(factors) != len(shape) or (factors and min(factors) < 1):
+        raise ValueError("Binning factors {0} are not valid for "
+                         "{1}-dimensional data".format(factors, len(shape)))
+    binned_shape = tuple(length // factor
+                         for length, factor in zip(shape, factors))
+    trimmed = np.asarray(data[tuple(slice(0, length * factor)
+                                    for length, factor in zip(binned_shape,
+                                                              factors))])
+    split_shape = []
+    for length, factor in zip(binned_shape, factors):
+        split_shape.extend([length, factor])
+    bin_axes = tuple(range(1, 2 * len(factors), 2))
+    return _bin_methods[method](trimmed.reshape(split_shape), axis=bin_axes)
+
+
+def binned_dtype(dtype, method='mean'):
+    """Return the dtype to use to store binned data in an MRC file.
+    
+    The maximum and minimum of each bin can be stored in the original dtype.
+    Means and sums are stored as float32 (or complex64 for complex data), so
+    that sums of integers cannot overflow and means are not rounded.
+    
+    Args:
+        dtype: The :class:`numpy dtype <numpy.dtype>` of the original data.
+        method: The binning method (see :func:`bin_data`).
+    
+    Returns:
+        The :class:`numpy dtype <numpy.dtype>` to use for the binned data.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the method is not recognised.
+    """
+    if method not in _bin_methods:
+        raise ValueError("Unknown binning method '{0}'".format(method))
+    dtype = np.dtype(dtype)
+    if method in ('max', 'min'):
+        return dtype
+    if dtype.kind == 'c':
+        return np.dtype(np.complex64)
+    return np.dtype(np.float32)
+
+
+# Names and sizes of the items in a SerialEM (SERI) extended header, in the
+# order they appear in each record, keyed by the flag bit in nreal which shows
+# the item is present. Most items are stored as scaled 16-bit integers (see
+# extended_header_dtype()); unnamed items are reserved.
+_serialem_items = [
+    (1, 'tilt_angle', 1),
+    (2, 'piece_coordinates', 3),
+    (4, 'stage_position', 2),
+    (8, 'magnification', 1),
+    (16, 'intensity', 1),
+    (32, 'exposure_dose', 2),
+    (64, 'reserved_64', 1),
+    (128, 'reserved_128', 2),
+    (256, 'reserved_256', 1),
+    (512, 'reserved_512', 2),
+    (1024, 'reserved_1024', 1),
+]
+
+
+def _fei1_dtype(header, extended_header):
+    """Return the FEI1 record dtype, padded if the records are larger."""
+    dtype = FEI1_EXTENDED_HEADER_DTYPE
+    if extended_header is not None and extended_header.nbytes >= 4:
+        record_size = int(np.frombuffer(extended_header.view('V1')[:4]
+                                        .tobytes(), dtype='<i4')[0])
+        if record_size > dtype.itemsize:
+            fields = [dtype.fields[name] for name in dtype.names]
+            dtype = np.dtype({
+                'names': list(dtype.names),
+                'formats': [field[0] for field in fields],
+                'offsets': [field[1] for field in fields],
+                'itemsize': record_size
+            })
+    return dtype
+
+
+def _ints_and_reals_dtype(header, extended_header):
+    """Return a record dtype of ``nint`` integers and ``nreal`` floats."""
+    fields = imod_header_fields(header)
+    byte_order = header.mode.dtype.byteorder
+    nint = max(int(fields.nint), 0)
+    nreal = max(int(fields.nreal), 0)
+    if nint == 0 and nreal == 0:
+        return None
+    return np.dtype([(str('ints'), 'i4', (nint,)),
+                     (str('reals'), 'f4', (nreal,))]).newbyteorder(byte_order)
+
+
+def _serialem_dtype(header, extended_header):
+    """Return the record dtype for a SerialEM extended header.
+    
+    ``nint`` gives the number of bytes in each record and ``nreal`` is a set of
+    flags showing which items are present. If the sizes of the flagged items
+    do not add up to ``nint``, the header is interpreted as an older style
+    header with ``nint`` integers and ``nreal`` floats per section instead.
+    """
+    fields = imod_header_fields(header)
+    nint = int(fields.nint)
+    flags = int(fields.nreal)
+    items = [(str(name), 'i2', (count,)) for flag, name, count
+             in _serialem_items if flags & flag]
+    if (not items or flags >= 2048
+            or sum(2 * item[2][0] for item in items) != nint):
+        return _ints_and_reals_dtype(header, extended_header)
+    byte_order = header.mode.dtype.byteorder
+    return np.dtype(items).newbyteorder(byte_order)
+
+
+_extended_header_dtypes = {
+    b'FEI1': _fei1_dtype,
+    b'SERI': _serialem_dtype,
+    b'AGAR': _ints_and_reals_dtype,
+    b'CCP4': SYMMETRY_EXTENDED_HEADER_DTYPE,
+    b'MRCO': SYMMETRY_EXTENDED_HEADER_DTYPE,
+}
+
+def extended_header_reserve_from_header(header):
+    """Return the number of bytes reserved at the end of the extended header.
+    
+    Reserved space lets the extended header grow later without moving the
+    data block. It is included in the header's ``nsymbt`` field, so the data
+    offset is correct for any reader, and the number of bytes actually in use
+    is stored in the header's ``extra2`` field, marked by a tag. Readers which
+    do not know about the tag simply see zeros at the end of the extended
+    header.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+    
+    Returns:
+        The number of reserved bytes, or 0 if no space is reserved (or the
+        recorded size is not valid for this header).
+    """
+    byte_order = header.mode.dtype.byteorder
+    fields = header.view(EXTENDED_HEADER_RESERVE_HEADER_DTYPE
+                         .newbyteorder(byte_order))
+    if fields.exthdr_tag != EXTENDED_HEADER_RESERVE_TAG:
+        return 0
+    used = int(fields.exthdr_used)
+    nsymbt = int(header.nsymbt)
+    if used < 0 or used > nsymbt:
+        return 0
+    return nsymbt - used
+
+
+def set_header_extended_header_size(header, nbytes, reserve=0):
+    """Record the extended header size and reserved space in the given header.
+    
+    The header's ``nsymbt`` field is set to the total size, including the
+    reserved space. See :func:`extended_header_reserve_from_header`.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+        nbytes: The number of bytes in use in the extended header.
+        reserve: The number of bytes to reserve after the extended header.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If ``reserve`` is negative.
+    """
+    if reserve < 0:
+        raise ValueError("Extended header reserve cannot be negative")
+    byte_order = header.mode.dtype.byteorder
+    fields = header.view(EXTENDED_HEADER_RESERVE_HEADER_DTYPE
+                         .newbyteorder(byte_order))
+    header.nsymbt = nbytes + reserve
+    if reserve == 0:
+        if fields.exthdr_tag == EXTENDED_HEADER_RESERVE_TAG:
+            fields.exthdr_tag = b''
+            fields.exthdr_used = 0
+    else:
+        fields.exthdr_tag = EXTENDED_HEADER_RESERVE_TAG
+        fields.exthdr_used = nbytes
+
+
+def extended_header_dtype(header, extended_header=None):
+    """Return the record dtype for the extended header described by the given
+    header.
+    
+    The dtype is chosen from the ``exttyp`` field. The types known by default
+    are:
+    
+    * ``FEI1``: Per-frame metadata written by Thermo Fisher (FEI) software,
+      such as tilt angles (``alpha_tilt``), ``dose`` and stage position
+      (``x_stage``, ``y_stage`` and ``z_stage``). If the record size given in
+      the first record is larger than the known fields, the dtype is padded to
+      match.
+    * ``SERI``: Per-section metadata written by SerialEM. The items present
+      depend on the ``nint`` and ``nreal`` fields (see
+      :func:`imod_header_fields`), and are stored as 16-bit integers: the tilt
+      angle in degrees multiplied by 100, montage piece coordinates, the stage
+      position in microns multiplied by 25, the magnification divided by 100,
+      the intensity multiplied by 25000 and the exposure dose (as a pair of
+      integers encoding a float, as described in the IMOD documentation).
+    * ``AGAR``: ``nint`` 32-bit integers (field ``ints``) followed by
+      ``nreal`` 32-bit floats (field ``reals``) per section.
+    * ``CCP4`` and ``MRCO``: Symmetry operators, as 80-character text lines.
+    
+    Other types can be added with :func:`register_extended_header_dtype`.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+        extended_header: The extended header, for types whose record size is
+            given in the records themselves. The default is :data:`None`.
+    
+    Returns:
+        The record :class:`numpy dtype <numpy.dtype>`, or :data:`None` if the
+        extended header type is not recognised (or its layout cannot be
+        determined from the header).
+    """
+    dtype = _extended_header_dtypes.get(header.exttyp.item())
+    if callable(dtype):
+        dtype = dtype(header, extended_header)
+    return dtype
+
+
+def register_extended_header_dtype(exttyp, dtype):
+    """Add or replace the record dtype used for an extended header type.
+    
+    Args:
+        exttyp: The extended header type code, as found in the header's
+            ``exttyp`` field (for example, ``b'FEI2'``).
+        dtype: The record :class:`numpy dtype <numpy.dtype>`, or a function
+            which takes the header and extended header as arguments and returns
+            the dtype (or :data:`None` if it cannot be determined).
+    """
+    if not isinstance(exttyp, bytes):
+        exttyp = exttyp.encode('ascii')
+    if not callable(dtype):
+        dtype = np.dtype(dtype)
+    _extended_header_dtypes[exttyp] = dtype
+
+
+_dtype_to_mode = dict(f2=12, f4=2, i1=0, i2=1, u1=0, u2=6, c8=4)
 
 def mode_from_dtype(dtype):
     """Return the MRC mode number corresponding to the given :class:`numpy
@@ -97,11 +892,12 @@ def mode_from_dtype(dtype):
     
     The conversion is as follows:
     
-    * float16   -> mode 2 (data will be widened to 32 bits in the file)
+    * float16   -> mode 12
     * float32   -> mode 2
     * int8      -> mode 0
     * int16     -> mode 1
-    * uint8     -> mode 6 (data will be widened to 16 bits in the file)
+    * uint8     -> mode 0 (the header must also be marked as containing
+      unsigned bytes -- see :func:`set_header_byte_signedness`)
     * uint16    -> mode 6
     * complex64 -> mode 4
     
@@ -128,7 +924,9 @@ _mode_to_dtype = { 0: np.int8,
                    1: np.int16,
                    2: np.float32,
                    4: np.complex64,
-                   6: np.uint16 }
+                   6: np.uint16,
+                   12: np.float16,
+                   101: np.uint8 }
 
 def dtype_from_mode(mode):
     """Return the :class:`numpy dtype <numpy.dtype>` corresponding to the given
@@ -144,6 +942,8 @@ def dtype_from_mode(mode):
     * mode 2 -> float32
     * mode 4 -> complex64
     * mode 6 -> uint16
+    * mode 12 -> float16
+    * mode 101 -> uint8 (4-bit values, packed two to a byte in the file)
     
     Note that mode 3 is not supported as there is no matching numpy dtype.
     
@@ -267,3 +1067,203 @@ def spacegroup_is_volume_stack(ispg):
         :data:`True` if the space group number is in the range 401--630.
     """
     return 401 <= ispg <= 630
+
+
+def axis_order_from_header(header):
+    """Return the axis order recorded in the given header.
+    
+    The axis order is a string of the letters ``x``, ``y`` and ``z``, giving
+    the axes which correspond to the columns, rows and sections of the data
+    (in that order), as recorded in the header's ``mapc``, ``mapr`` and
+    ``maps`` fields. The standard order is ``'xyz'``.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+    
+    Returns:
+        The axis order as a string.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the axis mapping fields are not a
+            permutation of 1, 2 and 3.
+    """
+    mapping = [int(header.mapc), int(header.mapr), int(header.maps)]
+    if sorted(mapping) != [1, 2, 3]:
+        raise ValueError("Invalid axis mapping: found {0}, should be a "
+                         "permutation of [1, 2, 3]".format(mapping))
+    return ''.join('xyz'[axis - 1] for axis in mapping)
+
+
+def set_header_axis_order(header, order):
+    """Set the axis mapping fields in the given header.
+    
+    Args:
+        header: An MRC header as a :class:`numpy record array
+            <numpy.recarray>`.
+        order: The axis order, as a string of the letters ``x``, ``y`` and
+            ``z`` (see :func:`axis_order_from_header`).
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If ``order`` is not a permutation of
+            ``'xyz'``.
+    """
+    order = _check_axis_order(order)
+    header.mapc = 'xyz'.index(order[0]) + 1
+    header.mapr = 'xyz'.index(order[1]) + 1
+    header.maps = 'xyz'.index(order[2]) + 1
+
+
+def transpose_axes(from_order, to_order, ndim):
+    """Work out how to transpose a data array to a different axis order.
+    
+    The last three axes of the array are the sections, rows and columns (or
+    for 2D data, the last two axes are the rows and columns, and the sections
+    must be along the same axis in both orders). Any other axes (for example,
+    the volumes in a volume stack) are left in place.
+    
+    Args:
+        from_order: The current axis order of the data, as a string (see
+            :func:`axis_order_from_header`).
+        to_order: The new axis order.
+        ndim: The number of dimensions of the data array.
+    
+    Returns:
+        A tuple of axes which can be passed to :func:`numpy.transpose`.
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If either order is invalid, or the
+            data is 2D and the orders have different section axes.
+    """
+    from_order = _check_axis_order(from_order)
+    to_order = _check_axis_order(to_order)
+    if ndim < 2:
+        raise ValueError("Data must have at least 2 dimensions")
+    if ndim == 2 and from_order[2] != to_order[2]:
+        raise ValueError("Cannot change the section axis of 2D data")
+    count = 2 if ndim == 2 else 3
+    lead = tuple(range(ndim - count))
+    return lead + tuple(ndim - 1 - from_order.index(to_order[position])
+                        for position in reversed(range(count)))
+
+
+def _check_axis_order(order):
+    """Check an axis order string and return it in lower case."""
+    try:
+        lower = order.lower()
+    except AttributeError:
+        lower = None
+    if lower is None or sorted(lower) != ['x', 'y', 'z']:
+        raise ValueError("Axis order '{0}' is not a permutation of 'xyz'"
+                         .format(order))
+    return lower
+
+
+# Values of the madvise() advice constants, for Python versions whose mmap
+# module does not define them (before Python 3.8)
+_MADVISE_VALUES = {
+    'linux': {'MADV_NORMAL': 0, 'MADV_RANDOM': 1, 'MADV_SEQUENTIAL': 2,
+              'MADV_WILLNEED': 3, 'MADV_DONTNEED': 4, 'MADV_HUGEPAGE': 14},
+    'darwin': {'MADV_NORMAL': 0, 'MADV_RANDOM': 1, 'MADV_SEQUENTIAL': 2,
+               'MADV_WILLNEED': 3, 'MADV_DONTNEED': 4},
+}
+
+# The C library's madvise() function, loaded on first use (False if it has not
+# been loaded yet, None if it is not available)
+_libc_madvise = False
+
+
+def _get_libc_madvise():
+    """Return the C library's madvise() function, or :data:`None` if it is not
+    available."""
+    global _libc_madvise
+    if _libc_madvise is False:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            function = libc.madvise
+        except Exception:
+            function = None
+        else:
+            function.argtypes = (ctypes.c_void_p, ctypes.c_size_t,
+                                 ctypes.c_int)
+            function.restype = ctypes.c_int
+        _libc_madvise = function
+    return _libc_madvise
+
+
+def _madvise_value(advice):
+    """Return the value of a madvise() advice constant, or :data:`None` if it
+    is not known on this platform."""
+    value = getattr(mmap, advice, None)
+    if value is None:
+        platform = sys.platform
+        if platform.startswith('linux'):
+            platform = 'linux'
+        value = _MADVISE_VALUES.get(platform, {}).get(advice)
+    return value
+
+
+def _memory_advice_supported(advice):
+    """Identify if a memory advice hint can be given on this platform.
+    
+    Args:
+        advice: The name of the advice constant, for example
+            ``'MADV_WILLNEED'``.
+    
+    Returns:
+        :data:`True` if :func:`_advise_memory` can give this hint, or
+        :data:`False` if not.
+    """
+    return (_madvise_value(advice) is not None
+            and _get_libc_madvise() is not None)
+
+
+def _advise_memory(array, advice, start=0, stop=None):
+    """Pass a hint about how part of a memory-mapped array will be used to the
+    operating system.
+    
+    This calls the C library's ``madvise()`` function directly (through
+    :mod:`ctypes`) on the array's memory, so it works on all Python versions
+    and does not depend on the internals of :class:`numpy.memmap`. The region
+    is extended back to the start of its first page, as ``madvise()``
+    requires.
+    
+    This is private because some advice (such as ``MADV_DONTNEED``) discards
+    the contents of anonymous memory, so it must only be used on arrays which
+    are memory-mapped from a file.
+    
+    Args:
+        array: A :class:`numpy memmap <numpy.memmap>` (or a view of one). It
+            must be C-contiguous.
+        advice: The name of the advice constant, for example
+            ``'MADV_WILLNEED'``.
+        start: The start of the region, in bytes from the start of the array.
+        stop: The end of the region, in bytes from the start of the array, or
+            :data:`None` for the end of the array.
+    
+    Returns:
+        :data:`True` if the hint was given, or :data:`False` if it is not
+        supported on this platform (or was rejected by the operating system,
+        for example because huge pages are not enabled).
+    
+    Raises:
+        :class:`~exceptions.ValueError`: If the array is not memory-mapped.
+    """
+    base = array
+    while base is not None and not isinstance(base, mmap.mmap):
+        base = getattr(base, 'base', None)
+    if base is None:
+        raise ValueError("Memory advice can only be given for memory-mapped "
+                         "arrays")
+    value = _madvise_value(advice)
+    function = _get_libc_madvise()
+    if value is None or function is None:
+        return False
+    if stop is None:
+        stop = array.nbytes
+    if stop <= start:
+        return False
+    address = array.ctypes.data + start
+    end = array.ctypes.data + stop
+    address -= address % mmap.PAGESIZE
+    return function(address, end - address, value) == 0
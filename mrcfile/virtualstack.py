@@ -0,0 +1,194 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+"""
+virtualstack
+------------
+
+A read-only array-like view of many MRC files stacked together.
+
+Classes:
+    :class:`VirtualStack`: A lazy stack of the data from many MRC files.
+
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import bisect
+from collections import OrderedDict
+
+import numpy as np
+
+from . import utils
+from ._opening import _get_mrc_class, _open_source
+from .lazyarrays import LazyArray
+
+
+# Default number of files to keep open in a VirtualStack
+DEFAULT_OPEN_FILES = 64
+
+
+class VirtualStack(LazyArray):
+    
+    """A lazy stack of the data from many MRC files.
+    
+    Only the file headers are read when the stack is created. Files are
+    opened when values from them are requested, and the most recently used
+    files are kept open (up to a fixed number) so that reading nearby items
+    repeatedly is fast. Uncompressed files are memory-mapped, so only the
+    requested values are read; compressed files are decompressed in full when
+    they are opened.
+    
+    The files can be stacked in two ways:
+    
+    * Along a new first axis (the default), so each file is one item of the
+      stack. All of the files must have data of the same shape. For example,
+      1000 files of 64x64 particle images give a stack of shape
+      ``(1000, 64, 64)``.
+    * Along the existing section axis, so the sections of all the files are
+      concatenated. The files can be 2D (one section) or 3D, with any number
+      of sections, but all sections must be the same shape. For example, a
+      movie split into files of 10 frames each can be read as one stack of
+      frames.
+    
+    Indexing works as for the other :class:`~mrcfile.lazyarrays.LazyArray`
+    classes, and always returns a new :class:`numpy array <numpy.ndarray>`.
+    The stack is read-only.
+    
+    Usage:
+        >>> with VirtualStack(particle_files) as stack:
+        ...     batch = stack[1000:1100]
+        ...     path, index = stack.locate(1050)
+    
+    Note that a :class:`VirtualStack` is not thread-safe: use a separate
+    object in each thread.
+    
+    """
+    
+    def __init__(self, paths, new_axis=True, max_open=DEFAULT_OPEN_FILES):
+        """Initialise a new :class:`VirtualStack`.
+        
+        Args:
+            paths: The names of the MRC files, in stack order.
+            new_axis: If :data:`True` (the default), stack the files along a
+                new first axis. If :data:`False`, concatenate the sections of
+                the files.
+            max_open: The maximum number of files to keep open at once.
+        
+        Raises:
+            :class:`~exceptions.ValueError`: If there are no files, or their
+                data cannot be stacked because the shapes or dtypes differ.
+            :class:`~exceptions.ValueError`: If ``max_open`` is less than 1.
+        """
+        paths = list(paths)
+        if not paths:
+            raise ValueError("No files were given")
+        if max_open < 1:
+            raise ValueError("At least one file must be kept open")
+        item_shape = dtype = None
+        lengths = []
+        sectioned = []
+        for path in paths:
+            with _get_mrc_class(path)(path, header_only=True) as mrc:
+                header = mrc.header
+                file_shape = utils.data_shape_from_header(header)
+                file_dtype = utils.loaded_dtype_from_header(header)
+            if new_axis:
+                file_item_shape = file_shape
+                lengths.append(1)
+                sectioned.append(False)
+            elif len(file_shape) in (2, 3):
+                file_item_shape = file_shape[-2:]
+                lengths.append(file_shape[0] if len(file_shape) == 3 else 1)
+                sectioned.append(len(file_shape) == 3)
+            else:
+                raise ValueError("File '{0}' has {1}-dimensional data; only "
+                                 "2D and 3D files can be concatenated"
+                                 .format(path, len(file_shape)))
+            if item_shape is None:
+                item_shape, dtype = file_item_shape, file_dtype
+            elif file_item_shape != item_shape:
+                raise ValueError("File '{0}' has items of shape {1}, but "
+                                 "expected {2}".format(path, file_item_shape,
+                                                       item_shape))
+            elif file_dtype != dtype:
+                raise ValueError("File '{0}' has data of dtype '{1}', but "
+                                 "expected '{2}'".format(path, file_dtype,
+                                                         dtype))
+        shape = (sum(lengths),) + tuple(item_shape)
+        super(VirtualStack, self).__init__(shape, dtype)
+        self.paths = paths
+        self.new_axis = new_axis
+        self._starts = np.cumsum([0] + lengths[:-1]).tolist()
+        self._sectioned = sectioned
+        self._max_open = max_open
+        self._open_files = OrderedDict()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def locate(self, position):
+        """Find the file which holds an item of the stack.
+        
+        Args:
+            position: The index of the item along the stack's first axis.
+        
+        Returns:
+            A tuple ``(path, index)``, where ``index`` is the section number
+            within the file, or :data:`None` if the file is a single item
+            (that is, if the files are stacked along a new axis or the file is
+            2D).
+        
+        Raises:
+            :class:`~exceptions.IndexError`: If the position is out of range.
+        """
+        position = self._normalise_index(position)[0]
+        file_number, local = self._locate(position)
+        return self.paths[file_number], local
+    
+    def close(self):
+        """Close all of the open files."""
+        while self._open_files:
+            self._open_files.popitem(last=False)[1].close()
+    
+    def _locate(self, position):
+        """Return the file number and section number for a position."""
+        file_number = bisect.bisect_right(self._starts, position) - 1
+        if not self._sectioned[file_number]:
+            return file_number, None
+        return file_number, position - self._starts[file_number]
+    
+    def _open(self, file_number):
+        """Return an open object for a file, opening it if necessary."""
+        mrc = self._open_files.pop(file_number, None)
+        if mrc is None:
+            while len(self._open_files) >= self._max_open:
+                self._open_files.popitem(last=False)[1].close()
+            mrc = _open_source(self.paths[file_number])
+        self._open_files[file_number] = mrc
+        return mrc
+    
+    def _get(self, index):
+        first, rest = index[0], index[1:]
+        if not isinstance(first, slice):
+            return self._read_item(first, rest)
+        items = [self._read_item(position, rest)
+                 for position in range(*first.indices(self.shape[0]))]
+        if items:
+            return np.stack(items)
+        rest_shape = tuple(len(range(*item.indices(length)))
+                           for item, length in zip(rest, self.shape[1:])
+                           if isinstance(item, slice))
+        return np.empty((0,) + rest_shape, dtype=self.dtype)
+    
+    def _read_item(self, position, rest):
+        """Read part of one item of the stack."""
+        file_number, local = self._locate(position)
+        data = self._open(file_number).data
+        if local is not None:
+            rest = (local,) + rest
+        return np.asarray(data[rest])
@@ -22,6 +22,7 @@ setup(
     version=version(),
     packages=['mrcfile'],
     install_requires=['numpy >= 1.11.0'],
+    extras_require={'dask': ['dask[array]']},
     
     test_suite='tests',
     
@@ -9,26 +9,36 @@ from __future__ import (absolute_import, division, print_function,
 
 import unittest
 
+from .test_bricks import BricksTest
 from .test_bzip2mrcfile import Bzip2MrcFileTest
+from .test_chunkstore import ChunkStoreTest
 from .test_gzipmrcfile import GzipMrcFileTest
+from .test_lazyarrays import LazyArraysTest
 from .test_load_functions import LoadFunctionTest
 from .test_mrcobject import MrcObjectTest
 from .test_mrcinterpreter import MrcInterpreterTest
 from .test_mrcfile import MrcFileTest
 from .test_mrcmemmap import MrcMemmapTest
+from .test_pyramid import PyramidTest
 from .test_utils import UtilsTest
 from .test_validation import ValidationTest
+from .test_virtualstack import VirtualStackTest
 
 test_classes = [
+    BricksTest,
     Bzip2MrcFileTest,
+    ChunkStoreTest,
     GzipMrcFileTest,
+    LazyArraysTest,
     LoadFunctionTest,
     MrcObjectTest,
     MrcInterpreterTest,
     MrcFileTest,
     MrcMemmapTest,
+    PyramidTest,
     UtilsTest,
-    ValidationTest
+    ValidationTest,
+    VirtualStackTest
 ]
 
 def load_tests(loader, tests, pattern):
@@ -0,0 +1,148 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+
+"""
+Tests for bricks.py
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import mrcfile
+from mrcfile import bricks
+from . import helpers
+
+
+class BricksTest(helpers.AssertRaisesRegexMixin, unittest.TestCase):
+    
+    """Unit tests for bricked sidecar files.
+    
+    """
+    
+    def setUp(self):
+        super(BricksTest, self).setUp()
+        
+        # Set up test files and names to be used
+        self.test_data = helpers.get_test_data_path()
+        self.test_output = tempfile.mkdtemp()
+        self.temp_mrc_name = os.path.join(self.test_output, 'test_mrcfile.mrc')
+        self.example_mrc_name = os.path.join(self.test_data, 'EMD-3197.map')
+        self.gzip_mrc_name = os.path.join(self.test_data, 'emd_3197.map.gz')
+    
+    def tearDown(self):
+        if os.path.exists(self.test_output):
+            shutil.rmtree(self.test_output)
+        super(BricksTest, self).tearDown()
+    
+    def write_example(self):
+        data = np.arange(5 * 6 * 7, dtype=np.int16).reshape(5, 6, 7)
+        mrcfile.new(self.temp_mrc_name, data).close()
+        return data
+    
+    def test_regions_match_original_data(self):
+        data = self.write_example()
+        sidecar = bricks.build(self.temp_mrc_name, brick=4)
+        assert sidecar == self.temp_mrc_name + '.bricks'
+        with bricks.BrickedReader(self.temp_mrc_name) as reader:
+            assert reader.shape == data.shape
+            assert reader.dtype == data.dtype
+            assert reader.brick_shape == (4, 4, 4)
+            assert reader.compression is None
+            for key in [2, (slice(None), 3), (Ellipsis, 6),
+                        (slice(1, 5), slice(2, 6), slice(3, 7)),
+                        (slice(None, None, -2), 1, slice(None, None, 3)),
+                        (4, 5, 6), (slice(3, 3),)]:
+                np.testing.assert_array_equal(reader.read_region(key),
+                                              data[key])
+            np.testing.assert_array_equal(np.asarray(reader.data), data)
+            assert not reader.data.flags.writeable
+    
+    def test_only_touched_bricks_are_read(self):
+        data = self.write_example()
+        bricks.build(self.temp_mrc_name, brick=(2, 3, 4))
+        with bricks.BrickedReader(self.temp_mrc_name) as reader:
+            read = []
+            read_brick = reader._read_brick
+            def record_read(brick_index):
+                read.append(brick_index)
+                return read_brick(brick_index)
+            reader.data._read_brick = record_read
+            np.testing.assert_array_equal(reader.data[1:3, 2, 5],
+                                          data[1:3, 2, 5])
+            assert sorted(read) == [(0, 0, 1), (1, 0, 1)]
+    
+    def test_compressed_bricks(self):
+        with mrcfile.open(self.gzip_mrc_name) as mrc:
+            data = mrc.data.copy()
+        shutil.copy(self.gzip_mrc_name, self.temp_mrc_name)
+        for compression in ['zlib', 'bzip2']:
+            bricks.build(self.temp_mrc_name, brick=8, compression=compression,
+                         overwrite=True)
+            with bricks.BrickedReader(self.temp_mrc_name) as reader:
+                assert reader.compression == compression
+                np.testing.assert_array_equal(reader.data[:, 10, :],
+                                              data[:, 10, :])
+        with self.assertRaisesRegex(ValueError, "Unknown compression format"):
+            bricks.build(self.temp_mrc_name, compression='lz4', overwrite=True)
+    
+    def test_bricks_are_cached(self):
+        self.write_example()
+        bricks.build(self.temp_mrc_name, brick=4)
+        with bricks.BrickedReader(self.temp_mrc_name,
+                                  cached_bricks=2) as reader:
+            reader.data[0:4, 0:4, 0:8]
+            assert list(reader._cache) == [(0, 0, 0), (0, 0, 1)]
+            reader.data[4, 4, 4]
+            assert list(reader._cache) == [(0, 0, 1), (1, 1, 1)]
+    
+    def test_existing_sidecar_is_not_overwritten(self):
+        self.write_example()
+        sidecar = os.path.join(self.test_output, 'other.bricks')
+        bricks.build(self.temp_mrc_name, sidecar=sidecar)
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            bricks.build(self.temp_mrc_name, sidecar=sidecar)
+        with bricks.BrickedReader(self.temp_mrc_name,
+                                  sidecar=sidecar) as reader:
+            assert reader.brick_shape == (64, 64, 64)
+    
+    def test_out_of_date_sidecar_is_rejected(self):
+        data = self.write_example()
+        bricks.build(self.temp_mrc_name)
+        with mrcfile.open(self.temp_mrc_name, mode='r+') as mrc:
+            mrc.data[0, 0, 0] = -1
+        stat = os.stat(self.temp_mrc_name)
+        os.utime(self.temp_mrc_name, (stat.st_atime, stat.st_mtime + 10))
+        with self.assertRaisesRegex(ValueError, "out of date"):
+            bricks.BrickedReader(self.temp_mrc_name)
+        with bricks.BrickedReader(self.temp_mrc_name,
+                                  check_source=False) as reader:
+            assert reader.data[0, 0, 0] == data[0, 0, 0]
+    
+    def test_invalid_sidecar_files(self):
+        self.write_example()
+        sidecar = os.path.join(self.test_output, 'bad.bricks')
+        with open(sidecar, 'wb') as f:
+            f.write(b'x' * 200)
+        with self.assertRaisesRegex(ValueError, "not a bricked sidecar"):
+            bricks.BrickedReader(self.temp_mrc_name, sidecar=sidecar)
+        bricks.build(self.temp_mrc_name, brick=2, sidecar=sidecar,
+                     overwrite=True)
+        with open(sidecar, 'rb+') as f:
+            f.truncate(200)
+        with self.assertRaisesRegex(ValueError, "truncated"):
+            bricks.BrickedReader(self.temp_mrc_name, sidecar=sidecar,
+                                 check_source=False)
+        with self.assertRaisesRegex(ValueError, "not valid"):
+            bricks.build(self.temp_mrc_name, brick=(2, 2), overwrite=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
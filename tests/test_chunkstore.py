@@ -0,0 +1,171 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+
+"""
+Tests for chunkstore.py
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import mrcfile
+from mrcfile import chunkstore
+from . import helpers
+
+
+class ChunkStoreTest(helpers.AssertRaisesRegexMixin, unittest.TestCase):
+    
+    """Unit tests for chunked directory stores.
+    
+    """
+    
+    def setUp(self):
+        super(ChunkStoreTest, self).setUp()
+        
+        # Set up test files and names to be used
+        self.test_data = helpers.get_test_data_path()
+        self.test_output = tempfile.mkdtemp()
+        self.temp_mrc_name = os.path.join(self.test_output, 'test_mrcfile.mrc')
+        self.store_dir = os.path.join(self.test_output, 'test.chunks')
+        self.example_mrc_name = os.path.join(self.test_data, 'EMD-3197.map')
+        self.gzip_mrc_name = os.path.join(self.test_data, 'emd_3197.map.gz')
+    
+    def tearDown(self):
+        if os.path.exists(self.test_output):
+            shutil.rmtree(self.test_output)
+        super(ChunkStoreTest, self).tearDown()
+    
+    def test_round_trip_is_lossless(self):
+        copy_name = os.path.join(self.test_output, 'copy.mrc')
+        store = chunkstore.export(self.example_mrc_name, self.store_dir,
+                                  chunks=(5, 6, 7))
+        assert store.chunks == (5, 6, 7)
+        assert store.chunk_grid == (4, 4, 3)
+        assert store.codec == 'zlib'
+        chunkstore.import_(self.store_dir, copy_name)
+        with io.open(self.example_mrc_name, 'rb') as f:
+            original = f.read()
+        with io.open(copy_name, 'rb') as f:
+            assert f.read() == original
+    
+    def test_round_trip_with_extended_header_and_big_endian_data(self):
+        data = np.arange(3 * 4 * 5, dtype='>i2').reshape(3, 4, 5)
+        copy_name = os.path.join(self.test_output, 'copy.mrc')
+        with mrcfile.new(self.temp_mrc_name, data) as mrc:
+            mrc.set_extended_header(np.arange(10, dtype='u1').view('V1'),
+                                    reserve=6)
+        for codec in [None, 'bzip2']:
+            chunkstore.export(self.temp_mrc_name, self.store_dir, chunks=2,
+                              codec=codec, overwrite=True)
+            store = chunkstore.ChunkStore(self.store_dir)
+            assert store.header.machst.tobytes() == b'\x11\x11\x00\x00'
+            assert store.extended_header_bytes == (bytes(bytearray(range(10)))
+                                                   + b'\0' * 6)
+            chunkstore.import_(self.store_dir, copy_name, overwrite=True)
+            with io.open(self.temp_mrc_name, 'rb') as f:
+                original = f.read()
+            with io.open(copy_name, 'rb') as f:
+                assert f.read() == original
+    
+    def test_compressed_source_and_regions(self):
+        with mrcfile.open(self.gzip_mrc_name) as mrc:
+            data = mrc.data.copy()
+        store = chunkstore.export(self.gzip_mrc_name, self.store_dir,
+                                  chunks=8)
+        assert sorted(os.listdir(self.store_dir))[:3] == ['0.0.0', '0.0.1',
+                                                          '0.0.2']
+        np.testing.assert_array_equal(store.data[:, 10, 3:17],
+                                      data[:, 10, 3:17])
+        np.testing.assert_array_equal(store.read_chunk((2, 2, 2)),
+                                      data[16:, 16:, 16:])
+        with open(os.path.join(self.store_dir, 'metadata.json')) as f:
+            metadata = json.load(f)
+        assert metadata['shape'] == [20, 20, 20]
+        assert metadata['dtype'] == '<f4'
+    
+    def test_export_streams_volume_stacks_and_images(self):
+        data = np.arange(3 * 5 * 4 * 6, dtype=np.int16).reshape(3, 5, 4, 6)
+        mrcfile.new(self.temp_mrc_name, data).close()
+        store = chunkstore.export(self.temp_mrc_name, self.store_dir,
+                                  chunks=(2, 3, 4, 4))
+        assert store.chunk_grid == (2, 2, 1, 2)
+        np.testing.assert_array_equal(store.data[...], data)
+        image = np.arange(7 * 9, dtype=np.float32).reshape(7, 9)
+        gzip_name = os.path.join(self.test_output, 'image.mrc.gz')
+        mrcfile.new(gzip_name, image, compression='gzip').close()
+        store = chunkstore.export(gzip_name, self.store_dir, chunks=4,
+                                  overwrite=True)
+        assert store.chunk_grid == (2, 3)
+        np.testing.assert_array_equal(store.data[...], image)
+    
+    def test_export_quantized_data(self):
+        data = np.linspace(0, 10, 4 * 5 * 6,
+                           dtype=np.float32).reshape(4, 5, 6)
+        with mrcfile.new(self.temp_mrc_name) as mrc:
+            mrc.set_data(data, quantize='int16')
+            stored = np.array(mrc.data)
+        store = chunkstore.export(self.temp_mrc_name, self.store_dir,
+                                  chunks=3)
+        assert store.dtype == np.float32
+        np.testing.assert_array_equal(store.data[...], stored)
+    
+    def test_chunks_can_be_written_separately(self):
+        data = np.zeros((4, 6, 6), dtype=np.float32)
+        mrcfile.new(self.temp_mrc_name, data).close()
+        chunkstore.export(self.temp_mrc_name, self.store_dir, chunks=(4, 3, 6))
+        writers = [chunkstore.ChunkStore(self.store_dir, mode='r+')
+                   for _ in range(2)]
+        writers[0].write_chunk((0, 0, 0), 1)
+        writers[1].write_chunk((0, 1, 0), np.arange(6))
+        os.remove(os.path.join(self.store_dir, '0.0.0'))
+        store = chunkstore.ChunkStore(self.store_dir)
+        np.testing.assert_array_equal(store.data[0, :, 2],
+                                      [0, 0, 0, 2, 2, 2])
+        assert not [name for name in os.listdir(self.store_dir)
+                    if name.endswith('.tmp')]
+        
+        copy_name = os.path.join(self.test_output, 'copy.mrc')
+        chunkstore.import_(self.store_dir, copy_name, update_header_stats=True)
+        with mrcfile.open(copy_name) as mrc:
+            np.testing.assert_array_equal(mrc.data[3, 4], np.arange(6))
+            assert mrc.header.dmax == 5
+    
+    def test_invalid_stores(self):
+        mrcfile.new(self.temp_mrc_name, np.zeros((4, 4), np.int8)).close()
+        with self.assertRaisesRegex(ValueError, "not a chunk store"):
+            chunkstore.ChunkStore(self.test_output)
+        with self.assertRaisesRegex(ValueError, "Unknown compression codec"):
+            chunkstore.export(self.temp_mrc_name, self.store_dir,
+                              codec='lz4')
+        store = chunkstore.export(self.temp_mrc_name, self.store_dir, chunks=2,
+                                  codec=None)
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            chunkstore.export(self.temp_mrc_name, self.store_dir)
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            chunkstore.import_(self.store_dir, self.temp_mrc_name)
+        with self.assertRaisesRegex(ValueError, "not a chunk store"):
+            chunkstore.export(self.temp_mrc_name, self.test_output,
+                              overwrite=True)
+        assert os.path.exists(self.temp_mrc_name)
+        with self.assertRaisesRegex(ValueError, "read-only"):
+            chunkstore.ChunkStore(self.store_dir).write_chunk((0, 0), 0)
+        with self.assertRaises(IndexError):
+            store.read_chunk((0, 2))
+        with open(os.path.join(self.store_dir, '1.1'), 'wb') as f:
+            f.write(b'bad')
+        with self.assertRaisesRegex(ValueError, "wrong size"):
+            store.read_chunk((1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
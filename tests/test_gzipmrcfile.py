@@ -55,6 +55,10 @@ class GzipMrcFileTest(MrcFileTest):
         with (self.assertRaisesRegex(IOError, 'Not a gzipped file')):
             GzipMrcFile(name, permissive=True)
     
+    def check_extended_header_is_not_loaded(self, mrc):
+        """Override because compressed extended headers are read at once."""
+        assert mrc._extended_header is not None
+    
     def test_repr(self):
         """Override test to change expected repr string."""
         with GzipMrcFile(self.example_mrc_name) as mrc:
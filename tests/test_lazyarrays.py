@@ -0,0 +1,217 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+
+"""
+Tests for lazyarrays.py
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import mrcfile
+import mrcfile.utils as utils
+from .helpers import AssertRaisesRegexMixin
+from mrcfile.lazyarrays import (Packed4BitArray, DequantizedArray,
+                                WindowedMemmapArray, TransposedArray,
+                                FileRegionArray)
+
+
+class CountingArray(object):
+    
+    """Wrapper around a numpy array which records the size of each read."""
+    
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.reads = []
+    
+    def __getitem__(self, key):
+        result = self.array[key]
+        self.reads.append(result.size)
+        return result
+    
+    def __setitem__(self, key, value):
+        self.array[key] = value
+
+
+class LazyArraysTest(AssertRaisesRegexMixin, unittest.TestCase):
+    
+    """Unit tests for lazy array classes."""
+    
+    def setUp(self):
+        super(LazyArraysTest, self).setUp()
+        self.values = (np.arange(4 * 3 * 7, dtype=np.uint8) % 16).reshape(4, 3, 7)
+        self.packed = CountingArray(utils.pack_4bit_data(self.values))
+        self.array = Packed4BitArray(self.packed, 7)
+    
+    def test_attributes(self):
+        assert self.array.shape == (4, 3, 7)
+        assert self.array.dtype == np.uint8
+        assert self.array.ndim == 3
+        assert self.array.size == 84
+        assert self.array.nbytes == 84
+        assert len(self.array) == 4
+    
+    def test_whole_array_can_be_read(self):
+        np.testing.assert_array_equal(np.asarray(self.array), self.values)
+        np.testing.assert_array_equal(self.array[...], self.values)
+        np.testing.assert_array_equal(self.array.copy(), self.values)
+    
+    def test_indexing_matches_numpy(self):
+        for key in [2, -1, (1, 2), (1, 2, 3), (0, slice(None), 6),
+                    (Ellipsis, 1), (slice(1, 3), Ellipsis, slice(2, 6)),
+                    (slice(None, None, -1), 0, slice(1, None, 3)),
+                    (slice(None), slice(None), slice(5, 2))]:
+            np.testing.assert_array_equal(self.array[key], self.values[key])
+    
+    def test_only_requested_section_is_unpacked(self):
+        self.array[2]
+        # One section of 3 rows, each packed into 4 bytes
+        assert self.packed.reads == [12]
+        del self.packed.reads[:]
+        self.array[1, 0, 2:4]
+        # Values 2 and 3 are both in the second byte
+        assert self.packed.reads == [1]
+    
+    def test_values_can_be_set(self):
+        self.array[1, 2, 3] = 9
+        self.array[3, :, 6] = [1, 2, 3]
+        self.values[1, 2, 3] = 9
+        self.values[3, :, 6] = [1, 2, 3]
+        np.testing.assert_array_equal(self.array[...], self.values)
+        np.testing.assert_array_equal(utils.unpack_4bit_data(self.packed.array, 7),
+                                      self.values)
+    
+    def test_out_of_range_values_cannot_be_set(self):
+        with self.assertRaisesRegex(ValueError, "range 0 to 15"):
+            self.array[0, 0, 0] = 16
+        assert self.array[0, 0, 0] == 0
+    
+    def test_invalid_indices_raise_exceptions(self):
+        with self.assertRaises(IndexError):
+            self.array[4]
+        with self.assertRaises(IndexError):
+            self.array[0, 0, 0, 0]
+        with self.assertRaises(TypeError):
+            self.array[[0, 1]]
+        with self.assertRaises(TypeError):
+            self.array[np.newaxis]
+    
+    def test_dequantized_array(self):
+        quantized = np.arange(-12, 12, dtype='>i2').reshape(2, 3, 4)
+        array = DequantizedArray(quantized, 0.5, 10.0)
+        assert array.dtype == np.dtype('>f4')
+        assert array.base is quantized
+        np.testing.assert_array_equal(array[1, 2], [14.0, 14.5, 15.0, 15.5])
+        array[0, 0, :2] = [0.0, 0.26]
+        np.testing.assert_array_equal(quantized[0, 0, :2], [-20, -19])
+        quantized.flags.writeable = False
+        with self.assertRaises(ValueError):
+            array[0, 0, 0] = 1.0
+    
+    
+    def test_windowed_memmap_array(self):
+        values = np.arange(7 * 3 * 4, dtype=np.int16).reshape(7, 3, 4)
+        with tempfile.TemporaryFile() as fileobj:
+            fileobj.write(b'x' * 10)
+            fileobj.write(values.tobytes())
+            fileobj.flush()
+            array = WindowedMemmapArray(fileobj, np.int16, values.shape,
+                                        offset=10, window=3)
+            assert array.window == 3
+            for key in [2, -1, (1, 2), (slice(None), 1, 3),
+                        (slice(1, 6), Ellipsis, slice(2, 4)),
+                        (slice(None, None, -2), 0), (slice(4, 2), 1)]:
+                np.testing.assert_array_equal(array[key], values[key])
+            # Only the window containing the last section is mapped
+            array[-1]
+            assert array._window_start == 6
+            assert array._window_map.shape == (1, 3, 4)
+            array[1:5, 0] = [[-1], [-2], [-3], [-4]]
+            values[1:5, 0] = [[-1], [-2], [-3], [-4]]
+            array[6, 2, 3] = 100
+            values[6, 2, 3] = 100
+            array.release()
+            assert array._window_map is None
+            fileobj.seek(10)
+            written = np.frombuffer(fileobj.read(values.nbytes), np.int16)
+            np.testing.assert_array_equal(written.reshape(values.shape),
+                                          values)
+            array.flags.writeable = False
+            with self.assertRaises(ValueError):
+                array[0, 0, 0] = 1
+            with self.assertRaisesRegex(ValueError, "greater than file size"):
+                WindowedMemmapArray(fileobj, np.int16, (8, 3, 4), offset=10)
+            with self.assertRaisesRegex(ValueError, "at least one section"):
+                WindowedMemmapArray(fileobj, np.int16, (7, 3, 4), window=0)
+    
+    def test_transposed_array(self):
+        values = np.arange(2 * 3 * 4 * 5, dtype=np.int16).reshape(2, 3, 4, 5)
+        base = CountingArray(values.copy())
+        array = TransposedArray(base, (0, 3, 1, 2))
+        expected = np.transpose(values, (0, 3, 1, 2))
+        assert array.shape == (2, 5, 3, 4)
+        assert array.base is base
+        for key in [1, (0, 2), (1, slice(1, 4), 2), (Ellipsis, 3),
+                    (slice(None), 0, slice(None, None, -1), slice(1, 3)),
+                    (1, 4, 2, 3)]:
+            np.testing.assert_array_equal(array[key], expected[key])
+        # Only the requested values are read from the base array
+        base.reads = []
+        array[1, 2, 0]
+        assert base.reads == [4]
+        array[1, :, 2, 3] = np.arange(5)
+        expected[1, :, 2, 3] = np.arange(5)
+        array[0, 1] = 7
+        expected[0, 1] = 7
+        np.testing.assert_array_equal(np.transpose(base.array, (0, 3, 1, 2)),
+                                      expected)
+        with self.assertRaisesRegex(ValueError, "not a permutation"):
+            TransposedArray(values, (0, 1, 1, 2))
+    
+    def test_file_region_array(self):
+        values = np.arange(3 * 4 * 5, dtype=np.float32).reshape(3, 4, 5)
+        test_output = tempfile.mkdtemp()
+        try:
+            name = os.path.join(test_output, 'test.mrc')
+            mrcfile.new(name, values).close()
+            array = FileRegionArray(name, values.shape, values.dtype)
+            array = pickle.loads(pickle.dumps(array))
+            assert not array.flags.writeable
+            np.testing.assert_array_equal(array[1:3, 2], values[1:3, 2])
+            np.testing.assert_array_equal(np.asarray(array), values)
+            
+            # Compressed files are read through a bricked sidecar file
+            gzip_name = os.path.join(test_output, 'test.mrc.gz')
+            mrcfile.new(gzip_name, values, compression='gzip').close()
+            sidecar = mrcfile.bricks.build(gzip_name, brick=2)
+            array = FileRegionArray(gzip_name, values.shape, values.dtype,
+                                    sidecar=sidecar)
+            np.testing.assert_array_equal(array[:, 1:4, 3], values[:, 1:4, 3])
+            np.testing.assert_array_equal(array[2], values[2])
+            # One reader is kept open and reused, with its brick cache
+            assert len(array._readers) == 1
+            reader = array._readers[0]
+            assert reader._cache
+            copy = pickle.loads(pickle.dumps(array))
+            assert copy._readers == []
+            np.testing.assert_array_equal(copy[1, 0], values[1, 0])
+            copy.close()
+            array.close()
+            assert array._readers == []
+            assert reader._file.closed
+        finally:
+            shutil.rmtree(test_output)
+
+if __name__ == '__main__':
+    unittest.main()
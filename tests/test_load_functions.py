@@ -11,12 +11,20 @@ from __future__ import (absolute_import, division, print_function,
 
 import os
 import shutil
+import sys
 import tempfile
+import types
 import unittest
 
 import numpy as np
 
 import mrcfile
+from mrcfile import utils
+
+try:
+    import dask.array
+except ImportError:
+    dask = None
 from . import helpers
 
 
@@ -95,6 +103,467 @@ class LoadFunctionTest(helpers.AssertRaisesRegexMixin, unittest.TestCase):
             assert repr(mrc) == ("Bzip2MrcFile('{0}', mode='w+')"
                                  .format(self.temp_mrc_name))
     
+    def test_new_mmap(self):
+        with mrcfile.new_mmap(self.temp_mrc_name, (3, 4, 5),
+                              np.float32) as mrc:
+            assert repr(mrc) == ("MrcMemmap('{0}', mode='w+')"
+                                 .format(self.temp_mrc_name))
+            assert isinstance(mrc.data, np.memmap)
+            assert mrc.data.shape == (3, 4, 5)
+            assert mrc.data.dtype == np.float32
+            assert mrc.header.mode == 2
+            assert (mrc.header.nx, mrc.header.ny, mrc.header.nz) == (5, 4, 3)
+            assert mrc.header.rms == -1
+            np.testing.assert_array_equal(mrc.data, 0)
+            mrc.data[1] = 2.5
+        assert os.path.getsize(self.temp_mrc_name) == 1024 + 3 * 4 * 5 * 4
+        with mrcfile.open(self.temp_mrc_name) as mrc:
+            np.testing.assert_array_equal(mrc.data[:, 0, 0], [0, 2.5, 0])
+    
+    def test_new_mmap_with_fill_value(self):
+        with mrcfile.new_mmap(self.temp_mrc_name, (2, 6), np.uint8, fill=7,
+                              sparse=False) as mrc:
+            assert mrc.header.mode == 0
+            np.testing.assert_array_equal(mrc.data, 7)
+        with mrcfile.open(self.temp_mrc_name) as mrc:
+            assert mrc.data.dtype == np.uint8
+            np.testing.assert_array_equal(mrc.data,
+                                          np.full((2, 6), 7, dtype=np.uint8))
+    
+    def test_new_mmap_can_be_written_by_several_handles(self):
+        mrcfile.new_mmap(self.temp_mrc_name, (4, 3, 3), np.int16).close()
+        for index in range(4):
+            with mrcfile.mmap(self.temp_mrc_name, mode='r+') as mrc:
+                mrc.data[index] = index
+        with mrcfile.mmap(self.temp_mrc_name) as mrc:
+            np.testing.assert_array_equal(mrc.data[:, 1, 1], np.arange(4))
+    
+    def test_new_mmap_can_be_opened_while_creator_is_open(self):
+        with mrcfile.new_mmap(self.temp_mrc_name, (4, 3, 3), np.int16,
+                              extended_header_reserve=100) as creator:
+            creator.data[0] = 5
+            with mrcfile.mmap(self.temp_mrc_name, mode='r+') as mrc:
+                assert mrc.data.shape == (4, 3, 3)
+                assert mrc.header.nsymbt == 100
+                mrc.data[3] = 9
+            np.testing.assert_array_equal(creator.data[:, 1, 1], [5, 0, 0, 9])
+        with mrcfile.open(self.temp_mrc_name) as mrc:
+            np.testing.assert_array_equal(mrc.data[:, 1, 1], [5, 0, 0, 9])
+    
+    def test_new_mmap_with_extended_header_reserve(self):
+        with mrcfile.new_mmap(self.temp_mrc_name, (3, 4), np.int16,
+                              extended_header_reserve=1000) as mrc:
+            assert mrc.header.nsymbt == 1000
+            assert mrc.extended_header.nbytes == 0
+            mrc.data[1] = 7
+            mrc.header.exttyp = b'SERI'
+            mrc.set_extended_header(np.ones(64, dtype='u1').view('V1'))
+            assert mrc.header.nsymbt == 1000
+            mrc.data[2] = 8
+        assert os.path.getsize(self.temp_mrc_name) == 1024 + 1000 + 3 * 4 * 2
+        with mrcfile.open(self.temp_mrc_name) as mrc:
+            assert mrc.extended_header.nbytes == 64
+            np.testing.assert_array_equal(mrc.data[:, 0], [0, 7, 8])
+    
+    def test_new_mmap_with_invalid_dtype(self):
+        with self.assertRaisesRegex(ValueError, "cannot be converted"):
+            mrcfile.new_mmap(self.temp_mrc_name, (2, 2), np.float64)
+        assert not os.path.exists(self.temp_mrc_name)
+    
+    def test_new_mmap_overwriting_flag(self):
+        open(self.temp_mrc_name, 'w+').close()
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            mrcfile.new_mmap(self.temp_mrc_name, (2, 2), np.int8)
+        mrcfile.new_mmap(self.temp_mrc_name, (2, 2), np.int8,
+                         overwrite=True).close()
+    
+    def test_reslice(self):
+        data = np.arange(3 * 4 * 5, dtype=np.float32).reshape(3, 4, 5)
+        resliced_name = os.path.join(self.test_output, 'resliced.mrc')
+        with mrcfile.new(self.temp_mrc_name, data) as mrc:
+            mrc.voxel_size = (1.0, 2.0, 3.0)
+            mrc.header.nxstart, mrc.header.nystart, mrc.header.nzstart = 1, 2, 3
+            mrc.header.origin = (10.0, 20.0, 30.0)
+            mrc.update_header_stats()
+            mrc.set_extended_header(np.ones(8, dtype='u1').view('V1'))
+        mrcfile.reslice(self.temp_mrc_name, resliced_name, max_bytes=40)
+        with mrcfile.open(resliced_name) as mrc:
+            # Each section is now an XZ plane
+            assert (mrc.header.mapc, mrc.header.mapr, mrc.header.maps) == (3, 1, 2)
+            assert mrc.data.shape == (4, 5, 3)
+            assert (mrc.header.nx, mrc.header.ny, mrc.header.nz) == (3, 5, 4)
+            assert ((mrc.header.nxstart, mrc.header.nystart,
+                     mrc.header.nzstart) == (3, 1, 2))
+            np.testing.assert_array_equal(mrc.data[2], data[:, 2, :].T)
+            np.testing.assert_array_equal(mrc.as_canonical(), data)
+            assert mrc.voxel_size.item() == (1.0, 2.0, 3.0)
+            assert mrc.header.origin.item() == (10.0, 20.0, 30.0)
+            assert mrc.header.dmax == data.max()
+            assert mrc.extended_header.tobytes() == b'\x01' * 8
+        # Reslicing back to the standard order gives the original data
+        mrcfile.reslice(resliced_name, self.temp_mrc_name, order='xyz',
+                        overwrite=True)
+        with mrcfile.open(self.temp_mrc_name) as mrc:
+            assert (mrc.header.mapc, mrc.header.mapr, mrc.header.maps) == (1, 2, 3)
+            np.testing.assert_array_equal(mrc.data, data)
+            assert ((mrc.header.nxstart, mrc.header.nystart,
+                     mrc.header.nzstart) == (1, 2, 3))
+    
+    def test_reslice_compressed_volume_stack(self):
+        data = np.arange(2 * 3 * 4 * 5, dtype='>i2').reshape(2, 3, 4, 5)
+        resliced_name = os.path.join(self.test_output, 'resliced.mrc')
+        mrcfile.new(self.temp_mrc_name, data, compression='gzip').close()
+        mrcfile.reslice(self.temp_mrc_name, resliced_name, order='yzx')
+        with mrcfile.open(resliced_name) as mrc:
+            assert mrc.is_volume_stack()
+            assert mrc.data.dtype == np.dtype('>i2')
+            np.testing.assert_array_equal(mrc.data,
+                                          np.transpose(data, (0, 3, 1, 2)))
+            np.testing.assert_array_equal(mrc.as_canonical(), data)
+    
+    def test_reslice_errors(self):
+        data = np.zeros((3, 4), dtype=np.int8)
+        resliced_name = os.path.join(self.test_output, 'resliced.mrc')
+        mrcfile.new(self.temp_mrc_name, data).close()
+        with self.assertRaisesRegex(ValueError, "not a permutation"):
+            mrcfile.reslice(self.temp_mrc_name, resliced_name, order='xz')
+        with self.assertRaisesRegex(ValueError, "section axis of 2D data"):
+            mrcfile.reslice(self.temp_mrc_name, resliced_name)
+        mrcfile.reslice(self.temp_mrc_name, resliced_name, order='yxz')
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            mrcfile.reslice(self.temp_mrc_name, resliced_name, order='yxz')
+    
+    def test_bin(self):
+        data = np.arange(7 * 10 * 9, dtype=np.int16).reshape(7, 10, 9)
+        binned_name = os.path.join(self.test_output, 'binned.mrc')
+        with mrcfile.new(self.temp_mrc_name, data) as mrc:
+            mrc.voxel_size = (1.0, 2.0, 3.0)
+            mrc.header.nxstart = 4
+            mrc.header.nystart = 5
+            mrc.header.nzstart = 6
+            mrc.header.origin = (10.0, 20.0, 30.0)
+        mrcfile.bin(self.temp_mrc_name, binned_name, max_bytes=200)
+        with mrcfile.open(binned_name) as mrc:
+            assert mrc.data.dtype == np.float32
+            np.testing.assert_array_equal(mrc.data,
+                                          utils.bin_data(data, (2, 2, 2)))
+            assert (mrc.header.mx, mrc.header.my, mrc.header.mz) == (4, 5, 3)
+            assert mrc.voxel_size.item() == (2.0, 4.0, 6.0)
+            assert mrc.header.cella.item() == (8.0, 20.0, 18.0)
+            assert ((mrc.header.nxstart, mrc.header.nystart,
+                     mrc.header.nzstart) == (2, 2, 3))
+            assert mrc.header.origin.item() == (10.0, 20.0, 30.0)
+            assert mrc.header.dmax == mrc.data.max()
+            assert mrc.header.nsymbt == 0
+        mrcfile.bin(self.temp_mrc_name, binned_name, factor=(3, 1, 4),
+                    method='sum', overwrite=True)
+        with mrcfile.open(binned_name) as mrc:
+            np.testing.assert_array_equal(
+                mrc.data, utils.bin_data(data, (3, 1, 4), 'sum'))
+            assert mrc.voxel_size.item() == (4.0, 2.0, 9.0)
+    
+    def test_bin_compressed_image_stack(self):
+        data = np.arange(3 * 6 * 5, dtype=np.uint16).reshape(3, 6, 5)
+        source_name = os.path.join(self.test_output, 'stack.mrc.gz')
+        binned_name = os.path.join(self.test_output, 'binned.mrc.bz2')
+        with mrcfile.new(source_name, data, compression='gzip') as mrc:
+            mrc.set_image_stack()
+            mrc.set_extended_header(np.arange(6, dtype='u1').view('V1'))
+        mrcfile.bin(source_name, binned_name, factor=(1, 3, 2), method='max',
+                    compression='bzip2', max_bytes=1)
+        # The temporary uncompressed file has been removed
+        assert sorted(os.listdir(self.test_output)) == ['binned.mrc.bz2',
+                                                        'stack.mrc.gz']
+        with mrcfile.open(binned_name) as mrc:
+            assert isinstance(mrc, mrcfile.bzip2mrcfile.Bzip2MrcFile)
+            assert mrc.is_image_stack()
+            assert mrc.data.dtype == np.uint16
+            np.testing.assert_array_equal(
+                mrc.data, utils.bin_data(data, (1, 3, 2), 'max'))
+            assert mrc.extended_header.tobytes() == bytes(bytearray(range(6)))
+    
+    def test_bin_quantized_source(self):
+        data = np.linspace(-300, 300, 4 * 6 * 6,
+                           dtype=np.float32).reshape(4, 6, 6)
+        binned_name = os.path.join(self.test_output, 'binned.mrc')
+        with mrcfile.new(self.temp_mrc_name) as mrc:
+            mrc.set_data(data, quantize='int8')
+            stored = np.array(mrc.data)
+        for method in ['max', 'min', 'mean']:
+            mrcfile.bin(self.temp_mrc_name, binned_name, method=method,
+                        overwrite=True)
+            with mrcfile.open(binned_name) as mrc:
+                assert mrc.header.mode == 2
+                assert mrc.data.dtype == np.float32
+                np.testing.assert_allclose(
+                    mrc.data, utils.bin_data(stored, (2, 2, 2), method),
+                    rtol=1e-6)
+    
+    def test_bin_copies_extended_header_description(self):
+        data = np.zeros((3, 4, 4), dtype=np.int16)
+        binned_name = os.path.join(self.test_output, 'binned.mrc')
+        with mrcfile.new(self.temp_mrc_name, data) as mrc:
+            mrc.header.exttyp = b'AGAR'
+            mrc.header.nversion = 20141
+            fields = utils.imod_header_fields(mrc.header)
+            fields.nint, fields.nreal = 1, 1
+            records = np.zeros(3, dtype=[(str('ints'), '<i4', (1,)),
+                                         (str('reals'), '<f4', (1,))])
+            records['ints'][:, 0] = [1, 2, 3]
+            records['reals'][:, 0] = [0.5, 1.5, 2.5]
+            mrc.set_extended_header(records.view('V1'))
+        mrcfile.bin(self.temp_mrc_name, binned_name, factor=(1, 2, 2))
+        with mrcfile.open(binned_name) as mrc:
+            assert mrc.header.exttyp == b'AGAR'
+            assert mrc.header.nversion == 20141
+            fields = utils.imod_header_fields(mrc.header)
+            assert (fields.nint, fields.nreal) == (1, 1)
+            binned_records = mrc.extended_header_records
+            assert binned_records['ints'][:, 0].tolist() == [1, 2, 3]
+            assert binned_records['reals'][:, 0].tolist() == [0.5, 1.5, 2.5]
+        mrcfile.bin(self.temp_mrc_name, binned_name, factor=(3, 2, 2),
+                    overwrite=True)
+        with mrcfile.open(binned_name) as mrc:
+            assert mrc.header.nsymbt == 0
+            assert mrc.header.exttyp == b''
+    
+    def test_bin_errors(self):
+        mrcfile.new(self.temp_mrc_name, np.zeros((4, 6), np.int8)).close()
+        binned_name = os.path.join(self.test_output, 'binned.mrc')
+        mrcfile.bin(self.temp_mrc_name, binned_name, factor=3)
+        with mrcfile.open(binned_name) as mrc:
+            assert mrc.data.shape == (1, 2)
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            mrcfile.bin(self.temp_mrc_name, binned_name)
+        with self.assertRaisesRegex(ValueError, "cannot be binned along Z"):
+            mrcfile.bin(self.temp_mrc_name, binned_name, factor=(2, 2, 2),
+                        overwrite=True)
+        with self.assertRaisesRegex(ValueError, "too small"):
+            mrcfile.bin(self.temp_mrc_name, binned_name, factor=5,
+                        overwrite=True)
+        with self.assertRaisesRegex(ValueError, "positive integer"):
+            mrcfile.bin(self.temp_mrc_name, binned_name, factor=(2, 2),
+                        overwrite=True)
+        with self.assertRaisesRegex(ValueError, "Unknown binning method"):
+            mrcfile.bin(self.temp_mrc_name, binned_name, method='median',
+                        overwrite=True)
+        with self.assertRaisesRegex(ValueError, "Unknown compression format"):
+            mrcfile.bin(self.temp_mrc_name, binned_name, compression='lz4',
+                        overwrite=True)
+    
+    def test_preview_of_central_section(self):
+        data = np.arange(5 * 10 * 21, dtype=np.int16).reshape(5, 10, 21)
+        with mrcfile.new(self.temp_mrc_name, data) as mrc:
+            mrc.header.dmin, mrc.header.dmax = 0, 1020
+        thumbnail = mrcfile.preview(self.temp_mrc_name, max_size=8)
+        assert thumbnail.dtype == np.uint8
+        expected = data[2, ::3, ::3] / 4.0
+        np.testing.assert_array_equal(thumbnail, np.rint(expected))
+    
+    def test_preview_projection_without_header_stats(self):
+        data = np.zeros((9, 4, 4), dtype=np.float32)
+        data[4] = 6.0
+        data[:, 0, 0] = 0.0
+        data[:, 0, 1] = 6.0
+        with mrcfile.new(self.temp_mrc_name, data) as mrc:
+            mrc.reset_header_stats()
+        thumbnail = mrcfile.preview(self.temp_mrc_name)
+        assert thumbnail.shape == (4, 4)
+        assert (thumbnail[0, 0], thumbnail[0, 1]) == (0, 255)
+        assert (thumbnail[1:, 1:] == 255).all()
+        thumbnail = mrcfile.preview(self.temp_mrc_name, projection=3)
+        assert (thumbnail[1:, 1:] == 85).all()
+        thumbnail = mrcfile.preview(self.temp_mrc_name, projection=20)
+        assert (thumbnail[1:, 1:] == 28).all()
+        with self.assertRaisesRegex(ValueError, "at least 1"):
+            mrcfile.preview(self.temp_mrc_name, projection=0)
+    
+    def test_preview_of_complex_data_uses_amplitude_range(self):
+        data = np.empty((4, 4), dtype=np.complex64)
+        data.real = 1.0
+        data.imag = np.arange(16).reshape(4, 4) * 10.0
+        with mrcfile.new(self.temp_mrc_name, data) as mrc:
+            # Header stats which describe only the real part
+            mrc.header.dmin, mrc.header.dmax = 0.0, 1.0
+        thumbnail = mrcfile.preview(self.temp_mrc_name)
+        amplitude = np.abs(data)
+        expected = ((amplitude - amplitude.min()) * 255.0
+                    / (amplitude.max() - amplitude.min()))
+        np.testing.assert_array_equal(thumbnail, np.rint(expected))
+        assert (thumbnail == 255).sum() == 1
+    
+    def test_preview_output_files(self):
+        data = np.arange(6, dtype=np.float32).reshape(2, 3)
+        name = os.path.join(self.test_output, 'test_mrcfile.mrc.gz')
+        mrcfile.new(name, data, compression='gzip').close()
+        pgm_name = os.path.join(self.test_output, 'thumb.pgm')
+        raw_name = os.path.join(self.test_output, 'thumb.raw')
+        thumbnail = mrcfile.preview(name, output=pgm_name)
+        mrcfile.preview(name, output=raw_name)
+        with open(pgm_name, 'rb') as f:
+            assert f.read() == b'P5\n3 2\n255\n' + thumbnail[::-1].tobytes()
+        with open(raw_name, 'rb') as f:
+            assert f.read() == bytes(bytearray([0, 51, 102, 153, 204, 255]))
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            mrcfile.preview(name, output=raw_name)
+        mrcfile.preview(name, output=raw_name, overwrite=True)
+        with self.assertRaisesRegex(ValueError, "at least 1"):
+            mrcfile.preview(name, max_size=0)
+    
+    @unittest.skipIf(dask is None, "dask is not installed")
+    def test_to_dask(self):
+        data = np.arange(2 * 3 * 4 * 5, dtype='>i2').reshape(2, 3, 4, 5)
+        mrcfile.new(self.temp_mrc_name, data).close()
+        array = mrcfile.to_dask(self.temp_mrc_name)
+        assert array.shape == data.shape
+        assert array.dtype == data.dtype
+        assert array.chunks == ((2,), (3,), (4,), (5,))
+        np.testing.assert_array_equal(array.compute(), data)
+        array = mrcfile.to_dask(self.temp_mrc_name, chunks=(1, 2, 4, 5))
+        assert array.numblocks == (2, 2, 1, 1)
+        assert array.sum().compute() == data.sum()
+        np.testing.assert_array_equal(array[1, 2].compute(), data[1, 2])
+    
+    @unittest.skipIf(dask is None, "dask is not installed")
+    def test_to_dask_with_compressed_file(self):
+        data = np.arange(6 * 7 * 8, dtype=np.float32).reshape(6, 7, 8)
+        name = os.path.join(self.test_output, 'test_mrcfile.mrc.bz2')
+        mrcfile.new(name, data, compression='bzip2').close()
+        with self.assertRaisesRegex(ValueError, "no bricked sidecar"):
+            mrcfile.to_dask(name)
+        mrcfile.bricks.build(name, brick=4)
+        array = mrcfile.to_dask(name)
+        assert array.chunks == ((4, 2), (4, 3), (4, 4))
+        np.testing.assert_array_equal(array[:, 3].compute(), data[:, 3])
+    
+    def to_dask_with_fake_dask(self, *args, **kwargs):
+        """Call to_dask() with a minimal stand-in for dask.array.
+        
+        Returns the source array and chunk shape passed to from_array(), and
+        the data read from the source one chunk at a time, as dask would.
+        """
+        def from_array(source, chunks):
+            return source, tuple(chunks)
+        fake_dask = types.ModuleType(str('dask'))
+        fake_dask.array = types.ModuleType(str('dask.array'))
+        fake_dask.array.from_array = from_array
+        saved = dict((key, sys.modules.get(key))
+                     for key in ['dask', 'dask.array'])
+        sys.modules['dask'] = fake_dask
+        sys.modules['dask.array'] = fake_dask.array
+        try:
+            source, chunks = mrcfile.to_dask(*args, **kwargs)
+        finally:
+            for key, module in saved.items():
+                if module is None:
+                    del sys.modules[key]
+                else:
+                    sys.modules[key] = module
+        values = np.empty(source.shape, dtype=source.dtype)
+        grid = [-(-length // size) for length, size in zip(source.shape,
+                                                            chunks)]
+        for chunk_index in np.ndindex(*grid):
+            region = tuple(slice(number * size, (number + 1) * size)
+                           for number, size in zip(chunk_index, chunks))
+            values[region] = source[region]
+        return source, chunks, values
+    
+    @unittest.skipIf(dask is not None, "dask is installed")
+    def test_to_dask_with_fake_dask(self):
+        data = np.arange(2 * 3 * 4 * 5, dtype='>i2').reshape(2, 3, 4, 5)
+        mrcfile.new(self.temp_mrc_name, data).close()
+        source, chunks, values = self.to_dask_with_fake_dask(
+            self.temp_mrc_name)
+        assert source.shape == data.shape
+        assert source.dtype == data.dtype
+        assert chunks == (2, 3, 4, 5)
+        np.testing.assert_array_equal(values, data)
+        source, chunks, values = self.to_dask_with_fake_dask(
+            self.temp_mrc_name, chunks=(1, 2, 4, 5))
+        assert chunks == (1, 2, 4, 5)
+        np.testing.assert_array_equal(values, data)
+    
+    @unittest.skipIf(dask is not None, "dask is installed")
+    def test_to_dask_with_fake_dask_and_compressed_file(self):
+        data = np.arange(6 * 7 * 8, dtype=np.float32).reshape(6, 7, 8)
+        name = os.path.join(self.test_output, 'test_mrcfile.mrc.bz2')
+        mrcfile.new(name, data, compression='bzip2').close()
+        with self.assertRaisesRegex(ValueError, "no bricked sidecar"):
+            self.to_dask_with_fake_dask(name)
+        mrcfile.bricks.build(name, brick=4)
+        source, chunks, values = self.to_dask_with_fake_dask(name)
+        assert chunks == (4, 4, 4)
+        np.testing.assert_array_equal(values, data)
+        # All of the chunks were read through one sidecar reader
+        assert len(source._readers) == 1
+        source.close()
+    
+    @unittest.skipIf(dask is not None, "dask is installed")
+    def test_to_dask_without_dask(self):
+        mrcfile.new(self.temp_mrc_name, np.zeros((2, 2), np.int8)).close()
+        with self.assertRaisesRegex(ImportError, "requires dask"):
+            mrcfile.to_dask(self.temp_mrc_name)
+    
+    def test_section_chunks(self):
+        assert mrcfile._section_chunks((6, 7), 4, 10) == (6, 7)
+        assert mrcfile._section_chunks((5, 6, 7), 2, 200) == (2, 6, 7)
+        assert mrcfile._section_chunks((5, 6, 7), 2, 10) == (1, 6, 7)
+        assert mrcfile._section_chunks((5, 6, 7), 2, 10000) == (5, 6, 7)
+        assert mrcfile._section_chunks((3, 4, 5, 6), 1, 60) == (1, 2, 5, 6)
+        assert mrcfile._section_chunks((3, 4, 5, 6), 1, 250) == (2, 4, 5, 6)
+    
+    def test_load_many(self):
+        arrays = [np.arange(2 * 3 * 4, dtype=np.int16).reshape(2, 3, 4) * n
+                  for n in range(5)]
+        names = []
+        for number, array in enumerate(arrays):
+            name = os.path.join(self.test_output,
+                                '{0}.mrc'.format(number))
+            if number % 2:
+                name += '.gz'
+            mrcfile.new(name, array, compression=('gzip' if number % 2
+                                                  else None)).close()
+            names.append(name)
+        data = mrcfile.load_many(names, workers=3)
+        assert data.dtype == np.int16
+        np.testing.assert_array_equal(data, np.stack(arrays))
+        out = np.zeros((5, 3, 2, 4), dtype=np.float32).transpose(0, 2, 1, 3)
+        assert mrcfile.load_many(iter(names), out=out) is out
+        np.testing.assert_array_equal(out, np.stack(arrays))
+    
+    def test_load_many_images_and_quantized_data(self):
+        names = [os.path.join(self.test_output, '{0}.mrc'.format(number))
+                 for number in range(3)]
+        for number, name in enumerate(names):
+            with mrcfile.new(name) as mrc:
+                mrc.set_data(np.full((3, 4), number / 2, dtype=np.float32),
+                             quantize='int16')
+        data = mrcfile.load_many(names)
+        assert data.shape == (3, 3, 4)
+        assert data.dtype == np.float32
+        np.testing.assert_allclose(data[:, 1, 2], [0, 0.5, 1], atol=1e-3)
+    
+    def test_load_many_errors(self):
+        with self.assertRaisesRegex(ValueError, "No files"):
+            mrcfile.load_many([])
+        names = [os.path.join(self.test_output, '{0}.mrc'.format(number))
+                 for number in range(3)]
+        mrcfile.new(names[0], np.zeros((2, 3), np.int8)).close()
+        mrcfile.new(names[1], np.zeros((3, 2), np.int8)).close()
+        mrcfile.new(names[2], np.zeros((2, 3), np.int16)).close()
+        with self.assertRaisesRegex(ValueError, "1.mrc' has data of shape"):
+            mrcfile.load_many(names[:2])
+        with self.assertRaisesRegex(ValueError, "dtype 'int16'"):
+            mrcfile.load_many([names[0], names[2]])
+        with self.assertRaisesRegex(ValueError, "needs shape"):
+            mrcfile.load_many(names[:1], out=np.zeros((2, 2, 3)))
+        # A bad file is found before any data is read into out
+        mrcfile.new(names[1], np.ones((2, 3), np.int8), overwrite=True).close()
+        out = np.full((3, 2, 3), 7, dtype=np.int8)
+        with self.assertRaisesRegex(ValueError, "2.mrc' has data"):
+            mrcfile.load_many(names, workers=1, out=out)
+        assert (out == 7).all()
+    
     def test_unknown_compression_type(self):
         with self.assertRaisesRegex(ValueError, 'Unknown compression format'):
             mrcfile.new(self.temp_mrc_name, compression='other')
@@ -21,6 +21,7 @@ import numpy as np
 from . import helpers
 from .test_mrcobject import MrcObjectTest
 from mrcfile import MrcFile
+import mrcfile.utils as utils
 from mrcfile.mrcobject import (IMAGE_STACK_SPACEGROUP, VOLUME_SPACEGROUP,
                                VOLUME_STACK_SPACEGROUP)
 
@@ -180,6 +181,160 @@ class MrcFileTest(MrcObjectTest):
             mrc._read()
             np.testing.assert_array_equal(orig_data, mrc.data)
     
+    def test_header_only_mode_does_not_read_data(self):
+        with self.newmrc(self.ext_header_mrc_name, header_only=True) as mrc:
+            assert mrc.data is None
+            assert mrc.header.nsymbt == 160
+            assert mrc.extended_header.nbytes == 160
+            with self.newmrc(self.ext_header_mrc_name) as full_mrc:
+                assert mrc.header.tobytes() == full_mrc.header.tobytes()
+    
+    def test_extended_header_is_read_when_first_accessed(self):
+        with self.newmrc(self.ext_header_mrc_name) as full_mrc:
+            expected = full_mrc.extended_header.tobytes()
+            data = np.array(full_mrc.data)
+        with self.newmrc(self.ext_header_mrc_name, header_only=True) as mrc:
+            self.check_extended_header_is_not_loaded(mrc)
+            position = mrc._iostream.tell()
+            assert mrc.extended_header.tobytes() == expected
+            assert mrc._iostream.tell() == position
+            blocks = list(mrc._iter_section_blocks())
+            np.testing.assert_array_equal(np.concatenate(blocks), data)
+    
+    def check_extended_header_is_not_loaded(self, mrc):
+        assert mrc._extended_header is None
+    
+    def test_extended_header_can_be_edited_in_place(self):
+        with self.newmrc(self.ext_header_mrc_name) as mrc:
+            data = np.array(mrc.data)
+            header = mrc.header.copy()
+            ext = mrc.extended_header.copy()
+            with self.newmrc(self.temp_mrc_name, mode='w+') as new_mrc:
+                new_mrc.set_data(data)
+                new_mrc.set_extended_header(ext)
+                new_mrc.header.exttyp = header.exttyp
+        with self.newmrc(self.temp_mrc_name, mode='r+') as mrc:
+            mrc.extended_header[4:8] = np.frombuffer(b'EDIT', dtype='V1')
+        with self.newmrc(self.temp_mrc_name, mode='r+',
+                         header_only=True) as mrc:
+            # Changing the header without loading the extended header
+            mrc.header.nlabl = 0
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            assert mrc.extended_header[4:8].tobytes() == b'EDIT'
+            assert mrc.extended_header[8:].tobytes() == ext[8:].tobytes()
+            assert mrc.header.nlabl == 0
+            np.testing.assert_array_equal(mrc.data, data)
+    
+    def test_data_stats_can_be_streamed_in_header_only_mode(self):
+        with self.newmrc(self.example_mrc_name) as mrc:
+            data = mrc.data.copy()
+        with self.newmrc(self.example_mrc_name, header_only=True) as mrc:
+            # Use small blocks to make sure several are read
+            blocks = list(mrc._iter_section_blocks(max_bytes=5000))
+            assert len(blocks) > 1
+            np.testing.assert_array_equal(np.concatenate(blocks), data)
+            # Blocks can be streamed more than once
+            stats = utils.stats_from_blocks(mrc._iter_section_blocks())
+            assert stats == (data.min(), data.max(), data.mean(), data.std())
+    
+    def record_fadvise(self):
+        """Replace :func:`os.posix_fadvise` with a function which records its
+        calls, and return the list of calls and a function to restore it."""
+        calls = []
+        names = ['posix_fadvise', 'POSIX_FADV_DONTNEED',
+                 'POSIX_FADV_WILLNEED']
+        saved = dict((name, getattr(os, name)) for name in names
+                     if hasattr(os, name))
+        def record(fd, offset, length, advice):
+            calls.append((advice, offset, length))
+        os.posix_fadvise = record
+        os.POSIX_FADV_DONTNEED = 'dontneed'
+        os.POSIX_FADV_WILLNEED = 'willneed'
+        def restore():
+            for name in names:
+                if name in saved:
+                    setattr(os, name, saved[name])
+                else:
+                    delattr(os, name)
+        return calls, restore
+    
+    def test_cache_advice_is_given_while_streaming_data(self):
+        with self.newmrc(self.example_mrc_name) as mrc:
+            data = mrc.data.copy()
+        calls, restore = self.record_fadvise()
+        try:
+            with self.newmrc(self.example_mrc_name, header_only=True,
+                             cache='drop') as mrc:
+                blocks = list(mrc._iter_section_blocks(max_bytes=8000))
+        finally:
+            restore()
+        assert len(blocks) == 4
+        np.testing.assert_array_equal(np.concatenate(blocks), data)
+        dropped = [call for call in calls if call[0] == 'dontneed']
+        wanted = [call for call in calls if call[0] == 'willneed']
+        assert len(dropped) == 4
+        assert all(offset == 0 for _, offset, _ in dropped)
+        lengths = [length for _, _, length in dropped]
+        assert lengths == sorted(lengths)
+        assert [length for _, _, length in wanted] == [8000, 8000, 8000]
+    
+    def test_cache_advice_is_not_given_by_default(self):
+        calls, restore = self.record_fadvise()
+        try:
+            with self.newmrc(self.example_mrc_name, header_only=True) as mrc:
+                utils.stats_from_blocks(mrc._iter_section_blocks())
+            with self.newmrc(self.example_mrc_name):
+                pass
+        finally:
+            restore()
+        assert calls == []
+    
+    def test_read_data_is_dropped_from_cache(self):
+        calls, restore = self.record_fadvise()
+        try:
+            with self.newmrc(self.example_mrc_name, cache='drop') as mrc:
+                assert mrc.data.shape == (20, 20, 20)
+        finally:
+            restore()
+        assert len(calls) == 1
+        assert calls[0][:2] == ('dontneed', 0)
+    
+    def test_read_data_is_dropped_from_cache_a_block_at_a_time(self):
+        with self.newmrc(self.example_mrc_name) as mrc:
+            data = mrc.data.copy()
+        calls, restore = self.record_fadvise()
+        old_block_bytes = MrcFile._cache_block_bytes
+        MrcFile._cache_block_bytes = 7000
+        try:
+            with self.newmrc(self.example_mrc_name, cache='drop') as mrc:
+                np.testing.assert_array_equal(mrc.data, data)
+        finally:
+            MrcFile._cache_block_bytes = old_block_bytes
+            restore()
+        # 32000 bytes of data are read in five blocks
+        dropped = [call for call in calls if call[0] == 'dontneed']
+        wanted = [call for call in calls if call[0] == 'willneed']
+        assert len(dropped) == 5
+        assert all(offset == 0 for _, offset, _ in dropped)
+        lengths = [length for _, _, length in dropped]
+        assert lengths == sorted(lengths)
+        assert [length for _, _, length in wanted] == [7000, 7000, 7000, 4000]
+    
+    def test_cache_advice_is_ignored_if_not_supported(self):
+        saved = getattr(os, 'posix_fadvise', None)
+        if saved is not None:
+            del os.posix_fadvise
+        try:
+            with self.newmrc(self.example_mrc_name, cache='drop') as mrc:
+                assert mrc.data.shape == (20, 20, 20)
+        finally:
+            if saved is not None:
+                os.posix_fadvise = saved
+    
+    def test_invalid_cache_option(self):
+        with self.assertRaisesRegex(ValueError, "Cache option 'keep'"):
+            self.newmrc(self.example_mrc_name, cache='keep')
+    
     ############################################################################
     #
     # Tests which do not depend on any existing files
@@ -280,6 +435,24 @@ class MrcFileTest(MrcObjectTest):
         with self.newmrc(self.temp_mrc_name, mode='r') as mrc:
             assert mrc.header.ispg == 0
     
+    def test_header_can_be_edited_in_header_only_mode(self):
+        data = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data)
+            mrc.set_extended_header(np.zeros(4, dtype='V1'))
+        with self.newmrc(self.temp_mrc_name, mode='r+',
+                         header_only=True) as mrc:
+            mrc.header.ispg = 1
+            mrc.voxel_size = 2.5
+            mrc.set_extended_header(np.ones(4, dtype='u1').view('V1'))
+            with self.assertRaisesRegex(ValueError, "Cannot change the size"):
+                mrc.set_extended_header(np.zeros(8, dtype='V1'))
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            np.testing.assert_array_equal(mrc.data, data)
+            assert mrc.header.ispg == 1
+            assert mrc.voxel_size.x == 2.5
+            assert mrc.extended_header.tobytes() == b'\x01' * 4
+    
     def test_creating_extended_header(self):
         data = np.arange(12, dtype=np.int16).reshape(3, 4)
         extended_header = np.array('example extended header', dtype='S')
@@ -306,6 +479,28 @@ class MrcFileTest(MrcObjectTest):
             file_size = mrc._iostream.tell() # relies on flush() leaving stream at end
             assert file_size == mrc.header.nbytes + mrc.data.nbytes
     
+    def test_extended_header_can_grow_into_reserved_space(self):
+        data = np.arange(12, dtype=np.int16).reshape(3, 4)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data)
+            mrc.set_extended_header(np.ones(10, dtype='u1').view('V1'),
+                                    reserve=90)
+        with self.newmrc(self.temp_mrc_name, mode='r+',
+                         header_only=True) as mrc:
+            assert mrc.header.nsymbt == 100
+            assert mrc.extended_header.tobytes() == b'\x01' * 10
+            mrc.set_extended_header(np.full(60, 2, dtype='u1').view('V1'))
+            assert mrc.header.nsymbt == 100
+            with self.assertRaisesRegex(ValueError, "Cannot change the size"):
+                mrc.set_extended_header(np.zeros(101, dtype='V1'))
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            assert mrc.header.nsymbt == 100
+            assert mrc.extended_header.tobytes() == b'\x02' * 60
+            np.testing.assert_array_equal(mrc.data, data)
+            # The reserved space is filled with zeros in the file
+            mrc._iostream.seek(mrc.header.nbytes + 60)
+            assert mrc._iostream.read(40) == b'\0' * 40
+    
     def test_can_edit_data_in_read_write_mode(self):
         with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
             mrc.set_data(np.arange(12, dtype=np.int16).reshape(3, 4))
@@ -351,10 +546,28 @@ class MrcFileTest(MrcObjectTest):
         with self.newmrc(name, mode='w+') as mrc:
             mrc.set_data(data)
             
-            # Check data has been converted to mode 6
+            # Check data has been stored natively in mode 0
+            np.testing.assert_array_equal(mrc.data, data)
+            assert mrc.header.mode == 0
+            assert mrc.data.dtype == np.uint8
+        
+        # Check the data is read back as unsigned bytes
+        with self.newmrc(name) as mrc:
+            np.testing.assert_array_equal(mrc.data, data)
+            assert mrc.data.dtype == np.uint8
+            assert mrc.header.dmax == 255
+            assert mrc._get_file_size() == 1024 + x * y
+    
+    def test_mode_0_file_with_imod_signed_flag_is_read_as_int8(self):
+        data = np.arange(-5, 5, dtype=np.int8).reshape(2, 5)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data)
+            utils.imod_header_fields(mrc.header).imod_stamp = 1146047817
+            mrc.update_header_from_data()
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            assert utils.imod_header_fields(mrc.header).imod_flags == 1
+            assert mrc.data.dtype == np.int8
             np.testing.assert_array_equal(mrc.data, data)
-            assert mrc.header.mode == 6
-            assert mrc.data.dtype == np.uint16
     
     def write_file_then_read_and_assert_data_unchanged(self, name, data):
         with self.newmrc(name, mode='w+') as mrc:
@@ -415,10 +628,96 @@ class MrcFileTest(MrcObjectTest):
         with self.newmrc(name, mode='w+') as mrc:
             mrc.set_data(data)
             
-            # Check data has been converted to mode 2
+            # Check data has been stored natively in mode 12
             np.testing.assert_array_equal(mrc.data, data)
-            assert mrc.header.mode == 2
-            assert mrc.data.dtype == np.float32
+            assert mrc.header.mode == 12
+            assert mrc.data.dtype == np.float16
+    
+    def test_writing_image_mode_12_native_byte_order(self):
+        data = np.linspace(-65504, 65504, 90, dtype=np.float16).reshape(9, 10)
+        name = os.path.join(self.test_output, 'test_img_10x9_mode12_native.mrc')
+        self.write_file_then_read_and_assert_data_unchanged(name, data)
+    
+    def test_writing_image_mode_12_big_endian(self):
+        data = np.linspace(-65504, 65504, 90, dtype='>f2').reshape(9, 10)
+        name = os.path.join(self.test_output, 'test_img_10x9_mode12_be.mrc')
+        self.write_file_then_read_and_assert_data_unchanged(name, data)
+        with self.newmrc(name) as mrc:
+            assert mrc.header.mode == 12
+            assert mrc.header.mode.dtype.byteorder == '>'
+    
+    def test_writing_image_mode_101(self):
+        data = (np.arange(9 * 11, dtype=np.uint8) % 16).reshape(9, 11)
+        name = os.path.join(self.test_output, 'test_img_11x9_mode101.mrc')
+        with self.newmrc(name, mode='w+') as mrc:
+            mrc.set_data(data, mode=101)
+        with self.newmrc(name) as mrc:
+            assert mrc.header.mode == 101
+            assert mrc.header.nx == 11
+            assert mrc.data.dtype == np.uint8
+            assert mrc.data.shape == (9, 11)
+            np.testing.assert_array_equal(mrc.data[...], data)
+            np.testing.assert_array_equal(mrc.data[3, 4:9], data[3, 4:9])
+        with self.newmrc(name, header_only=True) as mrc:
+            blocks = list(mrc._iter_section_blocks())
+            np.testing.assert_array_equal(blocks[0][0], data)
+    
+    def test_mode_101_file_size(self):
+        data = np.zeros((4, 3, 7), dtype=np.uint8)
+        name = os.path.join(self.test_output, 'test_mode101_size.mrc')
+        with self.newmrc(name, mode='w+') as mrc:
+            mrc.set_data(data, mode=101)
+        with self.newmrc(name) as mrc:
+            # Each row of 7 values is packed into 4 bytes
+            assert mrc._get_file_size() == 1024 + 4 * 3 * 4
+    
+    def test_mode_101_data_can_be_edited(self):
+        data = np.zeros((2, 3, 5), dtype=np.uint8)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data, mode=101)
+        with self.newmrc(self.temp_mrc_name, mode='r+') as mrc:
+            mrc.data[1, 2, 3] = 9
+            mrc.data[0, :, 0] = 15
+            mrc.update_header_stats()
+        data[1, 2, 3] = 9
+        data[0, :, 0] = 15
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            np.testing.assert_array_equal(mrc.data[...], data)
+            assert mrc.header.mode == 101
+            assert mrc.header.dmax == 15
+    
+    def test_writing_quantized_data(self):
+        data = np.random.normal(5, 3, size=(6, 7, 8)).astype(np.float32)
+        for quantize, mode, dtype in (('int16', 1, '>f4'), ('int8', 0, '=f4')):
+            with self.newmrc(self.temp_mrc_name, mode='w+',
+                             overwrite=True) as mrc:
+                mrc.set_data(data.astype(dtype), quantize=quantize)
+                written = np.array(mrc.data[...])
+            with self.newmrc(self.temp_mrc_name) as mrc:
+                assert mrc.header.mode == mode
+                assert mrc.data.dtype == np.dtype(dtype)
+                assert mrc._get_file_size() == 1024 + data.size * (mode + 1)
+                np.testing.assert_array_equal(mrc.data[...], written)
+                np.testing.assert_array_equal(mrc.data[2, 3:5], written[2, 3:5])
+                scale, _ = utils.quantization_from_header(mrc.header)
+                np.testing.assert_allclose(written, data, atol=scale)
+                assert np.isclose(mrc.header.dmean,
+                                  written.mean(dtype=np.float64))
+            with self.newmrc(self.temp_mrc_name, header_only=True) as mrc:
+                blocks = list(mrc._iter_section_blocks())
+                np.testing.assert_array_equal(np.concatenate(blocks), written)
+    
+    def test_quantized_data_can_be_edited(self):
+        data = np.linspace(0, 10, 60, dtype=np.float32).reshape(3, 4, 5)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data, quantize='int16')
+        with self.newmrc(self.temp_mrc_name, mode='r+') as mrc:
+            mrc.data[1, 2, 3] = 2.5
+            mrc.update_header_stats()
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            assert mrc.header.mode == 1
+            assert abs(mrc.data[1, 2, 3] - 2.5) < 1e-3
+            assert abs(mrc.data[2, 3, 4] - 10) < 1e-3
     
     def test_writing_image_mode_4_native_byte_order(self):
         data = create_test_complex64_array()
@@ -9,13 +9,19 @@ Tests for mrcmemmap.py
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import errno
+import mmap
 import os
 import unittest
+import warnings
 
 import numpy as np
 
 from .test_mrcfile import MrcFileTest
+from mrcfile import utils
 from mrcfile.mrcmemmap import MrcMemmap
+from mrcfile.lazyarrays import (Packed4BitArray, DequantizedArray,
+                                WindowedMemmapArray, TransposedArray)
 
 
 class MrcMemmapTest(MrcFileTest):
@@ -43,6 +49,16 @@ class MrcMemmapTest(MrcFileTest):
         with MrcMemmap(self.example_mrc_name) as mrc:
             assert repr(mrc) == "MrcMemmap('{0}', mode='r')".format(self.example_mrc_name)
     
+    def check_extended_header_is_not_loaded(self, mrc):
+        """Override because the extended header is memory-mapped instead."""
+        assert isinstance(mrc._extended_header, np.memmap)
+    
+    def test_memory_mapped_extended_header_is_read_only_after_closing(self):
+        mrc = self.newmrc(self.ext_header_mrc_name)
+        ext = mrc.extended_header
+        mrc.close()
+        assert not ext.flags.writeable
+    
     def test_exception_raised_if_file_is_too_small(self):
         """Override test to change expected error message."""
         with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
@@ -55,12 +71,323 @@ class MrcMemmapTest(MrcFileTest):
         with self.assertRaisesRegex(Exception, expected_error_msg):
             self.newmrc(self.temp_mrc_name)
     
+    def test_mode_101_data_is_unpacked_lazily(self):
+        data = (np.arange(5 * 4 * 9, dtype=np.uint8) % 16).reshape(5, 4, 9)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data, mode=101)
+            assert isinstance(mrc.data, Packed4BitArray)
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            assert isinstance(mrc.data, Packed4BitArray)
+            assert isinstance(mrc.data.base, np.memmap)
+            assert mrc.data.base.shape == (5, 4, 5)
+            np.testing.assert_array_equal(mrc.data[3], data[3])
+            np.testing.assert_array_equal(mrc.data[1:3, 2, ::2],
+                                          data[1:3, 2, ::2])
+    
+    def test_quantized_data_is_converted_lazily(self):
+        data = np.linspace(-1, 1, 5 * 4 * 9, dtype=np.float32).reshape(5, 4, 9)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data, quantize='int16')
+            assert isinstance(mrc.data, DequantizedArray)
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            assert isinstance(mrc.data, DequantizedArray)
+            assert isinstance(mrc.data.base, np.memmap)
+            assert mrc.data.base.dtype == np.int16
+            assert mrc.data[3].dtype == np.float32
+            np.testing.assert_allclose(mrc.data[3], data[3], atol=1e-4)
+    
+    def test_read_data_is_dropped_from_cache(self):
+        """Override test because the data is mapped, not read."""
+        calls, restore = self.record_fadvise()
+        try:
+            with self.newmrc(self.example_mrc_name, cache='drop') as mrc:
+                assert mrc.data.shape == (20, 20, 20)
+        finally:
+            restore()
+        assert calls == []
+    
+    def test_read_data_is_dropped_from_cache_a_block_at_a_time(self):
+        """Override test because the data is mapped, not read."""
+        calls, restore = self.record_fadvise()
+        try:
+            with self.newmrc(self.example_mrc_name, cache='drop') as mrc:
+                assert mrc.data.shape == (20, 20, 20)
+        finally:
+            restore()
+        assert calls == []
+    
     def test_data_is_not_copied_unnecessarily(self):
         """Override test because data has to be copied for mmap."""
         data = np.arange(6, dtype=np.int16).reshape(1, 2, 3)
         self.mrcobject.set_data(data)
         assert self.mrcobject.data is not data
     
+    def test_valid_data_can_be_set_without_copying(self):
+        """Override test because data is written straight to the file."""
+        data = np.arange(6, dtype=np.uint8).reshape(1, 2, 3)
+        self.mrcobject.set_data(data, copy=False)
+        assert isinstance(self.mrcobject.data, np.memmap)
+        np.testing.assert_array_equal(self.mrcobject.data, data)
+    
+    def test_data_is_converted_while_copying_into_file(self):
+        source = np.arange(4 * 5 * 6, dtype=np.int8).reshape(4, 5, 6)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(source, mode=1)
+            assert isinstance(mrc.data, np.memmap)
+            assert mrc.data.dtype == np.int16
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            np.testing.assert_array_equal(mrc.data, source)
+    
+    def test_sections_are_written_straight_to_file(self):
+        def sections():
+            for index in range(7):
+                yield np.full((3, 4), index, dtype=np.float32)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data_from_sections(sections())
+            assert isinstance(mrc.data, np.memmap)
+            assert mrc.data.shape == (7, 3, 4)
+            assert mrc.header.dmax == 6
+        assert os.path.getsize(self.temp_mrc_name) == 1024 + 7 * 3 * 4 * 4
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            np.testing.assert_array_equal(mrc.data[:, 0, 0], np.arange(7))
+    
+    def test_data_is_moved_within_file_when_extended_header_grows(self):
+        data = np.arange(4 * 5 * 6, dtype=np.int16).reshape(4, 5, 6)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data)
+            mrc.set_extended_header(np.zeros(10, dtype='V1'))
+            assert isinstance(mrc.data, np.memmap)
+            np.testing.assert_array_equal(mrc.data, data)
+            mrc.set_extended_header(np.zeros(1000, dtype='V1'))
+            np.testing.assert_array_equal(mrc.data, data)
+        assert os.path.getsize(self.temp_mrc_name) == 1024 + 1000 + data.nbytes
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            assert mrc.header.nsymbt == 1000
+            np.testing.assert_array_equal(mrc.data, data)
+    
+    def test_data_is_moved_within_file_when_extended_header_shrinks(self):
+        data = np.linspace(-1, 1, 4 * 5 * 6, dtype=np.float32).reshape(4, 5, 6)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_extended_header(np.ones(1000, dtype='u1').view('V1'))
+            mrc.set_data(data)
+            mrc.set_extended_header(np.zeros(8, dtype='V1'))
+            np.testing.assert_array_equal(mrc.data, data)
+        assert os.path.getsize(self.temp_mrc_name) == 1024 + 8 + data.nbytes
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            np.testing.assert_array_equal(mrc.data, data)
+    
+    def test_data_is_not_moved_when_extended_header_fits_reserved_space(self):
+        data = np.arange(4 * 5 * 6, dtype=np.int16).reshape(4, 5, 6)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_extended_header(np.zeros(10, dtype='V1'), reserve=990)
+            mrc.set_data(data)
+        moves = []
+        with self.newmrc(self.temp_mrc_name, mode='r+') as mrc:
+            old_move = mrc._move_data_block
+            def record_move(*args, **kwargs):
+                moves.append(args)
+                return old_move(*args, **kwargs)
+            mrc._move_data_block = record_move
+            mrc.set_extended_header(np.ones(800, dtype='u1').view('V1'))
+            assert moves == []
+            np.testing.assert_array_equal(mrc.data, data)
+            # Growing beyond the reserved space falls back to moving the data
+            mrc.set_extended_header(np.ones(1200, dtype='u1').view('V1'))
+            assert moves == [(2024, 2224, data.nbytes)]
+            np.testing.assert_array_equal(mrc.data, data)
+        assert os.path.getsize(self.temp_mrc_name) == 1024 + 1200 + data.nbytes
+    
+    def test_memory_mapped_extended_header_excludes_reserved_space(self):
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(np.zeros((2, 2), dtype=np.int8))
+            mrc.set_extended_header(np.ones(16, dtype='u1').view('V1'),
+                                    reserve=48)
+        with self.newmrc(self.temp_mrc_name, mode='r+') as mrc:
+            assert isinstance(mrc.extended_header, np.memmap)
+            assert mrc.extended_header.nbytes == 16
+            mrc.extended_header.view('u1')[0] = 5
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            assert mrc.header.nsymbt == 64
+            assert mrc.extended_header.tobytes() == b'\x05' + b'\x01' * 15
+    
+    def test_canonical_view_of_memory_mapped_data(self):
+        data = np.arange(3 * 4 * 5, dtype=np.float32).reshape(3, 4, 5)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data)
+            mrc.set_axis_order('yzx')
+        with self.newmrc(self.temp_mrc_name, mode='r+') as mrc:
+            canonical = mrc.as_canonical()
+            assert isinstance(canonical, np.memmap)
+            np.testing.assert_array_equal(canonical,
+                                          np.transpose(data, (1, 2, 0)))
+            canonical[0, 0, 0] = -5
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            assert mrc.data[0, 0, 0] == -5
+    
+    def test_canonical_view_of_lazy_data(self):
+        packed = (np.arange(3 * 4 * 7, dtype=np.uint8) % 16).reshape(3, 4, 7)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(packed, mode=101)
+            mrc.set_axis_order('zyx')
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            canonical = mrc.as_canonical()
+            assert isinstance(canonical, TransposedArray)
+            assert canonical.base is mrc.data
+            np.testing.assert_array_equal(canonical[2],
+                                          np.transpose(packed, (2, 1, 0))[2])
+    
+    def test_lazy_data_is_kept_when_extended_header_size_changes(self):
+        packed = (np.arange(3 * 4 * 7, dtype=np.uint8) % 16).reshape(3, 4, 7)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(packed, mode=101)
+            mrc.set_extended_header(np.zeros(100, dtype='V1'))
+            assert isinstance(mrc.data, Packed4BitArray)
+            np.testing.assert_array_equal(mrc.data, packed)
+        quantized = np.linspace(0, 1, 60, dtype=np.float32).reshape(3, 4, 5)
+        with self.newmrc(self.temp_mrc_name, mode='w+', overwrite=True) as mrc:
+            mrc.set_data(quantized, quantize='int16')
+            mrc.set_extended_header(np.zeros(100, dtype='V1'))
+            assert isinstance(mrc.data, DequantizedArray)
+            np.testing.assert_allclose(mrc.data, quantized, atol=1e-4)
+    
+    def test_data_block_is_moved_in_chunks(self):
+        data = np.arange(1000, dtype=np.int16).reshape(10, 10, 10)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data)
+            mrc._close_data()
+            # Move forwards and back by less than one chunk, so the source
+            # and destination of the move overlap
+            mrc._iostream.truncate(1024 + 30 + data.nbytes)
+            mrc._move_data_block(1024, 1054, data.nbytes, max_bytes=64)
+            mrc._move_data_block(1054, 1024, data.nbytes, max_bytes=64)
+            mrc._iostream.seek(1024)
+            moved = np.frombuffer(mrc._iostream.read(data.nbytes),
+                                  dtype=np.int16)
+            np.testing.assert_array_equal(moved, data.ravel())
+            mrc._open_memmap(np.dtype(np.int16), data.shape)
+    
+    def test_preallocation_falls_back_to_writing_zeros(self):
+        def unsupported(fd, offset, length):
+            raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+        old_fallocate = getattr(os, 'posix_fallocate', None)
+        os.posix_fallocate = unsupported
+        try:
+            with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+                mrc._allocate_data((3, 4, 5), np.int16, sparse=False)
+                assert mrc.data.shape == (3, 4, 5)
+                np.testing.assert_array_equal(mrc.data, 0)
+        finally:
+            if old_fallocate is None:
+                del os.posix_fallocate
+            else:
+                os.posix_fallocate = old_fallocate
+        assert os.path.getsize(self.temp_mrc_name) == 1024 + 3 * 4 * 5 * 2
+    
+    def test_invalid_access_pattern(self):
+        with self.assertRaisesRegex(ValueError, "Unknown access pattern"):
+            self.newmrc(self.example_mrc_name, access='backwards')
+    
+    def test_access_pattern_is_applied_when_data_is_mapped(self):
+        calls = []
+        def record_advice(mrc, advice, start=0, stop=None):
+            calls.append((advice, start, stop))
+            return True
+        old_advise = MrcMemmap._advise
+        MrcMemmap._advise = record_advice
+        try:
+            with self.newmrc(self.example_mrc_name, access='sequential'):
+                pass
+            assert calls == [('MADV_SEQUENTIAL', 0, None)]
+            with self.newmrc(self.example_mrc_name):
+                pass
+            assert len(calls) == 1
+        finally:
+            MrcMemmap._advise = old_advise
+    
+    def test_access_hints_are_ignored_if_not_supported(self):
+        old_madvise = utils._libc_madvise
+        utils._libc_madvise = None
+        try:
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter("always")
+                with self.newmrc(self.example_mrc_name,
+                                 access='random') as mrc:
+                    assert not mrc.prefetch(slice(0, 2))
+                    assert mrc.data.shape == (20, 20, 20)
+            assert len(w) == 1
+            assert issubclass(w[0].category, RuntimeWarning)
+            assert "not supported" in str(w[0].message)
+        finally:
+            utils._libc_madvise = old_madvise
+    
+    def test_prefetch_advises_page_aligned_region(self):
+        calls = []
+        def record_madvise(address, length, advice):
+            calls.append((address, length, advice))
+            return 0
+        old_madvise = utils._libc_madvise
+        utils._libc_madvise = record_madvise
+        try:
+            data = np.zeros((10, 64, 64), dtype=np.float32)
+            with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+                mrc.set_data(data)
+                data_address = mrc.data.ctypes.data
+                assert mrc.prefetch(slice(2, 4))
+                assert mrc.prefetch(-1)
+                assert not mrc.prefetch(slice(5, 5))
+                with self.assertRaises(IndexError):
+                    mrc.prefetch(10)
+        finally:
+            utils._libc_madvise = old_madvise
+        section_bytes = 64 * 64 * 4
+        assert len(calls) == 2
+        for (address, length, advice), (first, stop) in zip(calls,
+                                                            [(2, 4), (9, 10)]):
+            assert advice == utils._madvise_value('MADV_WILLNEED')
+            assert address % mmap.PAGESIZE == 0
+            assert address <= data_address + first * section_bytes
+            assert address + length == data_address + stop * section_bytes
+    
+    @unittest.skipUnless(utils._memory_advice_supported('MADV_WILLNEED'),
+                         "madvise is not supported on this platform")
+    def test_prefetch_calls_madvise(self):
+        with self.newmrc(self.example_mrc_name, access='sequential') as mrc:
+            assert mrc.prefetch(slice(3, 6))
+    
+    def test_data_can_be_mapped_a_window_at_a_time(self):
+        data = np.arange(10 * 4 * 5, dtype=np.float32).reshape(10, 4, 5)
+        with self.newmrc(self.temp_mrc_name, mode='w+') as mrc:
+            mrc.set_data(data)
+        with self.newmrc(self.temp_mrc_name, mode='r+', window=3) as mrc:
+            assert isinstance(mrc.data, WindowedMemmapArray)
+            assert mrc.data.shape == (10, 4, 5)
+            for index in range(10):
+                np.testing.assert_array_equal(mrc.data[index], data[index])
+                assert mrc.data._window_map.shape[0] <= 3
+            np.testing.assert_array_equal(mrc.data[2:8, 1], data[2:8, 1])
+            mrc.data[4:7] = 0
+            assert mrc.header.dmax == data.max()
+            mrc.update_header_stats()
+        data[4:7] = 0
+        with self.newmrc(self.temp_mrc_name) as mrc:
+            np.testing.assert_array_equal(mrc.data, data)
+            assert mrc.header.dmean == data.mean()
+    
+    def test_windows_can_be_used_with_lazy_data(self):
+        packed = (np.arange(5 * 3 * 7, dtype=np.uint8) % 16).reshape(5, 3, 7)
+        with self.newmrc(self.temp_mrc_name, mode='w+', window=2) as mrc:
+            mrc.set_data(packed, mode=101)
+            assert isinstance(mrc.data, Packed4BitArray)
+            assert isinstance(mrc.data.base, WindowedMemmapArray)
+            mrc.set_extended_header(np.zeros(10, dtype='V1'))
+            np.testing.assert_array_equal(mrc.data[1:4], packed[1:4])
+        with self.newmrc(self.temp_mrc_name, window=2) as mrc:
+            np.testing.assert_array_equal(mrc.data, packed)
+    
+    def test_invalid_window(self):
+        with self.assertRaisesRegex(ValueError, "at least one section"):
+            self.newmrc(self.example_mrc_name, window=0)
+    
     def test_data_array_cannot_be_changed_after_closing_file(self):
         mrc = self.newmrc(self.temp_mrc_name, mode='w+')
         mrc.set_data(np.arange(12, dtype=np.int16).reshape(3, 4))
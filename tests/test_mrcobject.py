@@ -58,6 +58,7 @@ class MrcObjectTest(AssertRaisesRegexMixin, unittest.TestCase):
         assert_read_only(MrcObject.voxel_size.__set__, self.mrcobject, None)
         assert_read_only(self.mrcobject.set_image_stack)
         assert_read_only(self.mrcobject.set_volume)
+        assert_read_only(self.mrcobject.set_axis_order, 'xyz')
         assert_read_only(self.mrcobject.update_header_from_data)
         assert_read_only(self.mrcobject.update_header_stats)
         assert_read_only(self.mrcobject.reset_header_stats)
@@ -138,6 +139,51 @@ class MrcObjectTest(AssertRaisesRegexMixin, unittest.TestCase):
         assert self.mrcobject.extended_header is ext2
         assert self.mrcobject.header.nsymbt == ext2.nbytes
     
+    def test_reserving_extended_header_space(self):
+        self.mrcobject.set_extended_header(np.zeros(100, dtype='V1'),
+                                           reserve=400)
+        assert self.mrcobject.extended_header.nbytes == 100
+        assert self.mrcobject.header.nsymbt == 500
+        # A larger extended header which fits is put in the reserved space
+        ext = np.ones(300, dtype='u1').view('V1')
+        self.mrcobject.set_extended_header(ext)
+        assert self.mrcobject.extended_header is ext
+        assert self.mrcobject.header.nsymbt == 500
+        assert utils.extended_header_reserve_from_header(
+            self.mrcobject.header) == 200
+        # One which does not fit uses the exact size with nothing reserved
+        self.mrcobject.set_extended_header(np.zeros(600, dtype='V1'))
+        assert self.mrcobject.header.nsymbt == 600
+        assert utils.extended_header_reserve_from_header(
+            self.mrcobject.header) == 0
+        with self.assertRaisesRegex(ValueError, "cannot be negative"):
+            self.mrcobject.set_extended_header(np.zeros(6, dtype='V1'),
+                                               reserve=-6)
+    
+    def test_extended_header_records_are_a_view(self):
+        ext = np.zeros(3 * 768 + 10, dtype='V1')
+        self.mrcobject.set_extended_header(ext)
+        assert self.mrcobject.extended_header_records is None
+        self.mrcobject.header.exttyp = b'FEI1'
+        records = self.mrcobject.extended_header_records
+        assert records.shape == (3,)
+        records['alpha_tilt'] = [-30.0, 0.0, 30.0]
+        records[1]['dose'] = 5.5
+        np.testing.assert_array_equal(
+            self.mrcobject.extended_header_records['alpha_tilt'],
+            [-30.0, 0.0, 30.0])
+        raw = self.mrcobject.extended_header[768 + 100:768 + 108].tobytes()
+        assert raw == np.array([0.0], dtype='<f8').tobytes()
+        raw = self.mrcobject.extended_header[768 + 92:768 + 100].tobytes()
+        assert raw == np.array([5.5], dtype='<f8').tobytes()
+    
+    def test_symmetry_operator_records(self):
+        ext = np.array([b'X,Y,Z'.ljust(80), b'-X,-Y,Z'.ljust(80)], dtype='S80')
+        self.mrcobject.set_extended_header(ext)
+        self.mrcobject.header.exttyp = b'CCP4'
+        records = self.mrcobject.extended_header_records
+        assert [op.strip() for op in records] == [b'X,Y,Z', b'-X,-Y,Z']
+    
     def test_header_is_correct_for_2d_data(self):
         x, y = 3, 2
         data = np.arange(y * x, dtype=np.int16).reshape(y, x)
@@ -311,23 +357,163 @@ class MrcObjectTest(AssertRaisesRegexMixin, unittest.TestCase):
         assert self.mrcobject.data.dtype == np.uint16
         assert self.mrcobject.header.mode == 6
     
-    def test_float16_dtype_is_widened_in_mode_2(self):
+    def test_float16_dtype_is_preserved_in_mode_12(self):
         data = np.arange(6, dtype=np.float16).reshape(3, 2)
         self.mrcobject.set_data(data)
-        assert self.mrcobject.data.dtype == np.float32
-        assert self.mrcobject.header.mode == 2
+        assert self.mrcobject.data.dtype == np.float16
+        assert self.mrcobject.header.mode == 12
     
-    def test_uint8_dtype_is_widened_in_mode_6(self):
+    def test_uint8_dtype_is_stored_in_mode_0(self):
         data = np.arange(6, dtype=np.uint8).reshape(3, 2)
         self.mrcobject.set_data(data)
+        assert self.mrcobject.data.dtype == np.uint8
+        assert self.mrcobject.header.mode == 0
+        assert utils.header_has_unsigned_bytes(self.mrcobject.header)
+    
+    def test_int8_dtype_after_uint8_is_marked_as_signed(self):
+        self.mrcobject.set_data(np.arange(6, dtype=np.uint8).reshape(3, 2))
+        self.mrcobject.set_data(np.arange(6, dtype=np.int8).reshape(3, 2))
+        assert self.mrcobject.header.mode == 0
+        assert not utils.header_has_unsigned_bytes(self.mrcobject.header)
+        assert utils.data_dtype_from_header(self.mrcobject.header) == np.int8
+    
+    def test_uint8_dtype_can_be_widened_to_mode_6(self):
+        data = np.arange(6, dtype=np.uint8).reshape(3, 2)
+        self.mrcobject.set_data(data, mode=6)
         assert self.mrcobject.data.dtype == np.uint16
         assert self.mrcobject.header.mode == 6
     
+    def test_data_can_be_widened_to_a_given_mode(self):
+        data = np.arange(6, dtype=np.int8).reshape(3, 2)
+        self.mrcobject.set_data(data, mode=1)
+        assert self.mrcobject.data.dtype == np.int16
+        assert self.mrcobject.header.mode == 1
+        np.testing.assert_array_equal(self.mrcobject.data, data)
+    
+    def test_data_cannot_be_narrowed_to_a_given_mode(self):
+        data = np.arange(6, dtype=np.float32).reshape(3, 2)
+        with self.assertRaisesRegex(ValueError, "cannot be stored in mode 1"):
+            self.mrcobject.set_data(data, mode=1)
+    
+    def test_float_data_can_be_quantized(self):
+        data = np.linspace(-10, 30, 120, dtype=np.float32).reshape(4, 5, 6)
+        self.mrcobject.set_data(data, quantize='int16', error_bound=1e-3)
+        assert self.mrcobject.header.mode == 1
+        assert self.mrcobject.data.dtype == np.float32
+        scale, offset = utils.quantization_from_header(self.mrcobject.header)
+        assert offset == 10.0
+        np.testing.assert_allclose(self.mrcobject.data, data, atol=1e-3)
+        # Statistics are calculated from the float values
+        assert abs(self.mrcobject.header.dmin + 10) < 1e-3
+        assert abs(self.mrcobject.header.dmax - 30) < 1e-3
+        
+        # Quantisation is kept when the header is updated from the data...
+        self.mrcobject.update_header_from_data()
+        assert self.mrcobject.header.mode == 1
+        assert utils.quantization_from_header(self.mrcobject.header) == (scale,
+                                                                        offset)
+        
+        # ...but not when new data is set
+        self.mrcobject.set_data(data)
+        assert self.mrcobject.header.mode == 2
+        assert utils.quantization_from_header(self.mrcobject.header) is None
+    
+    def test_float_data_can_be_quantized_to_int8(self):
+        data = np.linspace(0, 1, 30, dtype=np.float64).reshape(5, 6)
+        self.mrcobject.set_data(data, quantize='int8')
+        assert self.mrcobject.header.mode == 0
+        assert not utils.header_has_unsigned_bytes(self.mrcobject.header)
+        assert self.mrcobject.data.dtype == np.float32
+        scale, offset = utils.quantization_from_header(self.mrcobject.header)
+        np.testing.assert_allclose(self.mrcobject.data, data, atol=scale)
+    
+    def test_quantization_errors(self):
+        data = np.linspace(0, 1000, 30, dtype=np.float32).reshape(5, 6)
+        with self.assertRaisesRegex(ValueError, "smallest possible error"):
+            self.mrcobject.set_data(data, quantize='int8', error_bound=0.1)
+        with self.assertRaisesRegex(ValueError, "can only be quantised"):
+            self.mrcobject.set_data(data, quantize='int32')
+        with self.assertRaisesRegex(ValueError, "Only floating point"):
+            self.mrcobject.set_data(data.astype(np.int16), quantize='int8')
+        with self.assertRaisesRegex(ValueError, "Mode 2 cannot be used"):
+            self.mrcobject.set_data(data, mode=2, quantize='int16')
+        with self.assertRaisesRegex(ValueError, "stored in mode 0"):
+            self.mrcobject.set_data(data, mode=1, quantize='int8')
+        self.mrcobject.set_data(data, mode=1, quantize='int16')
+        assert self.mrcobject.header.mode == 1
+    
+    def test_4bit_data_is_stored_in_mode_101(self):
+        data = np.arange(15, dtype=np.int16).reshape(3, 5)
+        self.mrcobject.set_data(data, mode=101)
+        assert self.mrcobject.data.dtype == np.uint8
+        assert self.mrcobject.header.mode == 101
+        assert self.mrcobject.header.nx == 5
+        assert self.mrcobject.header.dmax == 14
+        np.testing.assert_array_equal(self.mrcobject.data, data)
+        
+        # Mode 101 is kept when the header is updated from the data...
+        self.mrcobject.update_header_from_data()
+        assert self.mrcobject.header.mode == 101
+        
+        # ...but not when new uint8 data is set
+        self.mrcobject.set_data(np.arange(15, dtype=np.uint8).reshape(3, 5))
+        assert self.mrcobject.header.mode == 0
+    
+    def test_out_of_range_4bit_data_raises_exception(self):
+        data = np.arange(20, dtype=np.uint8).reshape(4, 5)
+        with self.assertRaisesRegex(ValueError, "range 0 to 15"):
+            self.mrcobject.set_data(data, mode=101)
+    
     def test_data_is_not_copied_unnecessarily(self):
         data = np.arange(6, dtype=np.int16).reshape(1, 2, 3)
         self.mrcobject.set_data(data)
         assert self.mrcobject.data is data
     
+    def test_valid_data_can_be_set_without_copying(self):
+        data = np.arange(6, dtype=np.uint8).reshape(1, 2, 3)
+        self.mrcobject.set_data(data, copy=False)
+        assert self.mrcobject.data is data
+    
+    def test_data_needing_conversion_cannot_be_set_without_copying(self):
+        data = np.arange(12, dtype=np.int16).reshape(3, 4)
+        with self.assertRaisesRegex(ValueError, "without copying"):
+            self.mrcobject.set_data(data.T, copy=False)
+        with self.assertRaisesRegex(ValueError, "without copying"):
+            self.mrcobject.set_data(data, mode=2, copy=False)
+        with self.assertRaisesRegex(ValueError, "without copying"):
+            self.mrcobject.set_data(data.astype(np.float32), quantize='int8',
+                                    copy=False)
+    
+    def test_data_can_be_set_from_sections(self):
+        data = np.arange(60, dtype=np.int8).reshape(5, 3, 4)
+        self.mrcobject.set_data_from_sections(section for section in data)
+        np.testing.assert_array_equal(self.mrcobject.data, data)
+        assert self.mrcobject.data.dtype == np.int8
+        assert self.mrcobject.header.nz == 5
+        assert self.mrcobject.header.dmax == 59
+    
+    def test_sections_can_be_converted_to_a_given_mode(self):
+        sections = [np.full((3, 5), value, dtype=np.uint8) for value in (1, 15)]
+        self.mrcobject.set_data_from_sections(sections, mode=101)
+        assert self.mrcobject.header.mode == 101
+        np.testing.assert_array_equal(self.mrcobject.data[...],
+                                      np.stack(sections))
+        self.mrcobject.set_data_from_sections(sections, mode=1)
+        assert self.mrcobject.header.mode == 1
+        assert self.mrcobject.data.dtype == np.int16
+    
+    def test_invalid_sections_raise_exceptions(self):
+        with self.assertRaisesRegex(ValueError, "No sections"):
+            self.mrcobject.set_data_from_sections([])
+        with self.assertRaisesRegex(ValueError, "same shape"):
+            self.mrcobject.set_data_from_sections([np.zeros((2, 3), np.int8),
+                                                   np.zeros((3, 2), np.int8)])
+        with self.assertRaisesRegex(ValueError, "2-dimensional"):
+            self.mrcobject.set_data_from_sections([np.zeros(3, np.int8)])
+        with self.assertRaisesRegex(ValueError, "cannot be stored"):
+            self.mrcobject.set_data_from_sections(
+                [np.zeros((2, 3), np.int8), np.zeros((2, 3), np.float32)])
+    
     def test_header_byte_order_is_unchanged_by_data_with_native_order(self):
         data = np.arange(6, dtype=np.float32).reshape(3, 2)
         header = self.mrcobject.header
@@ -435,6 +621,31 @@ class MrcObjectTest(AssertRaisesRegexMixin, unittest.TestCase):
         assert header.dmean < header.dmax
         assert header.rms < 0
     
+    def test_canonical_view_of_data(self):
+        data = np.arange(2 * 3 * 4, dtype=np.int16).reshape(2, 3, 4)
+        self.mrcobject.set_data(data)
+        assert self.mrcobject.as_canonical() is self.mrcobject.data
+        # Columns along Z, rows along X and sections along Y
+        self.mrcobject.set_axis_order('zxy')
+        assert (self.mrcobject.header.mapc, self.mrcobject.header.mapr,
+                self.mrcobject.header.maps) == (3, 1, 2)
+        assert self.mrcobject.data.shape == (2, 3, 4)
+        canonical = self.mrcobject.as_canonical()
+        assert canonical.shape == (4, 2, 3)
+        assert np.may_share_memory(canonical, self.mrcobject.data)
+        # Value at (x, y, z) = (1, 0, 3) is at column 3, row 1, section 0
+        assert canonical[3, 0, 1] == self.mrcobject.data[0, 1, 3]
+        canonical[2, 1, 0] = -1
+        assert self.mrcobject.data[1, 0, 2] == -1
+    
+    def test_canonical_view_with_invalid_axis_mapping(self):
+        self.mrcobject.set_data(np.zeros((2, 2, 2), dtype=np.int8))
+        self.mrcobject.header.maps = 1
+        with self.assertRaisesRegex(ValueError, "Invalid axis mapping"):
+            self.mrcobject.as_canonical()
+        with self.assertRaisesRegex(ValueError, "not a permutation"):
+            self.mrcobject.set_axis_order('xy')
+    
     def test_setting_voxel_size_as_single_number(self):
         x, y, z = 4, 3, 1
         data = np.arange(x * y, dtype=np.int16).reshape(z, y, x)
@@ -0,0 +1,119 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+
+"""
+Tests for pyramid.py
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import mrcfile
+from mrcfile import pyramid, utils
+from . import helpers
+
+
+class PyramidTest(helpers.AssertRaisesRegexMixin, unittest.TestCase):
+    
+    """Unit tests for multi-resolution pyramids.
+    
+    """
+    
+    def setUp(self):
+        super(PyramidTest, self).setUp()
+        
+        # Set up test files and names to be used
+        self.test_data = helpers.get_test_data_path()
+        self.test_output = tempfile.mkdtemp()
+        self.temp_mrc_name = os.path.join(self.test_output, 'test_mrcfile.mrc')
+        self.gzip_mrc_name = os.path.join(self.test_data, 'emd_3197.map.gz')
+    
+    def tearDown(self):
+        if os.path.exists(self.test_output):
+            shutil.rmtree(self.test_output)
+        super(PyramidTest, self).tearDown()
+    
+    def test_volume_levels_match_binned_data(self):
+        data = np.arange(9 * 10 * 17, dtype=np.int16).reshape(9, 10, 17)
+        with mrcfile.new(self.temp_mrc_name, data) as mrc:
+            mrc.voxel_size = (1.0, 2.0, 3.0)
+            mrc.header.origin = (5.0, 6.0, 7.0)
+        names = pyramid.build(self.temp_mrc_name, levels=2)
+        assert names == [os.path.join(self.test_output, 'test_mrcfile.2x.mrc'),
+                         os.path.join(self.test_output, 'test_mrcfile.4x.mrc')]
+        with mrcfile.open(names[0]) as mrc:
+            assert mrc.data.dtype == np.float32
+            np.testing.assert_allclose(mrc.data,
+                                       utils.bin_data(data, (2, 2, 2)))
+            assert mrc.voxel_size.tolist() == (2.0, 4.0, 6.0)
+            assert mrc.header.origin.tolist() == (5.0, 6.0, 7.0)
+            assert mrc.header.dmax == mrc.data.max()
+        with mrcfile.open(names[1]) as mrc:
+            np.testing.assert_allclose(mrc.data,
+                                       utils.bin_data(data, (4, 4, 4)))
+            assert mrc.voxel_size.tolist() == (4.0, 8.0, 12.0)
+    
+    def test_image_stack_and_compressed_source(self):
+        with mrcfile.open(self.gzip_mrc_name) as mrc:
+            data = mrc.data.copy()
+        shutil.copy(self.gzip_mrc_name, self.temp_mrc_name)
+        with mrcfile.open(self.temp_mrc_name, mode='r+') as mrc:
+            mrc.set_image_stack()
+        names = pyramid.build(self.temp_mrc_name, levels=1, method='max')
+        with mrcfile.open(names[0]) as mrc:
+            assert mrc.is_image_stack()
+            assert mrc.data.dtype == data.dtype
+            np.testing.assert_array_equal(
+                mrc.data, utils.bin_data(data, (1, 2, 2), 'max'))
+    
+    def test_single_image(self):
+        data = np.arange(8 * 12, dtype=np.float32).reshape(8, 12)
+        mrcfile.new(self.temp_mrc_name, data).close()
+        names = pyramid.build(self.temp_mrc_name, levels=3, method='sum')
+        with mrcfile.open(names[2]) as mrc:
+            np.testing.assert_array_equal(mrc.data,
+                                          utils.bin_data(data, (8, 8), 'sum'))
+    
+    def test_invalid_pyramids(self):
+        mrcfile.new(self.temp_mrc_name, np.zeros((4, 4, 4),
+                                                 dtype=np.int8)).close()
+        with self.assertRaisesRegex(ValueError, "too small"):
+            pyramid.build(self.temp_mrc_name, levels=3)
+        for levels in (0, -1):
+            with self.assertRaisesRegex(ValueError, "at least 1"):
+                pyramid.build(self.temp_mrc_name, levels=levels)
+        with self.assertRaisesRegex(ValueError, "Unknown binning method"):
+            pyramid.build(self.temp_mrc_name, method='median')
+        pyramid.build(self.temp_mrc_name, levels=1)
+        with self.assertRaisesRegex(ValueError, "already exists"):
+            pyramid.build(self.temp_mrc_name, levels=1)
+        pyramid.build(self.temp_mrc_name, levels=1, overwrite=True)
+    
+    def test_open_level_chooses_smallest_large_enough_level(self):
+        data = np.zeros((16, 32, 64), dtype=np.float32)
+        mrcfile.new(self.temp_mrc_name, data).close()
+        names = pyramid.build(self.temp_mrc_name, levels=3)
+        assert pyramid.find_levels(self.temp_mrc_name) == [
+            (1, self.temp_mrc_name), (2, names[0]), (4, names[1]),
+            (8, names[2])
+        ]
+        for shape, expected in [((8, 16), names[1]), ((9, 16), names[0]),
+                                ((4, 8), names[2]), ((40, 40), None),
+                                ((None, 16), names[1]),
+                                ((8, 16, 16), names[0])]:
+            with pyramid.open_level(self.temp_mrc_name, shape) as mrc:
+                assert mrc._iostream.name == (expected or self.temp_mrc_name)
+        with self.assertRaisesRegex(ValueError, "more dimensions"):
+            pyramid.open_level(self.temp_mrc_name, (1, 8, 16, 16))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,7 @@ Tests for utils.py
 from __future__ import absolute_import, division, print_function
 
 import sys
+import tempfile
 import unittest
 
 import numpy as np
@@ -51,8 +52,17 @@ class UtilsTest(AssertRaisesRegexMixin, unittest.TestCase):
         dtype = utils.dtype_from_mode(6)
         assert dtype == np.dtype(np.uint16)
     
+    def test_mode_12_is_converted_to_float16(self):
+        dtype = utils.dtype_from_mode(12)
+        assert dtype == np.dtype(np.float16)
+    
+    def test_mode_101_is_converted_to_uint8(self):
+        dtype = utils.dtype_from_mode(101)
+        assert dtype == np.dtype(np.uint8)
+    
     def test_undefined_modes_raise_exception(self):
-        for mode in (x for x in range(-33, 34, 1) if x not in [0, 1, 2, 4, 6]):
+        for mode in (x for x in range(-33, 34, 1)
+                     if x not in [0, 1, 2, 4, 6, 12, 101]):
             with self.assertRaises(ValueError):
                 utils.dtype_from_mode(mode)
     
@@ -68,9 +78,9 @@ class UtilsTest(AssertRaisesRegexMixin, unittest.TestCase):
         dtype = utils.dtype_from_mode(np.array([1]))
         assert dtype == np.dtype(np.int16)
     
-    def test_float16_dtype_is_converted_to_mode_2(self):
+    def test_float16_dtype_is_converted_to_mode_12(self):
         mode = utils.mode_from_dtype(np.dtype(np.float16))
-        assert mode == 2
+        assert mode == 12
     
     def test_float32_dtype_is_converted_to_mode_2(self):
         mode = utils.mode_from_dtype(np.dtype(np.float32))
@@ -102,9 +112,9 @@ class UtilsTest(AssertRaisesRegexMixin, unittest.TestCase):
         with self.assertRaises(ValueError):
             utils.mode_from_dtype(np.dtype(np.int64))
     
-    def test_uint8_dtype_is_converted_to_mode_6(self):
+    def test_uint8_dtype_is_converted_to_mode_0(self):
         mode = utils.mode_from_dtype(np.dtype(np.uint8))
-        assert mode == 6
+        assert mode == 0
     
     def test_uint16_dtype_is_converted_to_mode_6(self):
         mode = utils.mode_from_dtype(np.dtype(np.uint16))
@@ -146,6 +156,368 @@ class UtilsTest(AssertRaisesRegexMixin, unittest.TestCase):
         with self.assertRaises(ValueError):
             utils.mode_from_dtype(np.dtype([('f1', np.int32)]))
     
+    def test_data_nbytes_from_header(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        header.nx, header.ny, header.nz, header.mz = 5, 4, 6, 3
+        header.mode = 1
+        header.ispg = 401
+        assert utils.data_nbytes_from_header(header) == 240
+        header.mode = 3
+        with self.assertRaises(ValueError):
+            utils.data_nbytes_from_header(header)
+    
+    def test_mode_0_header_with_imod_stamp_gives_uint8_dtype(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        assert utils.data_dtype_from_header(header) == np.int8
+        utils.set_header_byte_signedness(header, False)
+        assert utils.header_has_unsigned_bytes(header)
+        assert utils.data_dtype_from_header(header) == np.uint8
+        utils.set_header_byte_signedness(header, True)
+        assert not utils.header_has_unsigned_bytes(header)
+        assert utils.data_dtype_from_header(header) == np.int8
+    
+    def test_loaded_dtype_from_header(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        header.mode = 1
+        assert utils.loaded_dtype_from_header(header) == np.int16
+        utils.set_header_quantization(header, 0.5, 2.0)
+        assert utils.loaded_dtype_from_header(header) == np.float32
+        header = np.zeros(shape=(),
+                          dtype=HEADER_DTYPE.newbyteorder('>')).view(
+                              np.recarray)
+        header.mode = 1
+        utils.set_header_quantization(header, 0.5, 2.0)
+        assert utils.loaded_dtype_from_header(header) == np.dtype('>f4')
+        header.mode = 2
+        assert utils.loaded_dtype_from_header(header) == np.dtype('>f4')
+    
+    def test_imod_header_fields_use_header_byte_order(self):
+        for byte_order in ('<', '>'):
+            header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+            header.dtype = header.dtype.newbyteorder(byte_order)
+            utils.set_header_byte_signedness(header, False)
+            stamp = np.frombuffer(header.tobytes()[152:156],
+                                  dtype=byte_order + 'i4')[0]
+            assert stamp == 1146047817
+            assert utils.imod_header_fields(header).imod_stamp == stamp
+    
+    def test_signed_bytes_flag_is_not_added_without_imod_stamp(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        utils.set_header_byte_signedness(header, True)
+        assert header.tobytes() == np.zeros((), HEADER_DTYPE).tobytes()
+    
+    def test_extended_header_dtypes(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        assert utils.extended_header_dtype(header) is None
+        header.exttyp = b'FEI1'
+        assert utils.extended_header_dtype(header).itemsize == 768
+        header.exttyp = b'CCP4'
+        assert utils.extended_header_dtype(header) == np.dtype('S80')
+        header.exttyp = b'MRCO'
+        assert utils.extended_header_dtype(header) == np.dtype('S80')
+    
+    def test_fei1_dtype_is_padded_to_record_size(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        header.exttyp = b'FEI1'
+        ext = np.zeros(2 * 888, dtype='u1')
+        ext[:4] = np.array([888], dtype='<i4').view('u1')
+        dtype = utils.extended_header_dtype(header, ext.view('V1'))
+        assert dtype.itemsize == 888
+        assert dtype.fields['dose'][1] == 92
+    
+    def test_serialem_dtype_depends_on_flags(self):
+        for byte_order in ('<', '>'):
+            header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+            header.dtype = header.dtype.newbyteorder(byte_order)
+            header.exttyp = b'SERI'
+            assert utils.extended_header_dtype(header) is None
+            fields = utils.imod_header_fields(header)
+            # Tilt angle, stage position and magnification
+            fields.nint = 8
+            fields.nreal = 1 + 4 + 8
+            dtype = utils.extended_header_dtype(header)
+            assert dtype.names == ('tilt_angle', 'stage_position',
+                                   'magnification')
+            assert dtype.itemsize == 8
+            assert dtype['tilt_angle'].base == np.dtype(byte_order + 'i2')
+            # If the sizes do not match, nint and nreal count ints and reals
+            fields.nint = 2
+            fields.nreal = 3
+            dtype = utils.extended_header_dtype(header)
+            assert dtype.names == ('ints', 'reals')
+            assert dtype.itemsize == 20
+            assert dtype['reals'].base == np.dtype(byte_order + 'f4')
+    
+    def test_agar_dtype(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        header.exttyp = b'AGAR'
+        fields = utils.imod_header_fields(header)
+        fields.nint = 0
+        fields.nreal = 32
+        dtype = utils.extended_header_dtype(header)
+        assert dtype['reals'].shape == (32,)
+        assert dtype.itemsize == 128
+    
+    def test_extended_header_dtypes_can_be_registered(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        header.exttyp = b'TEST'
+        try:
+            utils.register_extended_header_dtype('TEST', [('value', 'f4')])
+            assert utils.extended_header_dtype(header).names == ('value',)
+            utils.register_extended_header_dtype(b'TEST',
+                                                 lambda hdr, ext: None)
+            assert utils.extended_header_dtype(header) is None
+        finally:
+            del utils._extended_header_dtypes[b'TEST']
+    
+    def test_data_nbytes_from_header_for_packed_4bit_data(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        header.nx, header.ny, header.nz, header.mz = 5, 4, 6, 1
+        header.mode = 101
+        # Each row of 5 values is packed into 3 bytes
+        assert utils.data_nbytes_from_header(header) == 72
+    
+    def test_block_slices(self):
+        slices = utils.block_slices((10, 3, 4), 2, max_bytes=100)
+        assert slices == [slice(0, 4), slice(4, 8), slice(8, 12)]
+        slices = utils.block_slices((2, 3, 4), 2, max_bytes=1)
+        assert slices == [slice(0, 1), slice(1, 2)]
+        assert utils.block_slices((0,), 1) == []
+        assert utils.block_slices((), 4) == [()]
+    
+    def test_pack_4bit_data_puts_first_value_in_low_bits(self):
+        data = np.array([[1, 2, 3, 4], [15, 0, 0, 15]], dtype=np.uint8)
+        packed = utils.pack_4bit_data(data)
+        assert packed.dtype == np.uint8
+        np.testing.assert_array_equal(packed, [[0x21, 0x43], [0x0F, 0xF0]])
+    
+    def test_pack_4bit_data_pads_odd_rows(self):
+        data = np.array([[1, 2, 3], [4, 5, 6]], dtype=np.uint8)
+        packed = utils.pack_4bit_data(data)
+        np.testing.assert_array_equal(packed, [[0x21, 0x03], [0x54, 0x06]])
+    
+    def test_unpack_4bit_data_reverses_packing(self):
+        data = np.arange(2 * 3 * 7, dtype=np.uint8).reshape(2, 3, 7) % 16
+        packed = utils.pack_4bit_data(data)
+        assert packed.shape == (2, 3, 4)
+        unpacked = utils.unpack_4bit_data(packed, 7)
+        assert unpacked.dtype == np.uint8
+        assert unpacked.flags.c_contiguous
+        np.testing.assert_array_equal(unpacked, data)
+    
+    def test_unpack_4bit_data_without_row_length(self):
+        unpacked = utils.unpack_4bit_data(np.array([0x21, 0xF0], np.uint8))
+        np.testing.assert_array_equal(unpacked, [1, 2, 0, 15])
+    
+    def test_check_4bit_data(self):
+        data = np.array([0, 15], dtype=np.int16)
+        assert utils.check_4bit_data(data) is data
+        with self.assertRaisesRegex(ValueError, "range 0 to 15"):
+            utils.check_4bit_data(np.array([0, 16], dtype=np.uint8))
+        with self.assertRaisesRegex(ValueError, "range 0 to 15"):
+            utils.check_4bit_data(np.array([-1, 3], dtype=np.int8))
+        with self.assertRaisesRegex(ValueError, "must be integers"):
+            utils.check_4bit_data(np.array([0.5], dtype=np.float32))
+    
+    def test_header_quantization_fields(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        header.mode = 1
+        assert utils.quantization_from_header(header) is None
+        utils.set_header_quantization(header, 0.5, -2.0)
+        assert utils.quantization_from_header(header) == (0.5, -2.0)
+        assert header.tobytes()[112:116] == b'QNT1'
+        # The quantisation is ignored in modes other than 0 and 1
+        header.mode = 2
+        assert utils.quantization_from_header(header) is None
+        header.mode = 1
+        utils.set_header_quantization(header, None)
+        assert utils.quantization_from_header(header) is None
+        assert header.extra2.tobytes() == bytes(bytearray(84))
+    
+    def test_tile_slices(self):
+        shape = (5, 8, 3)
+        covered = np.zeros(shape, dtype=int)
+        tiles = utils.tile_slices(shape, 4, max_bytes=40)
+        for tile in tiles:
+            assert covered[tile].size * 4 <= 40
+            covered[tile] += 1
+        np.testing.assert_array_equal(covered, 1)
+        # The longest axis is halved first, and tiles are roughly cubic
+        assert tiles[0] == (slice(0, 2), slice(0, 2), slice(0, 1))
+        assert utils.tile_slices(shape, 4) == [(slice(0, 5), slice(0, 8),
+                                                slice(0, 3))]
+        assert utils.tile_slices((2, 2), 8, max_bytes=1) == [
+            (slice(0, 1), slice(0, 1)), (slice(0, 1), slice(1, 2)),
+            (slice(1, 2), slice(0, 1)), (slice(1, 2), slice(1, 2))]
+    
+    def test_axis_order(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        with self.assertRaisesRegex(ValueError, "Invalid axis mapping"):
+            utils.axis_order_from_header(header)
+        utils.set_header_axis_order(header, 'ZXY')
+        assert (header.mapc, header.mapr, header.maps) == (3, 1, 2)
+        assert utils.axis_order_from_header(header) == 'zxy'
+        for order in ['xxz', 'xy', 123]:
+            with self.assertRaisesRegex(ValueError, "not a permutation"):
+                utils.set_header_axis_order(header, order)
+    
+    def test_transpose_axes(self):
+        data = np.zeros((2, 3, 4))
+        for from_order in ['xyz', 'zxy', 'yzx', 'zyx']:
+            axes = utils.transpose_axes(from_order, 'xyz', 3)
+            canonical = np.transpose(data, axes)
+            # Each axis's length must come from the matching stored axis
+            for position, letter in enumerate('zyx'):
+                stored_axis = 2 - from_order.index(letter)
+                assert canonical.shape[position] == data.shape[stored_axis]
+            # Transposing back gives the original order
+            back = utils.transpose_axes('xyz', from_order, 3)
+            assert np.transpose(canonical, back).shape == data.shape
+        assert utils.transpose_axes('zxy', 'xyz', 3) == (2, 0, 1)
+        assert utils.transpose_axes('zxy', 'xyz', 4) == (0, 3, 1, 2)
+        assert utils.transpose_axes('yxz', 'xyz', 2) == (1, 0)
+        with self.assertRaisesRegex(ValueError, "section axis of 2D data"):
+            utils.transpose_axes('zxy', 'xyz', 2)
+        with self.assertRaisesRegex(ValueError, "at least 2 dimensions"):
+            utils.transpose_axes('xyz', 'xyz', 1)
+    
+    def test_advise_memory(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b'\0' * 10000)
+            f.flush()
+            array = np.memmap(f, dtype=np.uint8, mode='r+')
+            assert not utils._memory_advice_supported('MADV_UNKNOWN')
+            assert not utils._advise_memory(array, 'MADV_UNKNOWN')
+            if utils._memory_advice_supported('MADV_WILLNEED'):
+                assert utils._advise_memory(array, 'MADV_WILLNEED')
+                assert utils._advise_memory(array[2000:], 'MADV_WILLNEED',
+                                            5000, 6000)
+                assert not utils._advise_memory(array, 'MADV_WILLNEED',
+                                                6000, 6000)
+            del array
+    
+    def test_advise_memory_rejects_arrays_which_are_not_mapped(self):
+        data = np.ones(10000, dtype=np.uint8)
+        with self.assertRaisesRegex(ValueError, "memory-mapped"):
+            utils._advise_memory(data, 'MADV_DONTNEED')
+        assert (data == 1).all()
+    
+    def test_header_extended_header_reserve_fields(self):
+        header = np.zeros(shape=(), dtype=HEADER_DTYPE).view(np.recarray)
+        assert utils.extended_header_reserve_from_header(header) == 0
+        utils.set_header_extended_header_size(header, 100, 400)
+        assert header.nsymbt == 500
+        assert utils.extended_header_reserve_from_header(header) == 400
+        assert header.tobytes()[132:136] == b'XRS1'
+        # An invalid used size is ignored
+        header.nsymbt = 50
+        assert utils.extended_header_reserve_from_header(header) == 0
+        utils.set_header_extended_header_size(header, 100)
+        assert header.nsymbt == 100
+        assert utils.extended_header_reserve_from_header(header) == 0
+        assert header.extra2.tobytes() == bytes(bytearray(84))
+        with self.assertRaisesRegex(ValueError, "cannot be negative"):
+            utils.set_header_extended_header_size(header, 100, -1)
+    
+    def test_quantization_params_cover_data_range(self):
+        data = np.linspace(-3.0, 7.0, 1000, dtype=np.float32)
+        scale, offset = utils.quantization_params([data[:300], data[300:]],
+                                                  np.int16)
+        assert offset == 2.0
+        assert scale * 32767 >= 5.0
+        assert scale == np.float32(scale)
+        quantized = utils.quantize_data(data, scale, offset, np.int16)
+        assert quantized.dtype == np.int16
+        assert quantized.min() == -32767
+        assert quantized.max() == 32767
+        restored = utils.dequantize_data(quantized, scale, offset)
+        assert restored.dtype == np.float32
+        assert np.abs(restored - data).max() <= scale / 2 + 1e-6
+    
+    def test_quantization_params_for_constant_data(self):
+        data = np.full((3, 4), 2.5, dtype=np.float32)
+        scale, offset = utils.quantization_params([data], np.int8)
+        quantized = utils.quantize_data(data, scale, offset, np.int8)
+        np.testing.assert_array_equal(
+            utils.dequantize_data(quantized, scale, offset), data)
+    
+    def test_quantization_error_bound(self):
+        data = np.linspace(0, 254, 100, dtype=np.float32)
+        scale, offset = utils.quantization_params([data], np.int8,
+                                                  error_bound=0.51)
+        assert scale == 1.0
+        with self.assertRaisesRegex(ValueError, "smallest possible error"):
+            utils.quantization_params([data], np.int8, error_bound=0.4)
+    
+    def test_quantization_of_non_finite_data_raises_exception(self):
+        data = np.array([0.0, np.nan, 1.0], dtype=np.float32)
+        with self.assertRaisesRegex(ValueError, "NaN or infinite"):
+            utils.quantization_params([data], np.int16)
+    
+    def test_dequantized_data_keeps_byte_order(self):
+        quantized = np.arange(4, dtype='>i2')
+        restored = utils.dequantize_data(quantized, 0.5, 1.0)
+        assert restored.dtype == np.dtype('>f4')
+        np.testing.assert_array_equal(restored, [1.0, 1.5, 2.0, 2.5])
+    
+    def test_bin_data(self):
+        data = np.arange(5 * 6 * 7, dtype=np.int16).reshape(5, 6, 7)
+        binned = utils.bin_data(data, (2, 3, 2))
+        assert binned.shape == (2, 2, 3)
+        assert binned[1, 0, 2] == data[2:4, 0:3, 4:6].mean()
+        np.testing.assert_array_equal(utils.bin_data(data, (1, 2, 2), 'max'),
+                                      data[:, 1:6:2, 1:6:2])
+        assert utils.bin_data(data, (5, 6, 7), 'sum')[0, 0, 0] == data.sum()
+        assert utils.bin_data(data, (1, 1, 8)).shape == (5, 6, 0)
+    
+    def test_bin_data_with_invalid_arguments(self):
+        data = np.zeros((4, 4))
+        with self.assertRaisesRegex(ValueError, "Unknown binning method"):
+            utils.bin_data(data, (2, 2), 'median')
+        with self.assertRaisesRegex(ValueError, "not valid"):
+            utils.bin_data(data, (2, 2, 2))
+        with self.assertRaisesRegex(ValueError, "not valid"):
+            utils.bin_data(data, (0, 2))
+    
+    def test_binned_dtype(self):
+        assert utils.binned_dtype(np.int8) == np.float32
+        assert utils.binned_dtype(np.uint16, 'sum') == np.float32
+        assert utils.binned_dtype(np.int16, 'max') == np.int16
+        assert utils.binned_dtype(np.complex64, 'mean') == np.complex64
+        with self.assertRaisesRegex(ValueError, "Unknown binning method"):
+            utils.binned_dtype(np.float32, 'mode')
+    
+    def test_stats_from_blocks_match_numpy(self):
+        data = np.random.normal(10.0, 3.0, size=(7, 5, 6)).astype(np.float32)
+        stats = utils.stats_from_blocks([data[:2], data[2:3], data[3:]])
+        assert stats[0] == data.min()
+        assert stats[1] == data.max()
+        assert stats[2].dtype == np.float32
+        assert stats[3].dtype == np.float32
+        assert np.isclose(stats[2], data.mean())
+        assert np.isclose(stats[3], data.std())
+    
+    def test_stats_from_integer_blocks_use_float64(self):
+        data = np.arange(-20000, 20000, 10, dtype=np.int16).reshape(40, 20, 5)
+        stats = utils.stats_from_blocks(data)
+        assert stats[0] == -20000
+        assert stats[1] == 19990
+        assert stats[2] == data.mean()
+        assert stats[3].dtype == np.float64
+        assert np.isclose(stats[3], data.std())
+    
+    def test_stats_from_complex_blocks(self):
+        data = (np.arange(12) + 1j * np.arange(12)[::-1]).astype(np.complex64)
+        stats = utils.stats_from_blocks([data[:5], data[5:]])
+        assert stats[2].dtype == np.complex64
+        assert stats[3].dtype == np.float32
+        assert np.isclose(stats[2], data.mean())
+        assert np.isclose(stats[3], data.std())
+    
+    def test_stats_from_empty_blocks(self):
+        assert utils.stats_from_blocks([]) is None
+        assert utils.stats_from_blocks([np.zeros(0)]) is None
+    
     def test_little_endian_machine_stamp(self):
         machst = utils.machine_stamp_from_byte_order('<')
         assert machst == bytearray((0x44, 0x44, 0x00, 0x00))
@@ -19,6 +19,7 @@ import warnings
 import numpy as np
 
 import mrcfile
+import mrcfile.utils as utils
 from . import helpers
 
 
@@ -58,6 +59,53 @@ class ValidationTest(helpers.AssertRaisesRegexMixin, unittest.TestCase):
         print_output = self.print_stream.getvalue()
         assert len(print_output) == 0
     
+    def test_good_float16_file(self):
+        data = np.linspace(-100, 100, 60, dtype=np.float16).reshape(3, 4, 5)
+        with mrcfile.new(self.temp_mrc_name) as mrc:
+            mrc.set_data(data)
+            mrc.voxel_size = 2.3
+        for quick in (False, True):
+            result = mrcfile.validate(self.temp_mrc_name, self.print_stream,
+                                      quick=quick)
+            assert result == True
+        assert len(self.print_stream.getvalue()) == 0
+    
+    def test_good_uint8_files(self):
+        data = np.arange(200, 260, dtype=np.int32).astype(np.uint8)
+        data = data.reshape(3, 4, 5)
+        for compression in (None, 'gzip', 'bzip2'):
+            with mrcfile.new(self.temp_mrc_name, overwrite=True,
+                             compression=compression) as mrc:
+                mrc.set_data(data)
+                mrc.voxel_size = 2.3
+            result = mrcfile.validate(self.temp_mrc_name, self.print_stream)
+            assert result == True
+        assert len(self.print_stream.getvalue()) == 0
+    
+    def test_uint8_file_with_signed_stats_is_invalid(self):
+        data = np.array([[0, 128], [200, 255]], dtype=np.uint8)
+        with mrcfile.new(self.temp_mrc_name) as mrc:
+            mrc.set_data(data)
+            mrc.voxel_size = 2.3
+            # Mark the data as signed, so the header stats are now wrong
+            utils.set_header_byte_signedness(mrc.header, True)
+        result = mrcfile.validate(self.temp_mrc_name, self.print_stream)
+        assert result == False
+        assert "minimum is" in self.print_stream.getvalue()
+    
+    def test_good_quantized_files(self):
+        data = np.random.normal(5.0, 2.0, size=(6, 8, 8)).astype(np.float32)
+        for compression in (None, 'gzip'):
+            with mrcfile.new(self.temp_mrc_name, overwrite=True,
+                             compression=compression) as mrc:
+                mrc.set_data(data, quantize='int16')
+                mrc.voxel_size = 2.3
+            for quick in (False, True):
+                result = mrcfile.validate(self.temp_mrc_name,
+                                          self.print_stream, quick=quick)
+                assert result == True
+        assert len(self.print_stream.getvalue()) == 0
+    
     def test_emdb_file(self):
         result = mrcfile.validate(self.example_mrc_name, self.print_stream)
         assert result == False
@@ -375,6 +423,133 @@ class ValidationTest(helpers.AssertRaisesRegexMixin, unittest.TestCase):
                                   print_file=self.print_stream)
         assert result == True
     
+    def create_large_temp_mrc(self):
+        data = np.random.normal(5.0, 2.0, size=(200, 8, 8)).astype(np.float32)
+        with mrcfile.new(self.temp_mrc_name) as mrc:
+            mrc.set_data(data)
+            mrc.header.nversion = 20140
+        return data
+    
+    def test_quick_good_file(self):
+        self.create_large_temp_mrc()
+        result = mrcfile.validate(self.temp_mrc_name, self.print_stream,
+                                  quick=True)
+        assert result == True
+        assert len(self.print_stream.getvalue()) == 0
+    
+    def test_quick_emdb_file(self):
+        for name in (self.example_mrc_name, self.gzip_mrc_name,
+                     self.bzip2_mrc_name):
+            result = mrcfile.validate(name, self.print_stream, quick=True)
+            assert result == False
+        print_output = self.print_stream.getvalue()
+        assert print_output.strip().split('\n') == ["File does not declare MRC "
+                                                    "format version 20140: "
+                                                    "nversion = 0"] * 3
+    
+    def test_quick_incorrect_dmax(self):
+        data = self.create_large_temp_mrc()
+        with mrcfile.open(self.temp_mrc_name, mode='r+') as mrc:
+            mrc.header.dmax = data.min() + 0.5
+        result = mrcfile.validate(self.temp_mrc_name,
+                                  print_file=self.print_stream, quick=True)
+        assert result == False
+        print_output = self.print_stream.getvalue()
+        assert "Error in data statistics: maximum is at least" in print_output
+    
+    def test_quick_incorrect_mean_and_rms(self):
+        self.create_large_temp_mrc()
+        with mrcfile.open(self.temp_mrc_name, mode='r+') as mrc:
+            mrc.header.dmean = 7.0
+            mrc.header.rms = 5.0
+        result = mrcfile.validate(self.temp_mrc_name,
+                                  print_file=self.print_stream, quick=True)
+        assert result == False
+        print_output = self.print_stream.getvalue()
+        assert "mean is estimated as" in print_output
+        assert "RMS deviation is estimated as" in print_output
+    
+    def test_quick_file_too_small(self):
+        with mrcfile.new(self.temp_mrc_name) as mrc:
+            mrc.set_data(np.arange(12, dtype=np.float32).reshape(1, 3, 4))
+            mrc.header.nz = 2
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            result = mrcfile.validate(self.temp_mrc_name,
+                                      print_file=self.print_stream, quick=True)
+            assert result == False
+            assert "data block" in self.print_stream.getvalue().lower()
+            assert len(w) == 1
+            assert "data block" in str(w[0].message)
+    
+    def test_sample_fraction_and_count(self):
+        self.create_large_temp_mrc()
+        with mrcfile.mmap(self.temp_mrc_name) as mrc:
+            assert mrc.validate(print_file=self.print_stream, sample=0.1)
+            assert mrc.validate(print_file=self.print_stream, sample=5)
+            # Samples including every section fall back to exact checks
+            assert mrc.validate(print_file=self.print_stream, sample=500)
+        assert len(self.print_stream.getvalue()) == 0
+    
+    def test_sampled_sections_are_repeatable(self):
+        from mrcfile.mrcobject import SAMPLED_STATS_SEED
+        self.create_large_temp_mrc()
+        global_state = np.random.get_state()
+        with mrcfile.mmap(self.temp_mrc_name) as mrc:
+            first = mrc._choose_sample_sections(20)
+            second = mrc._choose_sample_sections(20)
+            n_sections = mrc._section_count()
+        expected = np.sort(np.random.RandomState(SAMPLED_STATS_SEED).choice(
+            n_sections, 20, replace=False))
+        np.testing.assert_array_equal(first, expected)
+        np.testing.assert_array_equal(second, expected)
+        # The global random state is not used
+        assert np.random.get_state()[1].tolist() == global_state[1].tolist()
+        assert np.random.get_state()[2] == global_state[2]
+    
+    def test_small_samples_allow_wider_bounds(self):
+        from mrcfile.mrcobject import (_sampled_stats_critical_value,
+                                       SAMPLED_STATS_Z_SCORE)
+        assert _sampled_stats_critical_value(4) == 15.54
+        assert 4.84 < _sampled_stats_critical_value(19) < 4.97
+        values = [_sampled_stats_critical_value(dof)
+                  for dof in (1, 2, 5, 10, 50, 500, 5000)]
+        assert values == sorted(values, reverse=True)
+        assert values[-1] > SAMPLED_STATS_Z_SCORE
+    
+    def test_invalid_sample_raises_exception(self):
+        self.create_large_temp_mrc()
+        with mrcfile.open(self.temp_mrc_name) as mrc:
+            with self.assertRaisesRegex(ValueError, "Sample must be"):
+                mrc.validate(sample=0)
+    
+    def test_compressed_file_stats_are_checked(self):
+        data = np.arange(-10, 20, dtype=np.float32).reshape(2, 3, 5)
+        for compression in ('gzip', 'bzip2'):
+            with mrcfile.new(self.temp_mrc_name, compression=compression,
+                             overwrite=True) as mrc:
+                mrc.set_data(data)
+                mrc.header.dmax = 15
+            result = mrcfile.validate(self.temp_mrc_name,
+                                      print_file=self.print_stream)
+            assert result == False
+        print_output = self.print_stream.getvalue()
+        assert print_output.count("Error in data statistics: maximum is {0} "
+                                  "but the value in the header is 15"
+                                  .format(data.max())) == 2
+    
+    def test_compressed_file_too_small(self):
+        with mrcfile.new(self.temp_mrc_name, compression='gzip') as mrc:
+            mrc.set_data(np.arange(12, dtype=np.float32).reshape(1, 3, 4))
+            mrc.header.nz = 2
+        result = mrcfile.validate(self.temp_mrc_name,
+                                  print_file=self.print_stream)
+        assert result == False
+        print_output = self.print_stream.getvalue()
+        assert ("Data block could not be read: Expected 96 bytes in data block "
+                "but could only read 48" in print_output)
+        assert "File is smaller than expected" in print_output
+    
     def test_many_problems_simultaneously(self):
         data = np.arange(-10, 20, dtype=np.float32).reshape(3, 2, 5)
         with mrcfile.new(self.temp_mrc_name) as mrc:
@@ -0,0 +1,119 @@
+# Copyright (c) 2016, Science and Technology Facilities Council
+# This software is distributed under a BSD licence. See LICENSE.txt.
+
+"""
+Tests for virtualstack.py
+"""
+
+# Import Python 3 features for future-proofing
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import mrcfile
+from mrcfile.virtualstack import VirtualStack
+from . import helpers
+
+
+class VirtualStackTest(helpers.AssertRaisesRegexMixin, unittest.TestCase):
+    
+    """Unit tests for virtual stacks of MRC files.
+    
+    """
+    
+    def setUp(self):
+        super(VirtualStackTest, self).setUp()
+        
+        # Set up test files and names to be used
+        self.test_output = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        if os.path.exists(self.test_output):
+            shutil.rmtree(self.test_output)
+        super(VirtualStackTest, self).tearDown()
+    
+    def write_files(self, arrays, compression=None):
+        names = []
+        for number, array in enumerate(arrays):
+            name = os.path.join(self.test_output, '{0}.mrc'.format(number))
+            mrcfile.new(name, array, compression=compression).close()
+            names.append(name)
+        return names
+    
+    def test_stack_along_new_axis(self):
+        arrays = [np.full((3, 4), number, dtype=np.float32)
+                  + np.arange(4, dtype=np.float32)
+                  for number in range(5)]
+        names = self.write_files(arrays)
+        expected = np.stack(arrays)
+        with mrcfile.VirtualStack(names) as stack:
+            assert stack.shape == (5, 3, 4)
+            assert stack.dtype == np.float32
+            for key in [2, (slice(1, 4), 2), (Ellipsis, 3),
+                        (slice(None, None, -2), slice(1, 3)), (4, 2, 3),
+                        slice(3, 3)]:
+                np.testing.assert_array_equal(stack[key], expected[key])
+            np.testing.assert_array_equal(np.asarray(stack), expected)
+            assert stack.locate(-1) == (names[4], None)
+            with self.assertRaises(IndexError):
+                stack.locate(5)
+            with self.assertRaises(ValueError):
+                stack[0] = 1
+            assert not stack.flags.writeable
+    
+    def test_concatenate_sections(self):
+        arrays = [np.arange(2 * 3 * 4, dtype=np.int16).reshape(2, 3, 4),
+                  np.full((3, 4), -1, dtype=np.int16),
+                  np.arange(3 * 3 * 4, dtype=np.int16).reshape(3, 3, 4) * 2]
+        names = self.write_files(arrays, compression='gzip')
+        expected = np.concatenate([arrays[0], arrays[1][np.newaxis],
+                                   arrays[2]])
+        with VirtualStack(names, new_axis=False) as stack:
+            assert stack.shape == (6, 3, 4)
+            np.testing.assert_array_equal(stack[1:5, 2], expected[1:5, 2])
+            np.testing.assert_array_equal(stack[...], expected)
+            assert stack.locate(1) == (names[0], 1)
+            assert stack.locate(2) == (names[1], None)
+            assert stack.locate(5) == (names[2], 2)
+    
+    def test_open_files_are_limited(self):
+        arrays = [np.full((2, 2), number, dtype=np.int8)
+                  for number in range(6)]
+        names = self.write_files(arrays)
+        stack = VirtualStack(names, max_open=2)
+        assert not stack._open_files
+        stack[0]
+        stack[4:6]
+        assert list(stack._open_files) == [4, 5]
+        assert stack[4:0:-3, 0, 0].tolist() == [4, 1]
+        assert list(stack._open_files) == [4, 1]
+        opened = list(stack._open_files.values())
+        stack.close()
+        assert not stack._open_files
+        assert all(mrc.header is None for mrc in opened)
+    
+    def test_files_which_cannot_be_stacked(self):
+        with self.assertRaisesRegex(ValueError, "No files"):
+            VirtualStack([])
+        names = self.write_files([np.zeros((2, 3), np.int8),
+                                  np.zeros((3, 2), np.int8),
+                                  np.zeros((2, 3), np.int16),
+                                  np.zeros((1, 2, 2, 3), np.int8)])
+        with self.assertRaisesRegex(ValueError, "items of shape"):
+            VirtualStack(names[:2])
+        with self.assertRaisesRegex(ValueError, "dtype"):
+            VirtualStack([names[0], names[2]])
+        with self.assertRaisesRegex(ValueError, "only 2D and 3D"):
+            VirtualStack([names[0], names[3]], new_axis=False)
+        with self.assertRaisesRegex(ValueError, "kept open"):
+            VirtualStack(names[:1], max_open=0)
+
+
+if __name__ == '__main__':
+    unittest.main()